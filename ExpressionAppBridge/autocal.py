@@ -0,0 +1,170 @@
+'''
+autocal.py
+
+Automatic calibration proposals from live tracking.
+
+Every blendshape gets streaming estimators for a low and a high percentile of its raw input.
+Estimators use the P-Square algorithm (Jain and Chlamtac, 1985): five markers per percentile,
+constant memory, no samples stored. All of them are updated together as one vectorized array.
+
+The proposed calibration maps the low to high percentile range of each blendshape to 0 to 100
+with an interpolation entry.
+'''
+import json
+import numpy as np
+from .tracking_data import BLENDSHAPE_COUNT, BLENDSHAPE_INDEX, PERFECT_SYNC_BLENDSHAPES
+
+# Percentiles mapped to 0 and 100. In percent
+AUTOCAL_LOW = 2
+AUTOCAL_HIGH = 98
+
+# Samples needed before proposing a calibration
+AUTOCAL_MIN_SAMPLES = 300
+
+# Blendshapes moving less than this are left uncalibrated
+AUTOCAL_MIN_RANGE = 5
+
+# Only one frame out of this many is sampled. Ranges build up over minutes, so a few samples
+# per second are plenty and the cost per frame is divided by this much
+AUTOCAL_STRIDE = 4
+
+# Frames at or below this confidence are not sent by iFM, so they are not used either
+AUTOCAL_MIN_CONFIDENCE = 25
+
+# Marker rows adjusted together and the rows of their neighbours
+MARKERS_ODD, MARKERS_ODD_BELOW, MARKERS_ODD_ABOVE = slice(1, 4, 2), slice(0, 3, 2), slice(2, 5, 2)
+MARKER_MID, MARKER_MID_BELOW, MARKER_MID_ABOVE = slice(2, 3), slice(1, 2), slice(3, 4)
+
+class P2Quantiles:
+    """P-Square estimators for a set of independent streams. Each estimator tracks quantile p of
+    its stream. Every call to add takes one sample per estimator"""
+    def __init__(self, p):
+        p = np.asarray(p, dtype=float)
+        self.p = p
+        self.count = 0
+        self.init = np.zeros((5, len(p)))
+
+        # Marker heights, actual positions and desired positions. Positions start at 1
+        self.q = np.zeros((5, len(p)))
+        self.n = np.tile(np.arange(1, 6, dtype=float)[:, None], (1, len(p)))
+        self.desired = np.stack([np.ones_like(p), 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, np.full_like(p, 5)])
+        self.increment = np.stack([np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)])
+        self.marker = np.arange(5)[:, None]
+    def add(self, x):
+        """Add one sample per estimator"""
+        if self.count < 5:
+            # First samples are kept sorted as the initial markers
+            self.init[self.count] = x
+            self.count = self.count + 1
+            if self.count == 5:
+                self.q = np.sort(self.init, axis=0)
+            return
+        self.count = self.count + 1
+        q, n = self.q, self.n
+
+        # Cell the sample falls in. Extend the outer markers if needed
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])
+
+        # Markers above the cell move up one position
+        n += self.marker > k
+        self.desired += self.increment
+
+        # Move the middle markers toward their desired positions. Markers 1 and 3 are not
+        # neighbours, so they can move together before marker 2
+        self.adjust(MARKERS_ODD, MARKERS_ODD_BELOW, MARKERS_ODD_ABOVE)
+        self.adjust(MARKER_MID, MARKER_MID_BELOW, MARKER_MID_ABOVE)
+    def adjust(self, mid, lo, hi):
+        """Move the markers on rows mid one position toward their desired positions if needed.
+        lo and hi are the rows of their neighbours"""
+        q, n = self.q, self.n
+        d = self.desired[mid] - n[mid]
+        gap_hi = n[hi] - n[mid]
+        gap_lo = n[mid] - n[lo]
+        up = (d >= 1) & (gap_hi > 1)
+        down = (d <= -1) & (gap_lo > 1)
+        if not (up.any() or down.any()):
+            return
+        step = up.astype(float) - down
+
+        # Piecewise parabolic prediction. Fall back to linear if it breaks the ordering
+        slope_hi = (q[hi] - q[mid]) / gap_hi
+        slope_lo = (q[mid] - q[lo]) / gap_lo
+        parabolic = q[mid] + step / (gap_hi + gap_lo) * ((gap_lo + step) * slope_hi + (gap_hi - step) * slope_lo)
+        linear = q[mid] + step * np.where(up, slope_hi, slope_lo)
+        ordered = (q[lo] < parabolic) & (parabolic < q[hi])
+        q[mid] = np.where(ordered, parabolic, linear)
+        n[mid] += step
+    def quantiles(self):
+        """Current estimates. Exact over the samples seen while fewer than 5"""
+        if self.count == 0:
+            return np.zeros(len(self.p))
+        if self.count < 5:
+            samples = np.sort(self.init[:self.count], axis=0)
+            idx = np.rint(self.p * (self.count - 1)).astype(int)
+            return samples[idx, np.arange(len(self.p))]
+        return self.q[2].copy()
+
+class AutoCal:
+    """Track the low and high percentiles of every blendshape and propose a calibration"""
+    def __init__(self, low=AUTOCAL_LOW, high=AUTOCAL_HIGH, stride=AUTOCAL_STRIDE):
+        # Low estimators first, then high ones
+        p = np.concatenate([np.full(BLENDSHAPE_COUNT, low / 100), np.full(BLENDSHAPE_COUNT, high / 100)])
+        self.estimators = P2Quantiles(p)
+        self.sample = np.zeros(2 * BLENDSHAPE_COUNT)
+        self.stride = stride
+        self.skip = 0
+    @property
+    def samples(self):
+        return self.estimators.count
+    def update(self, blendshape_values, confidence):
+        """Feed the raw blendshapes of a frame"""
+        if confidence <= AUTOCAL_MIN_CONFIDENCE:
+            return
+        if self.skip > 0:
+            self.skip = self.skip - 1
+            return
+        self.skip = self.stride - 1
+        self.sample[:BLENDSHAPE_COUNT] = blendshape_values
+        self.sample[BLENDSHAPE_COUNT:] = blendshape_values
+        self.estimators.add(self.sample)
+    def ranges(self):
+        """Low and high percentile of every blendshape"""
+        q = self.estimators.quantiles()
+        return q[:BLENDSHAPE_COUNT], q[BLENDSHAPE_COUNT:]
+    def proposal(self, min_range=AUTOCAL_MIN_RANGE):
+        """Interpolation entries for the blendshapes that moved enough. Only blendshapes that take cal entries are proposed"""
+        low, high = self.ranges()
+        entries = {}
+        for k in PERFECT_SYNC_BLENDSHAPES:
+            i = BLENDSHAPE_INDEX[k]
+            lo, hi = round(float(low[i])), round(float(high[i]))
+            if hi - lo < min_range:
+                continue
+            entries[k] = {
+                "type": "interpolation",
+                "minIn": lo,
+                "maxIn": hi,
+                "minOut": 0,
+                "maxOut": 100
+            }
+        return entries
+    def candidate(self, config):
+        """Copy of config with the proposed blendshape entries"""
+        candidate = json.loads(json.dumps(config))
+        candidate['blendshapes'] = self.proposal()
+        return candidate
+    def write(self, config, filepath):
+        """Write the candidate calibration. False if there are not enough samples yet"""
+        if self.samples < AUTOCAL_MIN_SAMPLES:
+            return False
+        with open(filepath, "w") as f:
+            json.dump(self.candidate(config), f, indent=2)
+        return True
+
+def candidatePath(cal_filepath):
+    ''' Where the candidate for a cal file is written. config/x_cal.json -> config/x_cal.autocal.json '''
+    if cal_filepath.endswith('.json'):
+        return cal_filepath[:-5] + '.autocal.json'
+    return cal_filepath + '.autocal.json'
@@ -1,11 +1,15 @@
-import json, os, time
+import json, math, time
+import numpy as np
+from .autocal import AutoCal, candidatePath
+from .config_utils import debug_settings
+from .debug_log import DebugLogger
+from .file_watcher import FileWatcher
+from .filters import CHANNEL_COUNT, DEFAULT_WINDOW_SIZE, DEGREES, FilterBank, cleanFilters, filterSpec
+from .tracking_data import BLENDSHAPE_COUNT, BLENDSHAPE_INDEX, BLENDSHAPE_NAMES, PERFECT_SYNC_BLENDSHAPES
 
-# Cal file check time. In seconds.
+# Cal file check time when polling. In seconds.
 CAL_CHECK_PERIOD = 5
 
-# Debug list
-debug_entries = []
-
 # Global default cal object
 DEFAULT_CAL = {
     "eyes": {
@@ -21,65 +25,18 @@ DEFAULT_CAL = {
     "blendshapes": {}
 }
 
-# List of valid blendshapes. These line up with the ones listed on the ExpressionApp
-PERFECT_SYNC_BLENDSHAPES = [
-    "browDown_L",         # 0
-    "browDown_R",         # 1
-    "browInnerUp",        # 2 browInnerUp_L
-    "browInnerUp",        # 3 browInnerUp_R - Average both
-    "browOuterUp_L",      # 4
-    "browOuterUp_R",      # 5
-    "cheekPuff",          # 6 - cheekPuff_L
-    "cheekPuff",          # 7 - cheekPuff_R - Average both
-    "cheekSquint_L",      # 8
-    "cheekSquint_R",      # 9
-    "eyeBlink_L",         # 10
-    "eyeBlink_R",         # 11
-    "eyeLookDown_L",      # 12
-    "eyeLookDown_R",      # 13
-    "eyeLookIn_L",        # 14
-    "eyeLookIn_R",        # 15
-    "eyeLookOut_L",       # 16
-    "eyeLookOut_R",       # 17
-    "eyeLookUp_L",        # 18
-    "eyeLookUp_R",        # 19
-    "eyeSquint_L",        # 20
-    "eyeSquint_R",        # 21
-    "eyeWide_L",          # 22
-    "eyeWide_R",          # 23
-    "jawForward",         # 24
-    "jawLeft",            # 25
-    "jawOpen",            # 26
-    "jawRight",           # 27
-    "mouthClose",         # 28
-    "mouthDimple_L",      # 29
-    "mouthDimple_R",      # 30
-    "mouthFrown_L",       # 31
-    "mouthFrown_R",       # 32
-    "mouthFunnel",        # 33
-    "mouthLeft",          # 34
-    "mouthLowerDown_L",   # 35
-    "mouthLowerDown_R",   # 36
-    "mouthPress_L",       # 37
-    "mouthPress_R",       # 38
-    "mouthPucker",        # 39
-    "mouthRight",         # 40
-    "mouthRollLower",     # 41
-    "mouthRollUpper",     # 42
-    "mouthShrugLower",    # 43
-    "mouthShrugUpper",    # 44
-    "mouthSmile_L",       # 45
-    "mouthSmile_R",       # 46
-    "mouthStretch_L",     # 47
-    "mouthStretch_R",     # 48
-    "mouthUpperUp_L",     # 49
-    "mouthUpperUp_R",     # 50
-    "noseSneer_L",        # 51
-    "noseSneer_R"         # 52
-]
-
 # Valid calibration types
-CAL_TYPES = ['interpolation', 'outputSnap', 'simple']
+CAL_TYPES = ['interpolation', 'outputSnap', 'simple', 'curve']
+
+# Easing between curve points
+CURVE_SHAPES = ['linear', 'smoothstep', 'gamma']
+
+# Input step between curve lookup table entries
+CURVE_STEP = 0.1
+
+# Blendshape input range. Curve points and lookup tables stay inside it
+CURVE_MIN_INPUT = 0
+CURVE_MAX_INPUT = 100
 
 # A few error messages
 def printInterpolationUsage(key):
@@ -88,47 +45,315 @@ def printSimpleUsage(key):
     print(f"Missing config for \"{key}\" cal type simple. Required item is 'max'")
 def printOutputSnapUsage(key):
     print(f"Missing config for \"{key}\" cal type outputSnap. Required item is 'limit'")
+def printCurveUsage(key):
+    print(f"Missing config for \"{key}\" cal type curve. Required item is 'points'")
+
+def curveValues(config, x):
+    ''' Evaluate a curve cal entry at the inputs x. Inputs are clamped to the first and last points '''
+    points = np.array(config['points'], dtype=float)
+    xs, ys = points[:, 0], points[:, 1]
+    x = np.clip(np.asarray(x, dtype=float), xs[0], xs[-1])
+    
+    # Segment of every input and the position inside it
+    seg = np.clip(np.searchsorted(xs, x, side='right') - 1, 0, len(xs) - 2)
+    t = (x - xs[seg]) / (xs[seg + 1] - xs[seg])
+    shape = config.get('shape', 'linear')
+    if shape == 'smoothstep':
+        t = t * t * (3 - 2 * t)
+    elif shape == 'gamma':
+        t = t ** config.get('gamma', 1)
+    return ys[seg] + t * (ys[seg + 1] - ys[seg])
+
+def curveDomain(config):
+    ''' First and last input of a curve lookup table. The curve points clamped to the input range '''
+    first = min(max(config['points'][0][0], CURVE_MIN_INPUT), CURVE_MAX_INPUT)
+    last = min(max(config['points'][-1][0], CURVE_MIN_INPUT), CURVE_MAX_INPUT)
+    return first, last
+
+def curveTable(config, step=CURVE_STEP):
+    ''' Lookup table for a curve cal entry. Entry n is the output for input first + n * step, see curveDomain '''
+    first, last = curveDomain(config)
+    size = int(round((last - first) / step)) + 1
+    return curveValues(config, first + np.arange(size) * step)
+
+# Blendshape slots used for eye rotation. Left eye is Out - In, right eye is In - Out
+EYE_POSITIVE = np.array([BLENDSHAPE_INDEX['eyeLookOut_L'], BLENDSHAPE_INDEX['eyeLookIn_R']])
+EYE_NEGATIVE = np.array([BLENDSHAPE_INDEX['eyeLookIn_L'], BLENDSHAPE_INDEX['eyeLookOut_R']])
+
+class CompiledCal:
+    """A cleaned calibration config compiled into per-slot arrays.
+    
+    Every blendshape goes through out = ((clamp(x) - sub) / div) * mul + add, then snaps to 100
+    if x is above snap. Parameters reproduce the doCal formulas operation by operation, so results
+    are bit identical. Uncalibrated slots get identity parameters and are left untouched."""
+    def __init__(self, config):
+        self.config = config
+        n = BLENDSHAPE_COUNT
+        self.low = np.full(n, -np.inf)
+        self.high = np.full(n, np.inf)
+        self.sub = np.zeros(n)
+        self.div = np.ones(n)
+        self.mul = np.ones(n)
+        self.add = np.zeros(n)
+        self.snap = np.full(n, np.inf)
+        self.mask = np.zeros(n, dtype=bool)
+        
+        for k, i in config.get('blendshapes', {}).items():
+            idx = BLENDSHAPE_INDEX[k]
+            self.mask[idx] = True
+            if i['type'] == 'interpolation':
+                # ((maxOut - minOut)/(maxIn - minIn) * (Xin - minIn)) + minOut
+                self.low[idx] = i['minIn']
+                self.high[idx] = i['maxIn']
+                self.sub[idx] = i['minIn']
+                self.mul[idx] = (i['maxOut'] - i['minOut'])/(i['maxIn'] - i['minIn'])
+                self.add[idx] = i['minOut']
+            elif i['type'] == 'simple':
+                # (Xin / max) * 100
+                self.high[idx] = i['max']
+                self.div[idx] = i['max']
+                self.mul[idx] = 100
+            elif i['type'] == 'outputSnap':
+                self.snap[idx] = i['limit']
+        
+        # Curves go through lookup tables. Tables are padded with their last entry to a common size
+        curves = [(BLENDSHAPE_INDEX[k], i) for k, i in config.get('blendshapes', {}).items() if i['type'] == 'curve']
+        self.curve_slots = np.array([idx for idx, _ in curves], dtype=int)
+        tables = [curveTable(i) for _, i in curves]
+        size = max([len(t) for t in tables], default=1)
+        self.curve_table = np.array([np.pad(t, (0, size - len(t)), mode='edge') for t in tables]).reshape(-1)
+        domains = [curveDomain(i) for _, i in curves]
+        self.curve_first = np.array([first for first, _ in domains], dtype=float)
+        self.curve_last = np.array([last for _, last in domains], dtype=float)
+        self.curve_row = np.arange(len(curves)) * size
+        
+        # Calibrated slots, for debug output
+        self.slots = np.flatnonzero(self.mask)
+        
+        # Per channel smoothing filters
+        self.filters = filterSpec(config.get('filters', {}))
+        
+        # Eye rotation. Left then right
+        eyes = config['eyes']
+        self.eye_full_scale = np.array([eyes['left']['fullScale'], eyes['right']['fullScale']], dtype=float)
+        self.eye_max_rotation = np.array([eyes['left']['maxRotation'], eyes['right']['maxRotation']], dtype=float)
+        
+        # Scratch buffers for per frame use
+        self.scratch = np.zeros(n)
+        self.snapped = np.zeros(n, dtype=bool)
+        self.eye_scratch = np.zeros(2)
+    def calibrate(self, values, out, snapped=None):
+        """Unrounded calibration output for every slot of values. Works on any shape ending in the blendshape slots"""
+        snapped = np.greater(values, self.snap, out=snapped)
+        np.maximum(values, self.low, out=out)
+        np.minimum(out, self.high, out=out)
+        np.subtract(out, self.sub, out=out)
+        np.divide(out, self.div, out=out)
+        np.multiply(out, self.mul, out=out)
+        np.add(out, self.add, out=out)
+        np.copyto(out, 100, where=snapped)
+        if len(self.curve_slots):
+            out[..., self.curve_slots] = self.curves(np.take(values, self.curve_slots, axis=-1))
+        return out
+    def curves(self, x):
+        """Curve outputs for the inputs on the curve slots, by table lookup. x is modified"""
+        # NaN would turn into an invalid index. Read it as 0
+        np.nan_to_num(x, copy=False, nan=0)
+        np.maximum(x, self.curve_first, out=x)
+        np.minimum(x, self.curve_last, out=x)
+        np.subtract(x, self.curve_first, out=x)
+        np.multiply(x, 1 / CURVE_STEP, out=x)
+        np.rint(x, out=x)
+        idx = x.astype(np.intp)
+        np.add(idx, self.curve_row, out=idx)
+        return np.take(self.curve_table, idx)
+    def apply(self, values):
+        """Calibrate values in place. Calibrated slots are rounded to integers"""
+        if values.shape == self.scratch.shape:
+            self.calibrate(values, self.scratch, self.snapped)
+            out = self.scratch
+        else:
+            out = self.calibrate(values, np.empty_like(values))
+        np.rint(out, out=out)
+        np.copyto(values, out, where=self.mask)
+        return values
+    def eyes(self, blendshape_values):
+        """Left and right eye Y rotation in degrees from the eyeLook blendshapes"""
+        raw = self.eye_scratch
+        np.subtract(blendshape_values[EYE_POSITIVE], blendshape_values[EYE_NEGATIVE], out=raw)
+        
+        # Cap raw value to the fullScale setting. Keep the sign
+        np.minimum(raw, self.eye_full_scale, out=raw)
+        np.maximum(raw, -self.eye_full_scale, out=raw)
+        np.divide(raw, self.eye_full_scale, out=raw)
+        np.multiply(raw, self.eye_max_rotation, out=raw)
+        return raw
 
-DEFAULT_WINDOW_SIZE = 5
+# Numeric parameters for each cal type
+CAL_PARAMS = {
+    'interpolation': ['minIn', 'maxIn', 'minOut', 'maxOut'],
+    'outputSnap': ['limit'],
+    'simple': ['max'],
+    'curve': []
+}
+
+def validCalParams(config):
+    ''' Check the parameters of a cal entry that has every required key '''
+    for arg in CAL_PARAMS[config['type']]:
+        if type(config[arg]) not in [int, float]:
+            return False
+    if config['type'] == 'interpolation' and config['maxIn'] == config['minIn']:
+        return False
+    if config['type'] == 'simple' and config['max'] == 0:
+        return False
+    if config['type'] == 'curve':
+        return validCurve(config)
+    return True
+
+def validCurve(config):
+    ''' Check the points and shape of a curve cal entry '''
+    points = config['points']
+    if type(points) is not list or len(points) < 2:
+        return False
+    for point in points:
+        if type(point) is not list or len(point) != 2 or any(type(v) not in [int, float] or not math.isfinite(v) for v in point):
+            return False
+        if point[0] < CURVE_MIN_INPUT or point[0] > CURVE_MAX_INPUT:
+            return False
+    if any(b[0] <= a[0] for a, b in zip(points, points[1:])):
+        return False
+    shape = config.get('shape', 'linear')
+    if shape not in CURVE_SHAPES:
+        return False
+    if shape == 'gamma' and (type(config.get('gamma')) not in [int, float] or config['gamma'] <= 0):
+        return False
+    return True
 
-# Rolling Average helper
-class RollingAvg:
-    def __init__(self, size=DEFAULT_WINDOW_SIZE):
-        self.data = [None for x in range(size)]
-        self.idx = 0
-        self.size = size
-    def input(self, number):
-        self.data[self.idx] = number
-        self.idx = self.idx + 1
-        if self.idx >= self.size:
-            self.idx = 0
-    def avg(self):
-        if self.size == 1:
-            return self.data[0]
-        out = 0
-        for i in self.data:
-            if i is None:
+def cleanConfig(config, default_cal=DEFAULT_CAL):
+    ''' Check for the calibration entries. Remove invalid ones. The config is modified in place and returned '''
+    # Check for eye callib, replace with default values if needed
+    try:
+        entry = config['eyes']['left']['maxRotation']
+        entry = config['eyes']['left']['fullScale']
+        entry = config['eyes']['right']['maxRotation']
+        entry = config['eyes']['right']['fullScale']
+    except (KeyError, TypeError):
+        config['eyes'] = default_cal['eyes']
+        print("Reset eye cal to default")
+    
+    # Check the smoothing filters. Missing or invalid ones fall back to the defaults
+    filters = config.get('filters')
+    if filters is not None:
+        if type(filters) is dict:
+            cleanFilters(filters)
+        else:
+            print("Reset filters to default")
+            config.pop('filters')
+    
+    # Get blendshape entry
+    bs_cal = config.get('blendshapes')
+    
+    # Exit if 'blendshape' is missing
+    if bs_cal is None:
+        return config
+    
+    # Remove 'blendshapes' if it is not a dict
+    if type(bs_cal) is not dict:
+        config.pop('blendshapes')
+        return config
+    
+    # Iterate on a dict clone
+    for k, i in dict(bs_cal).items():
+        # Check if k is on the list
+        if k not in PERFECT_SYNC_BLENDSHAPES:
+            print(f"\"{k}\" is not a valid Perfect Sync blendshape")
+            bs_cal.pop(k)
+            continue
+        
+        cal_type = i.get('type')
+        
+        # Check for cal type
+        if cal_type is None:
+            print(f"No cal type for \"{k}\"")
+            bs_cal.pop(k)
+            continue
+        if cal_type not in CAL_TYPES:
+            print(f"No valid type for \"{k}\"")
+            bs_cal.pop(k)
+            continue
+        
+        # Get the keys on the dict. Verify the parameters on it.
+        cal_keys = list(i.keys())
+        if cal_type == "interpolation":
+            for arg in ['minIn', 'maxIn', 'minOut', 'maxOut']:
+                if arg not in cal_keys:
+                    printInterpolationUsage(k)
+                    bs_cal.pop(k)
+                    break
+        elif cal_type == 'outputSnap':
+            if 'limit' not in cal_keys:
+                printOutputSnapUsage(k)
+                bs_cal.pop(k)
+                continue
+        elif cal_type == 'simple':
+            if 'max' not in cal_keys:
+                printSimpleUsage(k)
+                bs_cal.pop(k)
                 continue
-            out = out + i
-        return out/self.size
+        elif cal_type == 'curve':
+            if 'points' not in cal_keys:
+                printCurveUsage(k)
+                bs_cal.pop(k)
+                continue
+        
+        # Parameters must be numbers that do not lead to a division by zero
+        if k in bs_cal and not validCalParams(i):
+            print(f"Invalid parameters for \"{k}\"")
+            bs_cal.pop(k)
+    return config
 
 class TrackingInput:
-    def __init__(self, tracking_data, cal_filepath, default_cal=DEFAULT_CAL, rolling_avg_size=DEFAULT_WINDOW_SIZE):
+    def __init__(self, tracking_data, cal_filepath, default_cal=DEFAULT_CAL, rolling_avg_size=DEFAULT_WINDOW_SIZE, rotation_scale=DEGREES):
         # Internal tracking data
         self.tracking_data = tracking_data
         
-        # Head rotation and head position is averaged to reduce jitter
-        self.headrotavgs = [RollingAvg(), RollingAvg(), RollingAvg()]
-        self.headposavgs = [RollingAvg(), RollingAvg(), RollingAvg()]
+        # Degrees per unit of the head rotation angles, for the rotation filters
+        self.rotation_scale = rotation_scale
+        
+        # Callbacks run with every frame handed to input_tracking and its timestamp, before filters and calibration
+        self.input_hooks = []
+        
+        # Callbacks run with the calibration in use once a frame is filtered, before calibration
+        self.filtered_hooks = []
+        
+        # Callbacks run after every processed frame
+        self.listeners = []
         
         # Cal data
         self.cal_filepath = cal_filepath
         self.__default_cal = default_cal
-        self.cal_timestamp = None
-        self.cal_lastcheck = None
+        self.watcher = None
+        self.debug_log = None
+        self.autocal = None
+        self.recorders = []
+        
+        # perf_counter timestamp of the last frame
+        self.timestamp = 0
         self.loadCal()
         self.cleanCal()
+        self.compileCal()
+        
+        # Smoothing filter state. Rebuilt when a reload changes the filters
+        self.filter_bank = FilterBank(self.compiled.filters, rotation_scale)
         
+        # Debug output for the blendshapes selected with --debug-param
+        self.setDebug(debug_settings['debug_param'])
+        
+    def add_listener(self, callback):
+        ''' Register a callback to be called with no arguments after every processed frame '''
+        self.listeners.append(callback)
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
     def loadCal(self):
         ''' Load calibration file. Create if missing '''
         try:
@@ -138,163 +363,165 @@ class TrackingInput:
             self.config = self.__default_cal
             with open(self.cal_filepath, "w") as f:
                 json.dump(self.config, f, indent=2)
-        self.cal_timestamp = os.path.getmtime(self.cal_filepath)
-        self.cal_lastcheck = time.time()
-    def cleanCal(self):
-        ''' Check for the calibration entries. Remove invalid ones '''
-        # Check for eye callib, replace with default values if needed
+    def reloadCal(self):
+        ''' Load, clean and compile the cal file, then swap it in. Runs on the watcher thread '''
+        print("Config file changed, reloading")
         try:
-            entry = self.config['eyes']['left']['maxRotation']
-            entry = self.config['eyes']['left']['fullScale']
-            entry = self.config['eyes']['right']['maxRotation']
-            entry = self.config['eyes']['right']['fullScale']
-        except (KeyError, TypeError):
-            self.config['eyes'] = self.__default_cal['eyes']
-            print("Reset eye cal to default")
-        
-        # Get blendshape entry
-        bs_cal = self.config.get('blendshapes')
-        
-        # Exit if 'blendshape' is missing
-        if bs_cal is None:
+            with open(self.cal_filepath) as f:
+                config = json.load(f)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            # Keep the current config. The file could be half written
+            print(f"Could not load {self.cal_filepath}: {e}")
             return
-        
-        # Remove 'blendshapes' if it is not a dict
-        if type(bs_cal) is not dict:
-            self.config.pop('blendshapes')
+        try:
+            compiled = CompiledCal(cleanConfig(config, self.__default_cal))
+        except (AttributeError, TypeError, ValueError) as e:
+            print(f"Invalid config on {self.cal_filepath}: {e}")
             return
         
-        # Iterate on a dict clone
-        for k, i in dict(bs_cal).items():
-            # Check if k is on the list
-            if k not in PERFECT_SYNC_BLENDSHAPES:
-                print(f"\"{k}\" is not a valid Perfect Sync blendshape")
-                bs_cal.pop(k)
-            
-            cal_type = i.get('type')
-            
-            # Check for cal type
-            if cal_type is None:
-                print(f"No cal type for \"{k}\"")
-                bs_cal.pop(k)
-                continue
-            if cal_type not in CAL_TYPES:
-                print(f"No valid type for \"{k}\"")
-                bs_cal.pop(k)
-                continue
-            
-            # Get the keys on the dict. Verify the parameters on it.
-            cal_keys = list(i.keys())
-            if cal_type == "interpolation":
-                for arg in ['minIn', 'maxIn', 'minOut', 'maxOut']:
-                    if arg not in cal_keys:
-                        printInterpolationUsage(k)
-                        bs_cal.pop(k)
-                        continue
-            elif cal_type == 'outputSnap':
-                if 'limit' not in cal_keys:
-                    printOutputSnapUsage(k)
-                    bs_cal.pop(k)
-                    continue
-            elif cal_type == 'simple':
-                if 'max' not in cal_keys:
-                    printSimpleUsage(k)
-                    bs_cal.pop(k)
-                    continue
-    def eyeRotation(self):
+        # Single reference swap. The frame path only reads self.compiled
+        self.compiled = compiled
+        self.config = compiled.config
+    def start_watcher(self, poll_period=CAL_CHECK_PERIOD):
+        ''' Reload the cal file on changes from a background thread '''
+        self.watcher = FileWatcher(self.cal_filepath, self.reloadCal, poll_period)
+        self.watcher.start()
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+    def compileCal(self):
+        ''' Compile the cleaned config for the per frame calibration '''
+        self.compiled = CompiledCal(self.config)
+    def cleanCal(self):
+        ''' Check for the calibration entries. Remove invalid ones '''
+        cleanConfig(self.config, self.__default_cal)
+    def eyeRotation(self, compiled=None):
         """Calculate rotation values from stored blendshapes. Rotations are in degrees. No Up/Down rotation set."""
-        
-        # Left Eye parameters
-        leftEye = self.tracking_data.blendshapes['eyeLookOut_L'] - self.tracking_data.blendshapes['eyeLookIn_L']
-        leftEyeFullScale = self.config['eyes']['left']['fullScale']
-        leftEyeMaxRotation = self.config['eyes']['left']['maxRotation']
-        
-        # Cap raw value to the fullScale setting. Keep the sign
-        if leftEye > leftEyeFullScale:
-            leftEye = leftEyeFullScale
-        if leftEye < leftEyeFullScale * -1:
-            leftEye = leftEyeFullScale * -1
-        
-        # Set rotation for left eye
-        self.tracking_data.leftEye[1] = (leftEye / leftEyeFullScale) * leftEyeMaxRotation
-        
-        
-        # Right Eye parameters
-        rightEye = self.tracking_data.blendshapes['eyeLookIn_R'] - self.tracking_data.blendshapes['eyeLookOut_R']
-        rightEyeFullScale = self.config['eyes']['right']['fullScale']
-        rightEyeMaxRotation = self.config['eyes']['right']['maxRotation']
-        
-        # Cap raw value to the fullScale setting. Keep the sign
-        if rightEye > rightEyeFullScale:
-            rightEye = rightEyeFullScale
-        if rightEye < rightEyeFullScale * -1:
-            rightEye = rightEyeFullScale * -1
-        
-        # Set rotation for right eye
-        self.tracking_data.rightEye[1] = (rightEye / rightEyeFullScale) * rightEyeMaxRotation
-    def input_tracking(self, tracking_data):
-        ''' Accept a tracking data object, apply calibration and save the result to the internal tracking_data '''
-        
-        # Check for cal changes and reload if needed
-        if time.time() > self.cal_lastcheck + CAL_CHECK_PERIOD:
-            self.cal_lastcheck = time.time()
-            modtime = os.path.getmtime(self.cal_filepath)
-            if modtime != self.cal_timestamp:
-                print("Config file changed, reloading")
-                self.loadCal()
-                self.cleanCal()
-                self.cal_timestamp = modtime
-        
+        if compiled is None:
+            compiled = self.compiled
+        rotation = compiled.eyes(self.tracking_data.blendshape_values)
+        self.tracking_data.leftEye[1] = rotation[0]
+        self.tracking_data.rightEye[1] = rotation[1]
+    def setDebug(self, entries):
+        ''' Print the blendshapes whose name contains any of entries, raw and calibrated '''
+        slots = debugSlots(entries)
+        if len(slots) == 0:
+            return
+        self.debug_slots = slots
+        self.debug_raw = np.zeros(len(slots))
+        self.debug_mask = None
+        self.debug_log = DebugLogger(self.formatDebug)
+        self.filtered_hooks.append(self.debugRaw)
+        self.add_listener(self.debugCalibrated)
+    def debugRaw(self, compiled):
+        ''' Keep the raw values of the debug blendshapes when a debug line is due '''
+        if not self.debug_log.due():
+            self.debug_mask = None
+            return
+        np.take(self.tracking_data.blendshape_values, self.debug_slots, out=self.debug_raw)
+        self.debug_mask = compiled.mask[self.debug_slots]
+    def debugCalibrated(self):
+        ''' Log the debug blendshapes kept by debugRaw along with their calibrated values '''
+        if self.debug_mask is None:
+            return
+        # Values are copied so the printer thread does not see later frames
+        self.debug_log.log((self.debug_raw.copy(), self.tracking_data.blendshape_values[self.debug_slots], self.debug_mask))
+    def formatDebug(self, entry):
+        ''' Debug lines for a (raw, calibrated, calibrated mask) entry '''
+        lines = []
+        for slot, raw, value, calibrated in zip(self.debug_slots, *entry):
+            if calibrated:
+                lines.append(f"{BLENDSHAPE_NAMES[slot]} raw {raw} cal {value}")
+            else:
+                lines.append(f"{BLENDSHAPE_NAMES[slot]} {value}")
+        return "\n".join(lines)
+    def startAutoCal(self):
+        ''' Collect blendshape ranges while tracking. A candidate cal file is written on close '''
+        self.autocal = AutoCal()
+        self.filtered_hooks.append(self.updateAutoCal)
+    def updateAutoCal(self, compiled):
+        ''' Feed the filtered blendshapes to the autocal estimators '''
+        self.autocal.update(self.tracking_data.blendshape_values, self.tracking_data.confidence)
+    def writeAutoCal(self):
+        ''' Write the candidate cal file next to the current one. Returns its path, None if not written '''
+        filepath = candidatePath(self.cal_filepath)
+        if not self.autocal.write(self.config, filepath):
+            print(f"Autocal needs more tracking time, only {self.autocal.samples} samples taken")
+            return None
+        print(f"Autocal candidate written to {filepath}")
+        return filepath
+    def startRecording(self, parsed=None, output=None):
+        ''' Record the frames handed to input_tracking to parsed, and the calibrated frames to output. See recording.py '''
+        if parsed is not None:
+            self.input_hooks.append(parsed.write_tracking)
+            self.recorders.append(parsed)
+        if output is not None:
+            self.add_listener(lambda: output.write_tracking(self.tracking_data, self.timestamp))
+            self.recorders.append(output)
+    def close(self):
+        ''' Stop the watcher and debug threads. Write the autocal candidate if enabled and close recordings '''
+        self.stop_watcher()
+        for recorder in self.recorders:
+            recorder.close()
+        self.recorders = []
+        if self.autocal is not None:
+            self.filtered_hooks.remove(self.updateAutoCal)
+            self.writeAutoCal()
+            self.autocal = None
+        if self.debug_log is not None:
+            self.filtered_hooks.remove(self.debugRaw)
+            self.remove_listener(self.debugCalibrated)
+            self.debug_log.close()
+            self.debug_log = None
+    def prepareFrame(self, tracking_data, compiled, now):
+        ''' Copy and filter the raw values, then compute eye rotation. now is the frame timestamp '''
         # Save confidence
         self.tracking_data.confidence = tracking_data.confidence
         
-        # Feed the head pos and rotation to their RollingAvg filters
-        self.headrotavgs[0].input(tracking_data.head[0])
-        self.headrotavgs[1].input(tracking_data.head[1])
-        self.headrotavgs[2].input(tracking_data.head[2])
-        self.headposavgs[0].input(tracking_data.head[3])
-        self.headposavgs[1].input(tracking_data.head[4])
-        self.headposavgs[2].input(tracking_data.head[5])
+        # Copy blendshapes and head from source to destination
+        channels = self.tracking_data.buffer[:CHANNEL_COUNT]
+        np.copyto(channels, tracking_data.buffer[:CHANNEL_COUNT])
         
-        # Save head rot and pos
-        self.tracking_data.head[0] = self.headrotavgs[0].avg()
-        self.tracking_data.head[1] = self.headrotavgs[1].avg()
-        self.tracking_data.head[2] = self.headrotavgs[2].avg()
-        self.tracking_data.head[3] = self.headposavgs[0].avg()
-        self.tracking_data.head[4] = self.headposavgs[1].avg()
-        self.tracking_data.head[5] = self.headposavgs[2].avg()
-        
-        # Copy blendshapes from source to destination
-        for k, i in tracking_data.blendshapes.items():
-            self.tracking_data.blendshapes[k] = i
+        # Smooth the raw values. Filter state only restarts when the filters themselves change
+        if compiled.filters is not self.filter_bank.spec:
+            if compiled.filters != self.filter_bank.spec:
+                self.filter_bank = FilterBank(compiled.filters, self.rotation_scale)
+            self.filter_bank.spec = compiled.filters
+        self.filter_bank.update(channels, now, tracking_data.rotation)
         
         # Compute eye rotation data
-        self.eyeRotation()
+        self.eyeRotation(compiled)
+    def input_tracking(self, tracking_data, now=None):
+        ''' Accept a tracking data object, apply calibration and save the result to the internal tracking_data.
+        now is the perf_counter timestamp of the frame, the current time if None. Replays pass the recorded one '''
+        # perf_counter, as monotonic ticks every 15.6 ms on Windows and the One Euro filter needs real frame intervals
+        if now is None:
+            now = time.perf_counter()
+        self.timestamp = now
         
-        # Get target blendshapes for cal
-        calKeys = (self.config.get('blendshapes', {}).keys())
+        # Hooks on the frame as received, IE. recording
+        for callback in self.input_hooks:
+            callback(tracking_data, now)
         
-        # Now apply any extra calibration entries on the config
-        for k in calKeys:
-            rawValue = self.tracking_data.blendshapes.get(k)
-            if rawValue is None:
-                print("No blendshape called", k)
-                continue
-            calValue = doCal(self.config['blendshapes'][k], rawValue)
-            # Handle cal debug messages
-            for d_k in debug_entries:
-                if d_k in k:
-                    print(f"{k} raw {rawValue} cal {calValue}")
-            self.tracking_data.blendshapes[k] = int(round(calValue))
+        # Calibration in use for this frame. The watcher thread may swap it at any time
+        compiled = self.compiled
+        self.prepareFrame(tracking_data, compiled, now)
         
-        # Handle now other debug entries that are not in cal
-        for k, v in self.tracking_data.blendshapes.items():
-            # Skip entries in calib
-            if k in calKeys:
-                continue
-            for d_k in debug_entries:
-                if d_k in k:
-                    print(f"{k} {self.tracking_data.blendshapes[k]}")
+        # Hooks on the filtered values, IE. autocal and debug output
+        for callback in self.filtered_hooks:
+            callback(compiled)
+        
+        # Now apply the calibration entries on the config
+        compiled.apply(self.tracking_data.blendshape_values)
+        
+        # Notify listeners a new frame is ready
+        for callback in self.listeners:
+            callback()
+
+def debugSlots(entries):
+    ''' Blendshape slots whose name contains any of entries '''
+    return np.array([i for i, k in enumerate(BLENDSHAPE_NAMES) if any(d_k in k for d_k in entries if d_k)], dtype=int)
 
 def doCal(config, in_ex):
     '''Apply calibration to the in_ex input'''
@@ -329,4 +556,8 @@ def doCal(config, in_ex):
             out_ex = 100
         else:
             out_ex = Xin
+    
+    # Curve procedure
+    elif config['type'] == 'curve':
+        out_ex = float(curveValues(config, in_ex))
     return out_ex
\ No newline at end of file
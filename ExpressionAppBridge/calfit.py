@@ -0,0 +1,185 @@
+'''
+calfit.py
+
+Fit blendshape calibration parameters from recorded tracking sessions.
+
+Run with `python -m ExpressionAppBridge.calfit SESSION [SESSION ...] -o OUTPUT`. Sessions are
+raw blendshape values, one frame per row:
+
+ * .npy arrays with the 52 blendshapes first on each row. Whole TrackingData buffers work too
+ * .csv files with a header of blendshape names. Missing blendshapes are read as 0
+ * .rec parsed recordings, see recording.py
+
+Every blendshape is reduced to a value histogram in one vectorized pass, and its parameters
+are picked from that:
+
+ * Blendshapes moving less than MIN_RANGE get no entry
+ * Two well separated clusters, like blinks that never reach 100, get an outputSnap entry at the
+   threshold between them
+ * Blendshapes resting near 0 get a simple entry with max at the high percentile
+ * Anything else gets an interpolation entry from the low to the high percentile
+
+The fitted config is then run over the recording with CompiledCal to report saturation and
+dead zone rates.
+'''
+import argparse, csv, json
+import numpy as np
+from .cal import DEFAULT_CAL, CompiledCal, cleanConfig
+from .recording import Recording
+from .tracking_data import BLENDSHAPE_COUNT, BLENDSHAPE_INDEX, PERFECT_SYNC_BLENDSHAPES
+
+# Percentiles mapped to 0 and 100. In percent
+FIT_LOW = 2
+FIT_HIGH = 98
+
+# Blendshapes moving less than this are left uncalibrated
+MIN_RANGE = 5
+
+# Low percentile at or below this is treated as resting at 0
+REST_LEVEL = 1
+
+# Share of the variance explained by a two cluster split needed for an outputSnap fit
+SNAP_SEPARATION = 0.9
+
+# Histogram resolution. Blendshape inputs go from 0 to 100
+HIST_BINS = 1001
+HIST_MAX = 100
+
+def load_session(path):
+    ''' Frames x blendshapes array for a recorded session '''
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = np.array([[float(x) for x in row] for row in reader if row], dtype=float).reshape(-1, len(header))
+        values = np.zeros((len(rows), BLENDSHAPE_COUNT))
+        for col, name in enumerate(header):
+            if name in BLENDSHAPE_INDEX:
+                values[:, BLENDSHAPE_INDEX[name]] = rows[:, col]
+        return values
+    if path.endswith('.rec'):
+        recording = Recording(path)
+        if recording.tap == 'raw':
+            raise ValueError(f"{path} holds raw datagrams, fit from the parsed recording")
+        if recording.tap == 'output':
+            print(f"{path} holds calibrated values, fit from the parsed recording to get raw ranges")
+        return recording.values()[:, :BLENDSHAPE_COUNT]
+    values = np.load(path, mmap_mode='r')
+    if values.ndim != 2 or values.shape[1] < BLENDSHAPE_COUNT:
+        raise ValueError(f"{path} does not hold one row of {BLENDSHAPE_COUNT} blendshapes per frame")
+    return values[:, :BLENDSHAPE_COUNT]
+
+def histograms(values):
+    ''' Blendshapes x HIST_BINS histograms of a frames x blendshapes array '''
+    scale = (HIST_BINS - 1) / HIST_MAX
+    bins = np.clip(np.rint(np.asarray(values, dtype=float) * scale), 0, HIST_BINS - 1).astype(np.intp)
+    bins += np.arange(BLENDSHAPE_COUNT) * HIST_BINS
+    return np.bincount(bins.ravel(), minlength=BLENDSHAPE_COUNT * HIST_BINS).reshape(BLENDSHAPE_COUNT, HIST_BINS)
+
+def hist_percentiles(hist, p):
+    ''' Percentile p of every histogram, at bin resolution '''
+    cumulative = np.cumsum(hist, axis=1)
+    target = cumulative[:, -1:] * (p / 100)
+    idx = np.argmax(cumulative >= np.maximum(target, 1), axis=1)
+    return idx * (HIST_MAX / (HIST_BINS - 1))
+
+def hist_split(hist):
+    ''' Otsu threshold of every histogram and the share of variance the split explains '''
+    centers = np.arange(HIST_BINS) * (HIST_MAX / (HIST_BINS - 1))
+    total = hist.sum(axis=1, keepdims=True)
+    w0 = np.cumsum(hist, axis=1) / total
+    m0 = np.cumsum(hist * centers, axis=1) / total
+    mean = m0[:, -1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean * w0 - m0) ** 2 / (w0 * (1 - w0))
+    between = np.nan_to_num(between, nan=0, posinf=0)
+
+    # Every threshold inside a gap between clusters scores the same. Take the middle of the gap
+    peak = between.max(axis=1, keepdims=True)
+    best = between >= peak * (1 - 1e-9)
+    first = np.argmax(best, axis=1)
+    last = HIST_BINS - 1 - np.argmax(best[:, ::-1], axis=1)
+    variance = (hist * (centers - mean) ** 2).sum(axis=1) / total[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        separation = np.where(variance > 0, peak[:, 0] / variance, 0)
+    return (centers[first] + centers[last]) / 2, separation
+
+def fit(values, low=FIT_LOW, high=FIT_HIGH):
+    ''' Fitted blendshape entries for a frames x blendshapes array. Only blendshapes that take cal entries are fitted '''
+    hist = histograms(values)
+    lo = hist_percentiles(hist, low)
+    hi = hist_percentiles(hist, high)
+    threshold, separation = hist_split(hist)
+
+    entries = {}
+    for k in PERFECT_SYNC_BLENDSHAPES:
+        i = BLENDSHAPE_INDEX[k]
+        lo_in, hi_in = round(float(lo[i])), round(float(hi[i]))
+        if hi_in - lo_in < MIN_RANGE:
+            continue
+        if separation[i] >= SNAP_SEPARATION:
+            entries[k] = {"type": "outputSnap", "limit": round(float(threshold[i]))}
+        elif lo_in <= REST_LEVEL:
+            entries[k] = {"type": "simple", "max": hi_in}
+        else:
+            entries[k] = {"type": "interpolation", "minIn": lo_in, "maxIn": hi_in, "minOut": 0, "maxOut": 100}
+    return entries
+
+def report(values, config, low=FIT_LOW, high=FIT_HIGH):
+    ''' Per blendshape input range, saturation and dead zone rates with config applied. Blendshapes without cal entries are left out '''
+    values = np.asarray(values, dtype=float)
+    out = CompiledCal(config).apply(values.copy())
+    hist = histograms(values)
+    lo = hist_percentiles(hist, low)
+    hi = hist_percentiles(hist, high)
+    minimum = values.min(axis=0)
+    maximum = values.max(axis=0)
+    saturation = np.mean(out >= 100, axis=0)
+    dead_zone = np.mean(out <= 0, axis=0)
+    rows = []
+    for k in PERFECT_SYNC_BLENDSHAPES:
+        i = BLENDSHAPE_INDEX[k]
+        entry = config['blendshapes'].get(k)
+        rows.append({
+            "blendshape": k,
+            "type": entry['type'] if entry else "none",
+            "min": float(minimum[i]),
+            "low": float(lo[i]),
+            "high": float(hi[i]),
+            "max": float(maximum[i]),
+            "saturation": float(saturation[i]),
+            "deadZone": float(dead_zone[i])
+        })
+    return rows
+
+def print_report(rows, frames):
+    print(f"{frames} frames")
+    print(f"{'blendshape':<20} {'type':<14} {'min':>6} {'low':>6} {'high':>6} {'max':>6} {'sat %':>6} {'dead %':>6}")
+    for r in rows:
+        print(f"{r['blendshape']:<20} {r['type']:<14} {r['min']:6.1f} {r['low']:6.1f} {r['high']:6.1f} {r['max']:6.1f} {r['saturation']*100:6.1f} {r['deadZone']*100:6.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a blendshape config from recorded tracking sessions")
+    parser.add_argument('sessions', nargs='+', help="Recorded sessions, .npy, .csv or parsed .rec")
+    parser.add_argument('-o', '--output', required=True, help="Fitted blendshape config to write")
+    parser.add_argument('--base', help="Existing blendshape config to take the eye and filter settings from")
+    parser.add_argument('--low', type=float, default=FIT_LOW, help=f"Percentile mapped to 0. Default {FIT_LOW}")
+    parser.add_argument('--high', type=float, default=FIT_HIGH, help=f"Percentile mapped to 100. Default {FIT_HIGH}")
+    args = parser.parse_args()
+
+    values = np.concatenate([load_session(path) for path in args.sessions])
+
+    if args.base:
+        with open(args.base) as f:
+            config = cleanConfig(json.load(f))
+    else:
+        config = json.loads(json.dumps(DEFAULT_CAL))
+    config['blendshapes'] = fit(values, args.low, args.high)
+
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print_report(report(values, config, args.low, args.high), len(values))
+    print(f"Fitted config written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,8 @@ CONFIG_FILEPATH = "config/RTX_path.json"
 debug_settings = {
     "debug_ifm": False,
     "debug_param": [],
-    "debug_expapp": False
+    "debug_expapp": False,
+    "debug_timing": False
 }
 
 def saveConfig(config):
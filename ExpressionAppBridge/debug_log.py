@@ -0,0 +1,51 @@
+'''
+debug_log.py
+
+Rate limited debug output off the frame path.
+
+The frame path only checks a deadline and queues the values to print. Formatting and printing
+happen on a background thread, so a slow console does not hold up tracking.
+'''
+import queue, threading, time
+
+# Debug lines printed per second
+DEBUG_LOG_RATE = 10
+
+# Entries waiting to be printed before new ones get dropped
+DEBUG_LOG_QUEUE = 64
+
+class DebugLogger:
+    """Queue entries at up to rate per second and print them from a background thread.
+    format receives the queued entry and returns the text to print."""
+    def __init__(self, format, rate=DEBUG_LOG_RATE):
+        self.format = format
+        self.period = 1 / rate
+        self.next_time = 0
+        self.queue = queue.Queue(DEBUG_LOG_QUEUE)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    def due(self, now=None):
+        """True if an entry can be logged now. Call log right after when True"""
+        if now is None:
+            now = time.monotonic()
+        if now < self.next_time:
+            return False
+        self.next_time = now + self.period
+        return True
+    def log(self, entry):
+        """Queue an entry for printing. Dropped if the printer fell behind"""
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped = self.dropped + 1
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            print(self.format(entry), flush=True)
+    def close(self):
+        """Print what is queued and stop the thread"""
+        self.queue.put(None)
+        self.thread.join()
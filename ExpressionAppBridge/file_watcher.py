@@ -0,0 +1,67 @@
+'''
+file_watcher.py
+
+Watch a file for changes on a background thread.
+
+Uses inotify through the inotify_simple package when it is installed, polls the
+modification time otherwise.
+'''
+import os, threading
+
+# Time to let a burst of writes settle before reporting a change. In seconds.
+SETTLE_TIME = 0.1
+
+# How often the inotify thread checks for a stop request. In seconds.
+STOP_CHECK_PERIOD = 0.5
+
+def _file_stamp(path):
+    ''' Modification time and size, None if the file is missing '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class FileWatcher:
+    ''' Call on_change from a background thread whenever path changes '''
+    def __init__(self, path, on_change, poll_period=5):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_period = poll_period
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.backend = None
+    def start(self):
+        # Take the reference stamp now so changes made right after start are not missed
+        self.stamp = _file_stamp(self.path)
+        try:
+            from inotify_simple import INotify, flags
+            
+            # Watch the directory. Editors usually replace the file instead of writing into it
+            self.inotify = INotify()
+            self.inotify.add_watch(os.path.dirname(self.path), flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+            self.backend = 'inotify'
+            target = self.run_inotify
+        except ImportError:
+            self.backend = 'poll'
+            target = self.run_poll
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+    def run_poll(self):
+        while not self.stop_event.wait(self.poll_period):
+            stamp = _file_stamp(self.path)
+            if stamp != self.stamp:
+                self.stamp = stamp
+                if stamp is not None:
+                    self.on_change()
+    def run_inotify(self):
+        name = os.path.basename(self.path)
+        with self.inotify:
+            while not self.stop_event.is_set():
+                events = self.inotify.read(timeout=int(STOP_CHECK_PERIOD * 1000), read_delay=int(SETTLE_TIME * 1000))
+                if any(e.name == name for e in events) and os.path.exists(self.path):
+                    self.on_change()
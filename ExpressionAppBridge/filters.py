@@ -0,0 +1,309 @@
+'''
+filters.py
+
+Smoothing filters for the tracking channels.
+
+Each blendshape and head value is a channel, laid out like the first slots of the TrackingData
+buffer. Every channel gets one filter from the "filters" section of the cal file. Channels
+sharing a filter are updated together as one vectorized group and every filter is O(1) per frame.
+
+none     Pass through
+avg      Moving average over the last 'window' frames. Kept as a running sum, so the window size
+         does not affect the cost. Averages the frames seen so far until the window is full
+ema      Exponential moving average. out = out + alpha * (in - out)
+oneEuro  One Euro filter. An EMA with a cutoff frequency that rises with the speed of the
+         signal, so slow motion gets heavy smoothing and fast motion gets little lag
+
+Head rotation can also be smoothed as a whole rotation. The three angles are turned into a
+quaternion, filtered and turned back into angles once. Unlike filtering each angle on its own
+this does not break where an angle wraps around +-180 or close to gimbal lock. Trackers that
+report a quaternion, like ExpressionApp, hand it over directly and skip the conversion from
+angles. Angles in other units than degrees, like the mediapipe ones, are scaled to degrees with
+the rotation scale of the FilterBank. The conversions make these filters cost more per frame
+than the default per angle avg, where the head rotation shares one group with the position.
+
+quatAvg  Moving average of the last 'window' rotations, a normalized running sum of quaternions
+slerp    Exponential moving average in quaternion space. out = slerp(out, in, alpha)
+'''
+import math
+import numpy as np
+from .quaternion import euler_from_quaternion, quaternion_from_euler, slerp_quaternion
+from .tracking_data import BLENDSHAPE_INDEX, HEAD_SLICE
+
+# Filtered channels. Blendshapes then head rotation and position
+CHANNEL_COUNT = HEAD_SLICE.stop
+HEAD_ROTATION_CHANNELS = list(range(HEAD_SLICE.start, HEAD_SLICE.start + 3))
+HEAD_POSITION_CHANNELS = list(range(HEAD_SLICE.start + 3, HEAD_SLICE.stop))
+
+# Valid filter types and their parameters with default values
+FILTER_TYPES = {
+    'none': {},
+    'avg': {'window': 1},
+    'ema': {'alpha': 0.5},
+    'oneEuro': {'minCutoff': 1.0, 'beta': 0.0, 'dCutoff': 1.0},
+    'quatAvg': {'window': 1},
+    'slerp': {'alpha': 0.5}
+}
+
+# Filters that work on the head rotation as a whole. Only valid for "headRotation"
+ROTATION_FILTER_TYPES = ['quatAvg', 'slerp']
+
+# Filters used for channels missing from the config
+DEFAULT_WINDOW_SIZE = 5
+DEFAULT_FILTERS = {
+    "headRotation": {"type": "avg", "window": DEFAULT_WINDOW_SIZE},
+    "headPosition": {"type": "avg", "window": DEFAULT_WINDOW_SIZE},
+    "blendshapes": {}
+}
+NO_FILTER = {"type": "none"}
+
+# Frame interval assumed when timestamps do not advance. In seconds
+DEFAULT_INTERVAL = 1 / 60
+
+# Rotation scale of head rotations already in degrees
+DEGREES = (1.0, 1.0, 1.0)
+
+def validFilter(entry):
+    ''' Check a single filter entry, {"type": ..., parameters} '''
+    if type(entry) is not dict or entry.get('type') not in FILTER_TYPES:
+        return False
+    for arg in FILTER_TYPES[entry['type']]:
+        if arg in entry and type(entry[arg]) not in [int, float]:
+            return False
+    if entry['type'] in ['avg', 'quatAvg'] and (type(entry.get('window', 1)) is not int or entry.get('window', 1) < 1):
+        return False
+    if entry['type'] in ['ema', 'slerp'] and not 0 < entry.get('alpha', 1) <= 1:
+        return False
+    if entry['type'] == 'oneEuro':
+        if entry.get('minCutoff', 1) <= 0 or entry.get('dCutoff', 1) <= 0 or entry.get('beta', 0) < 0:
+            return False
+    return True
+
+def cleanFilters(filters):
+    ''' Remove invalid entries from a "filters" config section. Modified in place and returned '''
+    for k in ['headRotation', 'headPosition']:
+        if k in filters and not validFilter(filters[k]):
+            print(f"Invalid filter for \"{k}\", using the default")
+            filters.pop(k)
+    if filters.get('headPosition', {}).get('type') in ROTATION_FILTER_TYPES:
+        print(f"Filter \"{filters['headPosition']['type']}\" only works on \"headRotation\", using the default")
+        filters.pop('headPosition')
+    bs_filters = filters.get('blendshapes', {})
+    if type(bs_filters) is not dict:
+        print("Filter \"blendshapes\" entry must be an object")
+        filters.pop('blendshapes')
+        return filters
+    for k, i in dict(bs_filters).items():
+        if k not in BLENDSHAPE_INDEX:
+            print(f"\"{k}\" is not a valid Perfect Sync blendshape")
+            bs_filters.pop(k)
+        elif not validFilter(i) or i['type'] in ROTATION_FILTER_TYPES:
+            print(f"Invalid filter for \"{k}\"")
+            bs_filters.pop(k)
+    return filters
+
+def _channel_filter(entry):
+    ''' Hashable (type, parameters) pair with the defaults filled in '''
+    defaults = FILTER_TYPES[entry['type']]
+    return (entry['type'], tuple(float(entry.get(arg, default)) for arg, default in defaults.items()))
+
+def filterSpec(filters):
+    ''' Per channel filters for a cleaned "filters" section. Equal configs give equal specs '''
+    head_rotation = filters.get('headRotation', DEFAULT_FILTERS['headRotation'])
+    head_position = filters.get('headPosition', DEFAULT_FILTERS['headPosition'])
+    bs_filters = filters.get('blendshapes', {})
+    spec = [_channel_filter(bs_filters.get(k, NO_FILTER)) for k in BLENDSHAPE_INDEX]
+    spec = spec + [_channel_filter(head_rotation)] * 3 + [_channel_filter(head_position)] * 3
+    return tuple(spec)
+
+class AvgGroup:
+    """Moving average over window frames for a set of channels"""
+    def __init__(self, slots, window):
+        self.slots = slots
+        self.window = int(window)
+        self.ring = np.zeros((self.window, len(slots)))
+        self.sum = np.zeros(len(slots))
+        self.x = np.zeros(len(slots))
+        self.pos = 0
+        self.filled = 0
+    def update(self, values, now):
+        x = np.take(values, self.slots, out=self.x)
+        self.sum += x
+        self.sum -= self.ring[self.pos]
+        self.ring[self.pos] = x
+        self.pos = self.pos + 1
+        if self.filled < self.window:
+            self.filled = self.filled + 1
+        if self.pos == self.window:
+            # Re-sum once per window so rounding errors do not pile up
+            self.pos = 0
+            np.sum(self.ring, axis=0, out=self.sum)
+        np.divide(self.sum, self.filled, out=x)
+        values[self.slots] = x
+
+class EmaGroup:
+    """Exponential moving average for a set of channels"""
+    def __init__(self, slots, alpha):
+        self.slots = slots
+        self.alpha = alpha
+        self.y = None
+        self.x = np.zeros(len(slots))
+    def update(self, values, now):
+        x = np.take(values, self.slots, out=self.x)
+        if self.y is None:
+            self.y = x.copy()
+        else:
+            np.subtract(x, self.y, out=x)
+            np.multiply(x, self.alpha, out=x)
+            self.y += x
+        values[self.slots] = self.y
+
+class OneEuroGroup:
+    """One Euro filter for a set of channels. See Casiez et al., CHI 2012"""
+    def __init__(self, slots, min_cutoff, beta, d_cutoff):
+        self.slots = slots
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.y = None
+        self.dy = np.zeros(len(slots))
+        self.last = None
+        self.x = np.zeros(len(slots))
+        self.a = np.zeros(len(slots))
+        self.d = np.zeros(len(slots))
+    def update(self, values, now):
+        x = np.take(values, self.slots, out=self.x)
+        if self.y is None:
+            self.y = x.copy()
+            self.last = now
+            return
+        dt = now - self.last
+        if dt <= 0:
+            dt = DEFAULT_INTERVAL
+        self.last = now
+
+        # Smoothed speed. alpha = 1 / (1 + tau / dt) with tau = 1 / (2 pi cutoff)
+        d, a = self.d, self.a
+        np.subtract(x, self.y, out=d)
+        np.divide(d, dt, out=d)
+        d -= self.dy
+        np.multiply(self.d_cutoff, 2 * math.pi * dt, out=a)
+        np.divide(a, a + 1, out=a)
+        d *= a
+        self.dy += d
+
+        # Cutoff goes up with speed
+        np.abs(self.dy, out=a)
+        a *= self.beta
+        a += self.min_cutoff
+        a *= 2 * math.pi * dt
+        np.divide(a, a + 1, out=a)
+        np.subtract(x, self.y, out=d)
+        d *= a
+        self.y += d
+        values[self.slots] = self.y
+
+class RotationGroup:
+    """Base for the filters on the head rotation as a whole. scale is the degrees per unit of
+    each angle. A single quaternion per frame is cheaper with plain floats than with numpy"""
+    def __init__(self, slots, scale=DEGREES):
+        self.slots = slots
+        self.scale = scale
+    def quaternion(self, values, rotation):
+        """Quaternion of the frame. The tracker one if given, else from the angles"""
+        if rotation is not None:
+            return rotation
+        x, y, z = self.slots
+        sx, sy, sz = self.scale
+        return quaternion_from_euler(values[x] * sx, values[y] * sy, values[z] * sz)
+    def store(self, values, q):
+        """Write a filtered quaternion back as angles"""
+        x, y, z = self.slots
+        sx, sy, sz = self.scale
+        ex, ey, ez = euler_from_quaternion(q[0], q[1], q[2], q[3])
+        values[x], values[y], values[z] = ex / sx, ey / sy, ez / sz
+
+class QuatAvgGroup(RotationGroup):
+    """Moving average over window frames of the head rotation, in quaternion space"""
+    def __init__(self, slots, window, scale=DEGREES):
+        super().__init__(slots, scale)
+        self.window = int(window)
+        self.ring = [(0.0, 0.0, 0.0, 0.0)] * self.window
+        self.sum = [0.0, 0.0, 0.0, 0.0]
+        self.last = None
+        self.pos = 0
+    def update(self, values, now, rotation=None):
+        q = self.quaternion(values, rotation)
+        # Keep every quaternion on the same side as the previous one so they add up
+        last = self.last
+        if last is not None and q[0] * last[0] + q[1] * last[1] + q[2] * last[2] + q[3] * last[3] < 0:
+            q = (-q[0], -q[1], -q[2], -q[3])
+        self.last = q
+        old = self.ring[self.pos]
+        self.ring[self.pos] = q
+        s = self.sum
+        for i in range(4):
+            s[i] = s[i] + q[i] - old[i]
+        self.pos = self.pos + 1
+        if self.pos == self.window:
+            # Re-sum once per window so rounding errors do not pile up
+            self.pos = 0
+            self.sum = s = [math.fsum(r[i] for r in self.ring) for i in range(4)]
+        n = math.sqrt(s[0] * s[0] + s[1] * s[1] + s[2] * s[2] + s[3] * s[3])
+        self.store(values, (s[0] / n, s[1] / n, s[2] / n, s[3] / n))
+
+class SlerpGroup(RotationGroup):
+    """Exponential moving average of the head rotation, in quaternion space"""
+    def __init__(self, slots, alpha, scale=DEGREES):
+        super().__init__(slots, scale)
+        self.alpha = alpha
+        self.y = None
+    def update(self, values, now, rotation=None):
+        q = self.quaternion(values, rotation)
+        if self.y is None:
+            self.y = q
+        else:
+            self.y = slerp_quaternion(self.y, q, self.alpha)
+        self.store(values, self.y)
+
+class FilterBank:
+    """Filters for every channel of a filter spec, grouped by filter type and parameters.
+    rotation_scale is the degrees per unit of each head rotation angle, see RotationGroup"""
+    def __init__(self, spec, rotation_scale=DEGREES):
+        self.spec = spec
+        self.rotation_scale = rotation_scale
+
+        # Gather the channels sharing a filter
+        by_filter = {}
+        for channel, f in enumerate(spec):
+            if f[0] != 'none':
+                by_filter.setdefault(f, []).append(channel)
+
+        # avg groups need one ring per window size. ema and oneEuro take per channel parameters
+        # Rotation filters always hold the three head rotation channels
+        self.groups = []
+        self.rotation_groups = []
+        merged = {}
+        for (kind, params), channels in by_filter.items():
+            if kind == 'avg':
+                self.groups.append(AvgGroup(np.array(channels), params[0]))
+            elif kind == 'quatAvg':
+                self.rotation_groups.append(QuatAvgGroup(channels, params[0], rotation_scale))
+            elif kind == 'slerp':
+                self.rotation_groups.append(SlerpGroup(channels, params[0], rotation_scale))
+            else:
+                merged.setdefault(kind, []).extend((c, params) for c in channels)
+        for kind, entries in merged.items():
+            slots = np.array([c for c, _ in entries])
+            params = np.array([p for _, p in entries]).T
+            if kind == 'ema':
+                self.groups.append(EmaGroup(slots, params[0]))
+            elif kind == 'oneEuro':
+                self.groups.append(OneEuroGroup(slots, *params))
+    def update(self, values, now, rotation=None):
+        """Filter the first CHANNEL_COUNT values in place. now is a perf_counter timestamp in seconds.
+        rotation is the head rotation as a x, y, z, w quaternion when the tracker gives one"""
+        for group in self.groups:
+            group.update(values, now)
+        for group in self.rotation_groups:
+            group.update(values, now, rotation)
@@ -0,0 +1,122 @@
+'''
+frame_ring.py
+
+Preallocated ring of camera frame buffers.
+
+Capture buffers like the DirectShow grabber one are only valid while the capture callback runs,
+so every frame has to be copied out of them once. write copies the image into a free buffer of
+the ring. publish takes an item that already holds its own copy instead, IE. an mp.Image built
+in the callback, and stores only a reference, so the frame is not copied a second time.
+
+Readers lease the newest frame and get its buffer or item together with its sequence number and
+capture time. Leased buffers are never written to, so a frame stays intact until it is released.
+'''
+import threading, time
+import numpy as np
+
+# Buffers in the ring. One being written, one published and a few leased by readers
+RING_SIZE = 4
+
+class Frame:
+    """A leased ring buffer, or published item. image is only valid until release"""
+    __slots__ = ('ring', 'generation', 'index', 'seq', 'timestamp', 'image')
+    def __init__(self, ring, generation, index, seq, timestamp, image):
+        self.ring = ring
+        self.generation = generation
+        self.index = index
+        self.seq = seq
+        self.timestamp = timestamp
+        self.image = image
+    def release(self):
+        """Give the buffer back to the ring. Safe to call more than once"""
+        if self.ring is not None:
+            self.ring.release(self)
+            self.ring = None
+            self.image = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.release()
+
+class FrameRing:
+    """Ring of frame buffers with a single writer thread and any number of readers.
+    Buffers are allocated on the first frame and again if the frame shape changes."""
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.cond = threading.Condition()
+        self.buffers = None
+        self.generation = 0
+        self.leases = [0] * size
+        self.seqs = [0] * size
+        self.timestamps = [0.0] * size
+        # What readers get for each slot. A view of its buffer or a published item
+        self.items = [None] * size
+        self.latest = None
+        self.seq = 0
+        self.written = 0
+        self.dropped = 0
+    def write(self, image, timestamp=None):
+        """Copy image into a free buffer and publish it. Dropped if every buffer is in use"""
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        image = np.asarray(image)
+        with self.cond:
+            if self.buffers is None or self.buffers.shape[1:] != image.shape or self.buffers.dtype != image.dtype:
+                # Leases on the old buffers keep them alive and are ignored on release
+                self.buffers = np.empty((self.size,) + image.shape, dtype=image.dtype)
+                self.generation = self.generation + 1
+                self.leases = [0] * self.size
+                self.items = [None] * self.size
+                self.latest = None
+            index = self.free_buffer()
+            if index is None:
+                self.dropped = self.dropped + 1
+                return False
+            buffer = self.buffers[index]
+
+        # Copy outside the lock so readers are not held up
+        np.copyto(buffer, image)
+
+        with self.cond:
+            self.items[index] = buffer
+            self.commit(index, timestamp)
+        return True
+    def publish(self, item, timestamp=None):
+        """Publish an item that holds its own copy of a frame, without copying it. Dropped if every slot is in use"""
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self.cond:
+            index = self.free_buffer()
+            if index is None:
+                self.dropped = self.dropped + 1
+                return False
+            self.items[index] = item
+            self.commit(index, timestamp)
+        return True
+    def commit(self, index, timestamp):
+        """Make slot index the newest frame. Call with the lock held"""
+        self.seq = self.seq + 1
+        self.seqs[index] = self.seq
+        self.timestamps[index] = timestamp
+        self.latest = index
+        self.written = self.written + 1
+        self.cond.notify_all()
+    def free_buffer(self):
+        """A buffer that is neither leased nor the newest published one. Call with the lock held"""
+        for n in range(self.size):
+            index = (self.seq + n) % self.size
+            if self.leases[index] == 0 and index != self.latest:
+                return index
+        return None
+    def acquire(self, after_seq=0, timeout=None):
+        """Lease the newest frame with a sequence number above after_seq. None on timeout"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.latest is not None and self.seq > after_seq, timeout):
+                return None
+            index = self.latest
+            self.leases[index] = self.leases[index] + 1
+            return Frame(self, self.generation, index, self.seqs[index], self.timestamps[index], self.items[index])
+    def release(self, frame):
+        with self.cond:
+            if frame.generation == self.generation:
+                self.leases[frame.index] = self.leases[frame.index] - 1
@@ -0,0 +1,161 @@
+'''
+frame_source.py
+
+Frame sources for camera based tracking.
+
+Every source hands out leased frames from a FrameRing, see frame_ring.py. read() returns ret and
+a Frame, ret is False once the source runs out of frames.
+
+Sources given a convert function pass each image through it and publish the result instead of
+copying the image into the ring. mediapipe converts to mp.Image, which copies the pixels, so
+that is the only copy a frame goes through.
+
+VideoSource plays a video file, an image sequence pattern or a directory of images through
+OpenCV. SyntheticSource generates a moving test pattern. Both can be paced to a frame rate or run
+as fast as possible for throughput runs. The DirectShow camera is in mediapipe/camera.py.
+'''
+import abc, os, time
+import numpy as np
+from .frame_ring import FrameRing
+from .timing import DeadlineClock
+
+# How long to wait for a frame. In seconds
+READ_TIMEOUT = 1
+
+# Frame rate used when a source does not have one
+DEFAULT_SOURCE_RATE = 30
+
+# Synthetic frame size
+SYNTHETIC_WIDTH = 640
+SYNTHETIC_HEIGHT = 480
+
+# Files picked up from image directories
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+class FrameSource(abc.ABC):
+    """Base frame source. Subclasses produce images with grab.
+    rate paces reads to that many frames per second, 0 or None reads as fast as possible.
+    max_frames ends the source after that many frames. convert turns images into what readers get."""
+    def __init__(self, rate=None, max_frames=None, convert=None):
+        self.ring = FrameRing()
+        self.convert = convert
+        self.last_seq = 0
+        self.clock = DeadlineClock(rate) if rate else None
+        self.max_frames = max_frames
+        self.count = 0
+    @abc.abstractmethod
+    def grab(self):
+        """Next RGB image, None at the end of the source. True if the source published it itself"""
+    def read(self):
+        """Next frame. Returns ret and a leased Frame, release it once done with its image"""
+        if self.max_frames is not None and self.count >= self.max_frames:
+            return False, None
+        if self.clock is not None:
+            time.sleep(self.clock.next_delay(time.perf_counter()))
+        image = self.grab()
+        if image is None:
+            return False, None
+        self.count = self.count + 1
+        if image is not True:
+            self.publish(image)
+        return self.acquire()
+    def publish(self, image, timestamp=None):
+        """Hand an image to the readers. Converted if the source has convert, copied into the ring otherwise"""
+        if self.convert is None:
+            return self.ring.write(image, timestamp)
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        return self.ring.publish(self.convert(image), timestamp)
+    def acquire(self):
+        """Lease the frame written after the last one read"""
+        frame = self.ring.acquire(self.last_seq, READ_TIMEOUT)
+        if frame is None:
+            return False, None
+        self.last_seq = frame.seq
+        return True, frame
+    def close(self):
+        pass
+
+class SyntheticSource(FrameSource):
+    """Moving color bars with a bright disc. Same frames on every run. rate defaults to DEFAULT_SOURCE_RATE"""
+    def __init__(self, width=SYNTHETIC_WIDTH, height=SYNTHETIC_HEIGHT, rate=None, max_frames=None, convert=None):
+        super().__init__(DEFAULT_SOURCE_RATE if rate is None else rate, max_frames, convert)
+        self.width = width
+        self.height = height
+        self.bars = np.zeros((height, width, 3), dtype=np.uint8)
+        self.bars[..., 0] = np.arange(width) * 255 // max(width - 1, 1)
+        self.bars[..., 1] = (np.arange(height) * 255 // max(height - 1, 1))[:, None]
+        self.bars[..., 2] = 96
+        self.yy, self.xx = np.mgrid[0:height, 0:width]
+        self.image = np.empty_like(self.bars)
+    def grab(self):
+        t = self.count / DEFAULT_SOURCE_RATE
+        np.copyto(self.image, np.roll(self.bars, self.count * 4, axis=1))
+        cx = self.width / 2 + self.width / 4 * np.sin(t)
+        cy = self.height / 2 + self.height / 4 * np.cos(0.7 * t)
+        r = min(self.width, self.height) / 6
+        self.image[(self.xx - cx) ** 2 + (self.yy - cy) ** 2 < r * r] = 255
+        return self.image
+
+class VideoSource(FrameSource):
+    """Video file, image sequence pattern like frames/%04d.png, or a directory of images.
+    rate defaults to the video frame rate. loop restarts the source at the end"""
+    def __init__(self, path, rate=None, max_frames=None, loop=False, convert=None):
+        import cv2
+        self.cv2 = cv2
+        self.path = path
+        self.loop = loop
+        self.files = None
+        self.capture = None
+        if os.path.isdir(path):
+            self.files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+            if len(self.files) == 0:
+                raise ValueError(f"No images found on {path}")
+            self.position = 0
+            source_rate = DEFAULT_SOURCE_RATE
+        else:
+            self.capture = cv2.VideoCapture(path)
+            if not self.capture.isOpened():
+                raise ValueError(f"Could not open {path}")
+            source_rate = self.capture.get(cv2.CAP_PROP_FPS) or DEFAULT_SOURCE_RATE
+        super().__init__(source_rate if rate is None else rate, max_frames, convert)
+    def grab_bgr(self):
+        if self.files is not None:
+            if self.position >= len(self.files):
+                return None
+            image = self.cv2.imread(self.files[self.position])
+            self.position = self.position + 1
+            return image
+        ret, image = self.capture.read()
+        return image if ret else None
+    def rewind(self):
+        if self.files is not None:
+            self.position = 0
+        else:
+            self.capture.set(self.cv2.CAP_PROP_POS_FRAMES, 0)
+    def grab(self):
+        image = self.grab_bgr()
+        if image is None and self.loop:
+            self.rewind()
+            image = self.grab_bgr()
+        if image is None:
+            return None
+        return self.cv2.cvtColor(image, self.cv2.COLOR_BGR2RGB)
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+def parse_source(spec):
+    ''' Split a --source value into kind and argument. "camera", "synthetic[:WxH]" or a path '''
+    if spec is None or spec == 'camera':
+        return 'camera', None
+    if spec == 'synthetic' or spec.startswith('synthetic:'):
+        size = spec.partition(':')[2]
+        if size == '':
+            return 'synthetic', (SYNTHETIC_WIDTH, SYNTHETIC_HEIGHT)
+        try:
+            width, height = (int(x) for x in size.lower().split('x'))
+        except ValueError:
+            raise ValueError(f"Invalid synthetic size {size}, expected WIDTHxHEIGHT")
+        return 'synthetic', (width, height)
+    return 'file', spec
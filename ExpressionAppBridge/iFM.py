@@ -5,77 +5,210 @@ iFacialMocap layer.
 
 iFM_Data is a class that can serialize a tracking_data object.
 
-start_iFM_Sender is a asyncio coroutine that will send the data at FREQ frequency
+iFM_Serializer holds the precompiled iFM packet template used by iFM_Data.
+
+iFM_Destination is a single iFM receiver. iFM_Data serializes once per frame and sends
+the same payload to every destination over one non-blocking socket.
+
+start_iFM_Sender is a asyncio coroutine that will send the data at FREQ frequency,
+or as soon as a new frame is processed when running on event mode
 '''
 
-import asyncio, socket
+import asyncio, socket, time
+import numpy as np
 from .config_utils import debug_settings
+from .timing import IntervalStats, DeadlineClock
+from .tracking_data import BLENDSHAPE_NAMES, BLENDSHAPE_COUNT, HEAD_SLICE, RIGHT_EYE_SLICE, LEFT_EYE_SLICE
 FREQ = 60
+# Event mode settings. Max send rate in Hz and keepalive period in seconds
+MAX_RATE = 120
+KEEPALIVE = 1
+SEND_MODES = ['poll', 'event']
 IFM_ADDR = "127.0.0.1"
 IFM_PORT = 49983
 
+class iFM_Serializer:
+    """Serialize tracking data using a precompiled packet template"""
+    def __init__(self, rightEye_enable=True, leftEye_enable=True):
+        self.compile(rightEye_enable, leftEye_enable)
+    def compile(self, rightEye_enable, leftEye_enable):
+        """Build the byte template and the buffer slots it consumes"""
+        self.rightEye_enable = rightEye_enable
+        self.leftEye_enable = leftEye_enable
+        
+        # Blendshapes are sent as integers, head and eyes with 6 decimals
+        template = "|".join([f"{k}-%d" for k in BLENDSHAPE_NAMES])
+        template = template + "|=head#" + ",".join(["%.6f"] * 6)
+        slots = list(range(BLENDSHAPE_COUNT)) + list(range(HEAD_SLICE.start, HEAD_SLICE.stop))
+        if rightEye_enable:
+            template = template + "|rightEye#" + ",".join(["%.6f"] * 3)
+            slots = slots + list(range(RIGHT_EYE_SLICE.start, RIGHT_EYE_SLICE.stop))
+        if leftEye_enable:
+            template = template + "|leftEye#" + ",".join(["%.6f"] * 3)
+            slots = slots + list(range(LEFT_EYE_SLICE.start, LEFT_EYE_SLICE.stop))
+        template = template + "|"
+        self.template = template.encode()
+        
+        # Contiguous slots are read through a slice to avoid a gather
+        if slots == list(range(len(slots))):
+            self.slots = slice(0, len(slots))
+        else:
+            self.slots = np.array(slots)
+    def serialize(self, tracking_data):
+        """Serialize tracking_data according to the iFaceMocap format. Returns the packet bytes"""
+        return self.template % tuple(tracking_data.buffer[self.slots].tolist())
+
+class iFM_Destination:
+    """An iFM receiver with its own rate limit and counters. Host names are resolved once here
+    so sends never wait on a DNS lookup"""
+    def __init__(self, addr=IFM_ADDR, port=IFM_PORT, max_rate=None):
+        self.host = addr
+        try:
+            self.addr = socket.getaddrinfo(addr, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+        except socket.gaierror as e:
+            raise ValueError(f"Can not resolve iFM destination {addr}: {e}")
+        self.min_interval = 1/max_rate if max_rate else 0
+        self.next_send = None
+        self.sent = 0
+        self.skipped = 0
+        self.errors = 0
+    def __str__(self):
+        return f"{self.host}:{self.addr[1]}: {self.sent} sent, {self.skipped} rate limited, {self.errors} errors"
+
+def parse_destination(spec):
+    """Parse a 'host:port' or 'host:port@rate' destination string"""
+    max_rate = None
+    if '@' in spec:
+        spec, rate = spec.rsplit('@', 1)
+        max_rate = float(rate)
+    addr, port = spec.rsplit(':', 1)
+    return iFM_Destination(addr, int(port), max_rate)
+
 class iFM_Data:
-    def __init__(self, tracking_data):
+    def __init__(self, tracking_data, destinations=None):
         self.tracking_data = tracking_data
         self.head_enable = True
         self.rightEye_enable = True
         self.leftEye_enable = True
+        self.serializer = iFM_Serializer(self.rightEye_enable, self.leftEye_enable)
+        
+        # Receivers. Defaults to localhost
+        self.destinations = destinations if destinations else [iFM_Destination()]
+        
+        # Single socket for every destination. Non-blocking so a full buffer never stalls the tracker
         self.sock = socket.socket(socket.AF_INET, # Internet
             socket.SOCK_DGRAM) # UDP
+        self.sock.setblocking(False)
+    def serialize(self):
+        """Serialize tracking_data into bytes ready for sendto"""
+        # Recompile the template if the eye settings changed
+        if self.rightEye_enable != self.serializer.rightEye_enable or self.leftEye_enable != self.serializer.leftEye_enable:
+            self.serializer.compile(self.rightEye_enable, self.leftEye_enable)
+        return self.serializer.serialize(self.tracking_data)
     def __str__(self):
         """Serialize tracking_data according to the iFaceMocap format"""
-        
-        # Serialize blendshapes
-        output = "|".join([f"{k}-{int(v)}" for k, v in self.tracking_data.blendshapes.items()])
-        # Head parameters
-        output = output + "|=head#" + ",".join(["{:.6f}".format(x) for x in self.tracking_data.head])
-        # Right Eye
-        if self.rightEye_enable:
-            output = output + "|rightEye#" + ",".join(["{:.6f}".format(x) for x in self.tracking_data.rightEye])
-        # Left Eye
-        if self.leftEye_enable:
-            output = output + "|leftEye#" + ",".join(["{:.6f}".format(x) for x in self.tracking_data.leftEye])
-        # Closing
-        output = output + "|"
-        return output
+        return str(self.serialize(), 'ascii')
     def udp_send(self):
+        """Serialize once and send to every destination. Returns True if a frame was sent"""
         # Send data if tracking_data.confidence is greater than 25
-        if self.tracking_data.confidence > 25:
-            payload = str(self)
-            if debug_settings['debug_ifm']:
-                print(payload)
-            self.sock.sendto(payload.encode(), (IFM_ADDR, IFM_PORT))
-
-class IFM_Sender_Protocol:
-    def __init__(self):
-        self.transport = None
-    def connection_made(self, transport):
-        self.transport = transport
-    def connection_lost(self, exp):
-        # Ignore lost connections
-        pass
-    def error_received(self, exp):
-        # Ignore unreachable destinations
-        pass
+        if self.tracking_data.confidence <= 25:
+            return False
+        payload = self.serialize()
+        if debug_settings['debug_ifm']:
+            print(str(payload, 'ascii'))
+        now = time.monotonic()
+        for dest in self.destinations:
+            # Per destination rate limit. Send slots advance by a fixed interval so the average rate holds
+            if dest.next_send is not None and now < dest.next_send:
+                dest.skipped = dest.skipped + 1
+                continue
+            if dest.next_send is None or now - dest.next_send > dest.min_interval:
+                dest.next_send = now
+            dest.next_send = dest.next_send + dest.min_interval
+            try:
+                self.sock.sendto(payload, dest.addr)
+                dest.sent = dest.sent + 1
+            except OSError:
+                # Unreachable destination or full socket buffer. Count it and move on to the next one
+                dest.errors = dest.errors + 1
+        return True
+    def close(self):
+        self.sock.close()
 
-async def start_iFM_Sender(iFM):
-    """Start iFM sender. Rate is set to FREQ"""
-    print("Setting up iFM sender", flush=True)
+# Seconds between timing reports when debug_timing is set
+TIMING_REPORT_PERIOD = 5
+
+def send_frame(iFM, stats):
+    """Serialize and send a single frame. Sent packets are marked on stats"""
+    if iFM.udp_send():
+        stats.mark()
+
+async def poll_sender(iFM, stats):
+    """Send the current frame at FREQ. Deadlines are fixed, late ticks are skipped"""
+    clock = DeadlineClock(FREQ, stats)
+    while True:
+        send_frame(iFM, stats)
+        await clock.wait()
+
+async def timing_reporter(stats):
+    """Print interval statistics periodically"""
+    while True:
+        await asyncio.sleep(TIMING_REPORT_PERIOD)
+        print(f"iFM timing: {stats}", flush=True)
+
+async def event_sender(iFM, stats, tracking_input, max_rate=MAX_RATE, keepalive=KEEPALIVE):
+    """Send as soon as tracking_input processes a frame. Sends are capped to max_rate,
+    the last frame is repeated after keepalive seconds without new frames"""
     loop = asyncio.get_running_loop()
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: IFM_Sender_Protocol(),
-        remote_addr=(IFM_ADDR, IFM_PORT))
+    min_interval = 1/max_rate if max_rate else 0
+    
+    # tracking_input calls us from the event loop thread, so the event can be set directly
+    frame_ready = asyncio.Event()
+    tracking_input.add_listener(frame_ready.set)
     try:
+        last_send = loop.time()
         while True:
-            # Send data if tracking_data.confidence is greater than 25
-            if iFM.tracking_data.confidence > 25:
-                payload = str(iFM)
-                if debug_settings['debug_ifm']:
-                    print(payload)
-                transport.sendto(payload.encode())
-            await asyncio.sleep(1/FREQ)
+            # Wait for a frame or the keepalive deadline
+            timeout = last_send + keepalive - loop.time()
+            try:
+                await asyncio.wait_for(frame_ready.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+            
+            # Hold the frame if we are above the rate cap. Frames that arrive meanwhile are merged into it
+            wait = last_send + min_interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            frame_ready.clear()
+            
+            send_frame(iFM, stats)
+            last_send = loop.time()
+    finally:
+        tracking_input.remove_listener(frame_ready.set)
+
+async def start_iFM_Sender(iFM, tracking_input=None, mode='poll', max_rate=MAX_RATE, keepalive=KEEPALIVE):
+    """Start iFM sender. Rate is set to FREQ on poll mode. Event mode sends every frame processed by tracking_input"""
+    print("Setting up iFM sender", flush=True)
+    for dest in iFM.destinations:
+        print(f"Sending iFM to {dest.host}:{dest.addr[1]} ({dest.addr[0]})", flush=True)
+    
+    # Inter-packet timing
+    stats = IntervalStats()
+    reporter = None
+    if debug_settings['debug_timing']:
+        reporter = asyncio.create_task(timing_reporter(stats))
+    try:
+        if mode == 'event':
+            await event_sender(iFM, stats, tracking_input, max_rate, keepalive)
+        else:
+            await poll_sender(iFM, stats)
     except asyncio.CancelledError:
         pass
     finally:
         print("Stopping iFM sender", flush=True)
-        transport.close()
\ No newline at end of file
+        if reporter is not None:
+            reporter.cancel()
+        print(f"iFM timing: {stats}", flush=True)
+        for dest in iFM.destinations:
+            print(f"iFM destination {dest}", flush=True)
+        iFM.close()
@@ -1 +1 @@
-from .mediapipe import mediapipe_start
\ No newline at end of file
+from .mediapipe import ROTATION_SCALE, mediapipe_start
\ No newline at end of file
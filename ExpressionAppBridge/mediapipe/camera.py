@@ -1,9 +1,10 @@
-from pygrabber.dshow_graph import FilterGraph
-import threading
-import numpy as np
+from ExpressionAppBridge.frame_source import FrameSource, SyntheticSource, VideoSource, parse_source
 
 # Create camera graph, ask user for camera selection and resolution
 def create_guided_camera_graph_flow():
+    # DirectShow is Windows only, import it when actually used
+    from pygrabber.dshow_graph import FilterGraph
+    
     # Instance PyGrabber graph
     graph = FilterGraph()
     
@@ -47,24 +48,31 @@ def create_guided_camera_graph_flow():
     
     return graph
 
-# Create camera backend using guided workflow
-def create_camera_backend():
-    return CameraBackend(create_guided_camera_graph_flow())
+# Create the frame source. The DirectShow camera goes through the guided workflow
+# convert builds what readers get from each image, see frame_source.py
+def create_camera_backend(source=None, rate=None, max_frames=None, loop=False, convert=None):
+    kind, arg = parse_source(source)
+    if kind == 'synthetic':
+        return SyntheticSource(arg[0], arg[1], rate=rate, max_frames=max_frames, convert=convert)
+    if kind == 'file':
+        return VideoSource(arg, rate=rate, max_frames=max_frames, loop=loop, convert=convert)
+    return CameraBackend(create_guided_camera_graph_flow(), max_frames=max_frames, convert=convert)
 
-class CameraBackend:
-    def __init__(self, graph):
+class CameraBackend(FrameSource):
+    """DirectShow camera through pygrabber. Frames come in on the grabber callback"""
+    def __init__(self, graph, max_frames=None, convert=None):
+        super().__init__(max_frames=max_frames, convert=convert)
         self.graph = graph
         self.graph.add_sample_grabber(self.img_cb)
         self.graph.add_null_render()
         self.graph.prepare_preview_graph()
         self.graph.run()
-        self.image_done = threading.Event()
-        self.image_grabbed = None
     def img_cb(self, image):
-        self.image_grabbed = image
-        self.image_done.set()
-    def read(self):
-        self.image_done.clear()
+        # The grabber buffer is only valid during the callback. Copy or convert it right away
+        self.publish(image)
+    def grab(self):
+        ''' Ask the grabber for a frame. img_cb publishes it '''
         self.graph.grab_frame()
-        ret = self.image_done.wait(1000)
-        return ret, np.array(self.image_grabbed)
\ No newline at end of file
+        return True
+    def close(self):
+        self.graph.stop()
\ No newline at end of file
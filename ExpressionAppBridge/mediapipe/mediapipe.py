@@ -1,7 +1,11 @@
+from ExpressionAppBridge.frame_ring import Frame
 from ExpressionAppBridge.mediapipe.camera import create_camera_backend
-from ExpressionAppBridge.tracking_data import TrackingData
+from ExpressionAppBridge.mediapipe.pose import matrix_pose
+from ExpressionAppBridge.pipeline import LatestSlot, StageTimer
+from ExpressionAppBridge.tracking_data import BLENDSHAPE_INDEX, TrackingData
 
-import time, transforms3d, threading
+import math, time, threading
+import numpy as np
 
 # Math constants
 ROT_X_FACTOR = 100
@@ -11,6 +15,12 @@ POS_X_FACTOR = -0.01
 POS_Y_FACTOR = 0.01
 POS_Z_FACTOR = 0.01
 
+# Degrees per unit of the head rotation angles above, for the rotation filters
+ROTATION_SCALE = (math.degrees(1) / ROT_X_FACTOR, math.degrees(1) / ROT_Y_FACTOR, math.degrees(1) / ROT_Z_FACTOR)
+
+# Status line update period. In seconds
+STATUS_PERIOD = 1
+
 # Mapping from mediapipe parameters to iFM
 # The mediapipe parameters seem to be mirrored so Left and Right are mapped opposite
 mediapipe_to_ifm = {
@@ -74,11 +84,105 @@ mediapipe_to_ifm = {
 }
 
 def process_BlendShapes_into_TrackingData(Blendshapes, tracking_data):
+    ''' Name based mapping. Slow, used when the category list does not fit the mapper '''
     for C in Blendshapes[0]:
-        if C.category_name in mediapipe_to_ifm.keys():
+        if C.category_name in mediapipe_to_ifm:
             tracking_data.blendshapes[mediapipe_to_ifm[C.category_name]] = C.score * 100
 
-def mediapipe_start(cal, iFM):
+class BlendshapeMapper:
+    """Maps mediapipe blendshape categories to the blendshape slots by index.
+    The category order is resolved to an index permutation from the names of the first result.
+    Later results only get their length and one mapped name checked, and go through a single
+    gather. If the categories ever change the permutation is resolved again, and if they can not
+    be resolved the name based mapping is used."""
+    def __init__(self):
+        self.names = None
+        self.src = None
+        self.dst = None
+        self.check = None
+        self.check_name = None
+    def resolve(self, categories):
+        ''' Build the index permutation from the category names. False if they do not map '''
+        names = [C.category_name for C in categories]
+        self.names = names
+        src = [i for i, name in enumerate(names) if name in mediapipe_to_ifm]
+        dst = [BLENDSHAPE_INDEX[mediapipe_to_ifm[names[i]]] for i in src]
+        if len(src) == 0 or len(set(dst)) != len(dst):
+            self.src = None
+            return False
+        if len(src) != len(mediapipe_to_ifm):
+            missing = sorted(set(mediapipe_to_ifm) - set(names))
+            print(f"Mediapipe blendshapes missing from the model: {', '.join(missing)}")
+        self.src = np.array(src, dtype=np.intp)
+        self.dst = np.array(dst, dtype=np.intp)
+        self.check = src[-1]
+        self.check_name = names[self.check]
+        return True
+    def matches(self, categories):
+        ''' Cheap check that categories still have the resolved layout '''
+        return len(categories) == len(self.names) and categories[self.check].category_name == self.check_name
+    def apply(self, Blendshapes, tracking_data):
+        ''' Write the scores of the first face into tracking_data, scaled to 0-100 '''
+        categories = Blendshapes[0]
+        if self.src is None or not self.matches(categories):
+            # First result or the model categories changed
+            if self.names is None or [C.category_name for C in categories] != self.names:
+                self.resolve(categories)
+            if self.src is None:
+                process_BlendShapes_into_TrackingData(Blendshapes, tracking_data)
+                return
+        scores = np.fromiter((C.score for C in categories), dtype=float, count=len(categories))
+        scores *= 100
+        tracking_data.blendshape_values[self.dst] = scores[self.src]
+
+def process_Transform_into_TrackingData(matrix, tracking_data):
+    (tx, ty, tz), (rx, ry, rz) = matrix_pose(matrix)
+    tracking_data.head[:] = (rx * ROT_X_FACTOR, ry * ROT_Y_FACTOR, rz * ROT_Z_FACTOR, tx * POS_X_FACTOR, ty * POS_Y_FACTOR, tz * POS_Z_FACTOR)
+
+def capture_loop(cap, frames, timer, stop):
+    ''' Capture stage. Pass leased camera frames to the frames slot '''
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                print("Can't receive frame (stream end?). Exiting ...")
+                break
+            timer.record(start)
+            frames.put(frame)
+    finally:
+        frames.close()
+
+def output_loop(cal, iFM, results, timers, stop):
+    ''' Output stage. Calibrate and send every landmarker result as soon as it arrives '''
+    # Temporary tracking data storage
+    temp_td = TrackingData()
+    # mediapipe does not give us confidence
+    temp_td.confidence = 100
+    mapper = BlendshapeMapper()
+    
+    while not stop.is_set():
+        item = results.get(STATUS_PERIOD)
+        if item is None:
+            continue
+        result, captured = item
+        start = time.perf_counter()
+        
+        # Capture to result time covers conversion, queueing and inference
+        timers['detect'].record(captured, start)
+        try:
+            process_Transform_into_TrackingData(result.facial_transformation_matrixes[0], temp_td)
+            mapper.apply(result.face_blendshapes, temp_td)
+        except IndexError:
+            # No face on this frame
+            continue
+        # Filters run on capture time, not on when inference happened to finish
+        cal.input_tracking(temp_td, captured)
+        iFM.udp_send()
+        timers['output'].record(start)
+        timers['total'].record(captured)
+
+def mediapipe_start(cal, iFM, source=None, rate=None, max_frames=None, loop=False):
     
     # Import mediapipe
     import mediapipe as mp
@@ -89,21 +193,16 @@ def mediapipe_start(cal, iFM):
     FaceLandmarkerOptions = mp.tasks.vision.FaceLandmarkerOptions
     VisionRunningMode = mp.tasks.vision.RunningMode
     
-    # Temporary tracking data storage
-    temp_td = TrackingData()
-    # mediapipe does not give us confidence
-    temp_td.confidence = 100
-    
-    # FaceLandmarker payload
-    FrameInfo = None
-    FrameReady = threading.Event()
+    # Stages hand over the newest item only. Stale frames and results are dropped
+    frames = LatestSlot(on_drop=Frame.release)
+    results = LatestSlot()
+    stop = threading.Event()
+    timers = {name: StageTimer(name) for name in ['capture', 'submit', 'detect', 'output', 'total']}
     
-    # FaceLandmarker callback function
-    def onDetect(DetectionResult, Image, Cnf):
-        nonlocal FrameInfo
-        nonlocal FrameReady
-        FrameInfo = DetectionResult
-        FrameReady.set()
+    # FaceLandmarker callback function. Runs on the landmarker thread
+    # Timestamps are the capture time in ms, see below
+    def onDetect(DetectionResult, Image, Timestamp):
+        results.put((DetectionResult, Timestamp / 1000))
     
     # Set landmarker options
     options = FaceLandmarkerOptions(
@@ -114,48 +213,52 @@ def mediapipe_start(cal, iFM):
         result_callback=onDetect)
     
     with FaceLandmarker.create_from_options(options) as landmarker:
-        # Create camera backend
-        cap = create_camera_backend()
+        # Create camera backend. See frame_source.py for the source options
+        # Frames are turned into mp.Image as they are captured. mp.Image copies the pixels into its own
+        # ImageFrame, which is the only copy a frame goes through. The landmarker never reads a capture buffer
+        cap = create_camera_backend(source, rate, max_frames, loop, lambda image: mp.Image(image_format=mp.ImageFormat.SRGB, data=image))
         
-        start = None
+        capture = threading.Thread(target=capture_loop, args=(cap, frames, timers['capture'], stop), daemon=True)
+        output = threading.Thread(target=output_loop, args=(cal, iFM, results, timers, stop), daemon=True)
+        capture.start()
+        output.start()
+        
+        last_timestamp = -1
+        next_status = time.monotonic() + STATUS_PERIOD
         try:
-            while True:
-                start = time.time()
-                # Capture frame-by-frame
-                ret, frame = cap.read()
-                if not ret:
-                    print("Can't receive frame (stream end?). Exiting ...")
-                    break
-                
-                # Convert to mediapipe format
-                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
-                
-                # Send to landmarker, timestamp in ms
-                landmarker.detect_async(mp_image, int(time.time()*1000))
-                
-                if FrameReady.is_set():
-                    FrameReady.clear()
-                    try:
-                        affine = transforms3d.affines.decompose(FrameInfo.facial_transformation_matrixes[0])
-                        translation = affine[0]
-                        rotation_euler = transforms3d.euler.mat2euler(affine[1])
-                        
-                        temp_td.head[0] = rotation_euler[0] * ROT_X_FACTOR
-                        temp_td.head[1] = rotation_euler[1] * ROT_Y_FACTOR
-                        temp_td.head[2] = rotation_euler[2] * ROT_Z_FACTOR
-                        
-                        temp_td.head[3] = translation[0] * POS_X_FACTOR
-                        temp_td.head[4] = translation[1] * POS_Y_FACTOR
-                        temp_td.head[5] = translation[2] * POS_Z_FACTOR
-                        
-                        process_BlendShapes_into_TrackingData(FrameInfo.face_blendshapes, temp_td)
-                        
-                        cal.input_tracking(temp_td)
-                        
-                        payload = str(iFM)
-                        iFM.udp_send()
-                        print(f"Running... {int(1/(time.time() - start))} FPS", end='\r')
-                    except IndexError:
-                        pass
+            while capture.is_alive() or frames.full:
+                item = frames.get(STATUS_PERIOD)
+                now = time.monotonic()
+                if now >= next_status:
+                    next_status = now + STATUS_PERIOD
+                    print("Running... " + " | ".join(timers[name].short() for name in ['capture', 'detect', 'output']) + "    ", end='\r')
+                if item is None:
+                    continue
+                with item as frame:
+                    # Landmarker timestamps are in ms and must go up. Use the capture time, a perf_counter
+                    # reading. monotonic ticks every 15.6 ms on Windows and frames on the same tick would be dropped
+                    timestamp = int(frame.timestamp * 1000)
+                    if timestamp <= last_timestamp:
+                        continue
+                    last_timestamp = timestamp
+                    
+                    # frame.image is the mp.Image built on capture
+                    start = time.perf_counter()
+                    landmarker.detect_async(frame.image, timestamp)
+                    timers['submit'].record(start)
         except KeyboardInterrupt:
-            print("Closing...")
\ No newline at end of file
+            print("Closing...")
+        finally:
+            stop.set()
+            frames.close()
+            results.close()
+            capture.join(STATUS_PERIOD)
+            output.join()
+            cap.close()
+    
+    # Per stage timing
+    print()
+    for name in ['capture', 'submit', 'detect', 'output', 'total']:
+        print(timers[name])
+    print(f"Dropped {frames.dropped} frames waiting for the landmarker and {results.dropped} results waiting for output")
+    print(f"Camera ring: {cap.ring.written} frames captured, {cap.ring.dropped} dropped with every buffer in use")
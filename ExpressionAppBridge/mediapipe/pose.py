@@ -0,0 +1,85 @@
+'''
+pose.py
+
+Head pose from mediapipe facial transformation matrices.
+
+Translation is read straight from the last column. The rotation block is orthonormalized by
+Gram-Schmidt on its columns, dropping scale and shear, then converted to static xyz Euler
+angles in closed form. Results match transforms3d affines.decompose followed by euler.mat2euler.
+
+head_pose works on a single 4x4 matrix or any stack of them, IE. faces x frames x 4 x 4.
+matrix_pose does the same for a single matrix on Python floats, which is several times faster
+than numpy for the one face of each frame.
+'''
+import math
+import numpy as np
+
+# Below this, the y rotation is treated as +-90 degrees. Same threshold as transforms3d
+GIMBAL_EPS = np.finfo(float).eps * 4.0
+
+def rotation_block(matrices):
+    ''' Orthonormal rotation part of affine matrices, scale and shear removed '''
+    m = np.asarray(matrices, dtype=float)[..., :3, :3]
+    c0, c1, c2 = m[..., :, 0], m[..., :, 1], m[..., :, 2]
+
+    # Gram-Schmidt on the columns
+    c0 = c0 / np.linalg.norm(c0, axis=-1, keepdims=True)
+    c1 = c1 - np.sum(c0 * c1, axis=-1, keepdims=True) * c0
+    c1 = c1 / np.linalg.norm(c1, axis=-1, keepdims=True)
+    c2 = c2 - np.sum(c0 * c2, axis=-1, keepdims=True) * c0 - np.sum(c1 * c2, axis=-1, keepdims=True) * c1
+    c2 = c2 / np.linalg.norm(c2, axis=-1, keepdims=True)
+
+    # Mirrored transforms get a negative x scale instead of a reflection
+    flip = np.sum(np.cross(c0, c1) * c2, axis=-1, keepdims=True) < 0
+    c0 = np.where(flip, -c0, c0)
+    return np.stack([c0, c1, c2], axis=-1)
+
+def euler_sxyz(rotations):
+    ''' Static xyz Euler angles in radians of rotation matrices, last axis is x, y, z '''
+    r = np.asarray(rotations, dtype=float)
+    cy = np.hypot(r[..., 0, 0], r[..., 1, 0])
+    regular = cy > GIMBAL_EPS
+    ax = np.where(regular, np.arctan2(r[..., 2, 1], r[..., 2, 2]), np.arctan2(-r[..., 1, 2], r[..., 1, 1]))
+    ay = np.arctan2(-r[..., 2, 0], cy)
+    az = np.where(regular, np.arctan2(r[..., 1, 0], r[..., 0, 0]), 0.0)
+    return np.stack([ax, ay, az], axis=-1)
+
+def head_pose(matrices):
+    ''' Translation and static xyz Euler angles in radians of affine matrices '''
+    m = np.asarray(matrices, dtype=float)
+    return m[..., :3, 3], euler_sxyz(rotation_block(m))
+
+def matrix_pose(matrix):
+    ''' head_pose of a single affine matrix with the math module. Returns translation and angles as tuples '''
+    (m00, m01, m02, t0), (m10, m11, m12, t1), (m20, m21, m22, t2) = np.asarray(matrix, dtype=float)[:3].tolist()
+    try:
+        # Gram-Schmidt on the columns a, b and c
+        n = math.sqrt(m00 * m00 + m10 * m10 + m20 * m20)
+        a0, a1, a2 = m00 / n, m10 / n, m20 / n
+        d = a0 * m01 + a1 * m11 + a2 * m21
+        b0, b1, b2 = m01 - d * a0, m11 - d * a1, m21 - d * a2
+        n = math.sqrt(b0 * b0 + b1 * b1 + b2 * b2)
+        b0, b1, b2 = b0 / n, b1 / n, b2 / n
+        da = a0 * m02 + a1 * m12 + a2 * m22
+        db = b0 * m02 + b1 * m12 + b2 * m22
+        c0, c1, c2 = m02 - da * a0 - db * b0, m12 - da * a1 - db * b1, m22 - da * a2 - db * b2
+        n = math.sqrt(c0 * c0 + c1 * c1 + c2 * c2)
+        c0, c1, c2 = c0 / n, c1 / n, c2 / n
+    except ZeroDivisionError:
+        # Degenerate matrix. The numpy version gives the same NaNs as before
+        translation, angles = head_pose(matrix)
+        return tuple(translation.tolist()), tuple(angles.tolist())
+
+    # Mirrored transforms get a negative x scale instead of a reflection
+    if (a1 * b2 - a2 * b1) * c0 + (a2 * b0 - a0 * b2) * c1 + (a0 * b1 - a1 * b0) * c2 < 0:
+        a0, a1, a2 = -a0, -a1, -a2
+
+    # Same as euler_sxyz, the rotation matrix columns being a, b and c
+    cy = math.hypot(a0, a1)
+    if cy > GIMBAL_EPS:
+        ax = math.atan2(b2, c2)
+        az = math.atan2(a1, a0)
+    else:
+        ax = math.atan2(-c1, b1)
+        az = 0.0
+    return (t0, t1, t2), (ax, math.atan2(-a2, cy), az)
@@ -0,0 +1,76 @@
+'''
+pipeline.py
+
+Helpers to run tracking as a set of threaded stages.
+
+LatestSlot hands items from one stage to the next keeping only the newest one, so a slow stage
+works on fresh data instead of a backlog.
+StageTimer keeps per stage duration statistics.
+'''
+import threading, time
+from .timing import IntervalStats
+
+class LatestSlot:
+    """Single item queue where put replaces any item not yet taken. on_drop is called with every
+    replaced item, to give back resources it holds"""
+    def __init__(self, on_drop=None):
+        self.on_drop = on_drop
+        self.cond = threading.Condition()
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.put_count = 0
+        self.dropped = 0
+    def put(self, item):
+        """Store item, replacing the previous one if it was not taken"""
+        with self.cond:
+            if self.full:
+                self.dropped = self.dropped + 1
+                if self.on_drop is not None:
+                    self.on_drop(self.item)
+            self.item = item
+            self.full = True
+            self.put_count = self.put_count + 1
+            self.cond.notify()
+    def get(self, timeout=None):
+        """Take the newest item. None on timeout or once closed and empty"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.full or self.closed, timeout)
+            if not self.full:
+                return None
+            item = self.item
+            self.item = None
+            self.full = False
+            return item
+    def close(self):
+        """Wake up every waiting get"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class StageTimer:
+    """Duration and rate statistics for a pipeline stage. All values in seconds"""
+    def __init__(self, name):
+        self.name = name
+        self.durations = IntervalStats()
+        self.rate = IntervalStats()
+    def record(self, start, end=None):
+        """Record a run of the stage that started at start, perf_counter seconds"""
+        if end is None:
+            end = time.perf_counter()
+        self.durations.add(end - start)
+        self.rate.mark(end)
+    def fps(self):
+        """Runs per second over the latest runs"""
+        intervals = self.rate.intervals
+        if len(intervals) == 0:
+            return 0
+        recent = list(intervals)[-30:]
+        return len(recent) / sum(recent) if sum(recent) > 0 else 0
+    def short(self):
+        """Compact status, mean duration and rate"""
+        s = self.durations.summary()
+        return f"{self.name} {s['mean']*1000:.1f}ms {self.fps():.1f}/s"
+    def __str__(self):
+        s = self.durations.summary()
+        return f"{self.name}: {s['count']} runs, mean {s['mean']*1000:.2f}ms, p99 {s['p99']*1000:.2f}ms, max {s['max']*1000:.2f}ms, {self.fps():.1f}/s"
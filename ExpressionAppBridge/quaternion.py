@@ -1,4 +1,17 @@
+'''
+quaternion.py
+
+Quaternion helpers for head rotation.
+
+euler_from_quaternion, quaternion_from_euler and slerp_quaternion work on a single quaternion
+with the math module, which is the fastest for the one head rotation of each frame. The rest
+work on numpy stacks of quaternions, IE. a whole recording, at once.
+'''
 import math
+import numpy as np
+
+# Below this angle between two quaternions slerp falls back to normalized lerp
+SLERP_EPS = 1e-6
  
 def euler_from_quaternion(x, y, z, w):
         """
@@ -18,4 +31,93 @@ def euler_from_quaternion(x, y, z, w):
         t4 = +1.0 - 2.0 * (y * y + z * z)
         yaw_z = math.atan2(t3, t4)
      
-        return math.degrees(roll_x), math.degrees(pitch_y), math.degrees(yaw_z) # in degrees
\ No newline at end of file
+        return math.degrees(roll_x), math.degrees(pitch_y), math.degrees(yaw_z) # in degrees
+
+def quaternion_from_euler(roll_x, pitch_y, yaw_z):
+    ''' Inverse of euler_from_quaternion. Degrees to x, y, z, w '''
+    hr, hp, hy = math.radians(roll_x) / 2, math.radians(pitch_y) / 2, math.radians(yaw_z) / 2
+    cr, sr = math.cos(hr), math.sin(hr)
+    cp, sp = math.cos(hp), math.sin(hp)
+    cy, sy = math.cos(hy), math.sin(hy)
+    return (
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+        cr * cp * cy + sr * sp * sy
+    )
+
+def slerp_quaternion(q0, q1, t):
+    ''' Spherical interpolation between two unit quaternions along the shorter arc '''
+    dot = q0[0] * q1[0] + q0[1] * q1[1] + q0[2] * q1[2] + q0[3] * q1[3]
+    if dot < 0:
+        q1 = (-q1[0], -q1[1], -q1[2], -q1[3])
+        dot = -dot
+    theta = math.acos(min(dot, 1.0))
+    sin_theta = math.sin(theta)
+    if sin_theta < SLERP_EPS:
+        w0, w1 = 1 - t, t
+    else:
+        w0, w1 = math.sin((1 - t) * theta) / sin_theta, math.sin(t * theta) / sin_theta
+    q = [w0 * a + w1 * b for a, b in zip(q0, q1)]
+    n = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+    return (q[0] / n, q[1] / n, q[2] / n, q[3] / n)
+
+# Vectorized versions. Quaternions are x, y, z, w on the last axis and Euler angles are
+# roll x, pitch y, yaw z in degrees, same convention as euler_from_quaternion
+
+def normalize(q):
+    ''' Unit length quaternions '''
+    q = np.asarray(q, dtype=float)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+def eulers_from_quaternions(q):
+    ''' euler_from_quaternion over any stack of quaternions. Returns (..., 3) degrees '''
+    q = np.asarray(q, dtype=float)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    roll_x = np.arctan2(2.0 * (w * x + y * z), 1.0 - 2.0 * (x * x + y * y))
+    pitch_y = np.arcsin(np.clip(2.0 * (w * y - z * x), -1.0, 1.0))
+    yaw_z = np.arctan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+    return np.degrees(np.stack([roll_x, pitch_y, yaw_z], axis=-1))
+
+def quaternions_from_eulers(angles):
+    ''' Inverse of eulers_from_quaternions. (..., 3) degrees to (..., 4) unit quaternions '''
+    half = np.radians(np.asarray(angles, dtype=float)) / 2
+    c, s = np.cos(half), np.sin(half)
+    cr, cp, cy = c[..., 0], c[..., 1], c[..., 2]
+    sr, sp, sy = s[..., 0], s[..., 1], s[..., 2]
+    return np.stack([
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+        cr * cp * cy + sr * sp * sy
+    ], axis=-1)
+
+def align(q, reference):
+    ''' Flip quaternions to the same hemisphere as reference. q and -q are the same rotation '''
+    q = np.asarray(q, dtype=float)
+    dot = np.sum(q * reference, axis=-1, keepdims=True)
+    return np.where(dot < 0, -q, q)
+
+def average(q, weights=None, axis=0):
+    ''' Normalized weighted mean of quaternions along axis. Good for rotations close together '''
+    q = np.moveaxis(np.asarray(q, dtype=float), axis, 0)
+    q = align(q, q[0])
+    if weights is None:
+        total = q.sum(axis=0)
+    else:
+        total = np.tensordot(np.asarray(weights, dtype=float), q, axes=(0, 0))
+    return normalize(total)
+
+def slerp(q0, q1, t):
+    ''' Spherical interpolation from q0 to q1 along the shorter arc. t broadcasts over the stack '''
+    q0 = normalize(q0)
+    q1 = align(normalize(q1), q0)
+    t = np.asarray(t, dtype=float)[..., None]
+    dot = np.clip(np.sum(q0 * q1, axis=-1, keepdims=True), -1.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    small = sin_theta < SLERP_EPS
+    safe = np.where(small, 1.0, sin_theta)
+    w0 = np.where(small, 1 - t, np.sin((1 - t) * theta) / safe)
+    w1 = np.where(small, t, np.sin(t * theta) / safe)
+    return normalize(w0 * q0 + w1 * q1)
@@ -0,0 +1,218 @@
+'''
+recording.py
+
+Record tracking sessions and replay them.
+
+A recording taps the tracking pipeline at one point:
+
+raw     ExpressionApp datagrams as they arrive. RTX tracking only
+parsed  TrackingData handed to TrackingInput, before filters and calibration
+output  TrackingData after calibration, as sent over iFM
+
+Each tap goes to its own append-only file. Files start with a HEADER_SIZE byte header followed
+by fixed size records of a perf_counter timestamp, a sequence number and the payload. parsed and
+output payloads are the confidence and the TrackingData buffer as float32, parsed ones add the
+tracker head quaternion and whether there was one. raw payloads are the datagram bytes padded
+to RAW_RECORD_BYTES. Fixed records let replay memory map the file and index any frame directly.
+A partial record at the end, IE. after a crash, is ignored.
+
+Replay feeds recordings back at their original pace, scaled by speed, or as fast as possible
+with speed 0. raw recordings go through ExpressionAppRunner.onMessage, parsed ones through
+TrackingInput.input_tracking and output ones straight to iFM. Frames carry their recorded
+timestamps, so time based filters give the same output at any speed.
+'''
+import os, struct, time
+import numpy as np
+from .rtxtracking.decoder import is_calibration
+from .tracking_data import BUFFER_SIZE, TrackingData
+
+TAPS = ['raw', 'parsed', 'output']
+
+# File header. Magic, tap, tracking mode, record size, channel count, wall clock start time
+MAGIC = b'EABREC01'
+HEADER_FORMAT = '<8s8s16sIId'
+HEADER_SIZE = 64
+
+# Biggest datagram a raw record holds. ExpressionApp packets are around 5KB
+RAW_RECORD_BYTES = 16384
+
+# Channels of parsed and output records. Confidence followed by the TrackingData buffer
+CHANNEL_COUNT = BUFFER_SIZE + 1
+
+# Time between the last record of a file and the first one appended to it. In seconds
+APPEND_GAP = 1.0
+
+def record_dtype(tap):
+    ''' numpy dtype of a record for tap '''
+    if tap == 'raw':
+        return np.dtype([('timestamp', '<f8'), ('seq', '<u4'), ('size', '<u4'), ('data', 'u1', RAW_RECORD_BYTES)])
+    if tap == 'parsed':
+        # TrackingData.rotation, x y z w. The rotation filters use it over the buffer angles
+        return np.dtype([('timestamp', '<f8'), ('seq', '<u4'), ('channels', '<f4', CHANNEL_COUNT), ('rotation', '<f8', 4), ('has_rotation', 'u1')])
+    return np.dtype([('timestamp', '<f8'), ('seq', '<u4'), ('channels', '<f4', CHANNEL_COUNT)])
+
+def recordingPath(prefix, tap):
+    ''' File for tap of a recording named prefix, IE. session.parsed.rec '''
+    return f"{prefix}.{tap}.rec"
+
+def readHeader(f):
+    ''' tap, tracking mode and start time of an open recording. ValueError if it is not one '''
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("File too short for a recording header")
+    magic, tap, mode, record_size, channels, started = struct.unpack_from(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError("Not a tracking recording")
+    tap = tap.rstrip(b'\x00').decode()
+    if tap not in TAPS or record_size != record_dtype(tap).itemsize:
+        raise ValueError(f"Unsupported recording layout for tap {tap}")
+    return tap, mode.rstrip(b'\x00').decode(), started
+
+class Recorder:
+    """Appends records of one tap to a recording file. Appending to an existing file of the
+    same tap continues it. perf_counter has a different origin in every process, so appended
+    timestamps are moved to start APPEND_GAP after the last record"""
+    def __init__(self, path, tap, mode=''):
+        if tap not in TAPS:
+            raise ValueError(f"Invalid tap {tap}, expected one of {', '.join(TAPS)}")
+        self.path = path
+        self.tap = tap
+        self.record = np.zeros(1, dtype=record_dtype(tap))
+        self.seq = 0
+        # Added to every timestamp. resume is where the first appended record goes
+        self.offset = 0
+        self.resume = None
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                existing, _, _ = readHeader(f)
+            if existing != tap:
+                raise ValueError(f"{path} holds {existing} records, not {tap}")
+            size = os.path.getsize(path) - HEADER_SIZE
+            self.seq = size // self.record.itemsize
+            # Drop a partial record so the file stays aligned
+            with open(path, 'r+b') as f:
+                f.truncate(HEADER_SIZE + self.seq * self.record.itemsize)
+                if self.seq > 0:
+                    f.seek(HEADER_SIZE + (self.seq - 1) * self.record.itemsize)
+                    self.resume = struct.unpack('<d', f.read(8))[0] + APPEND_GAP
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            header = struct.pack(HEADER_FORMAT, MAGIC, tap.encode(), mode.encode(), self.record.itemsize, CHANNEL_COUNT, time.time())
+            self.file.write(header.ljust(HEADER_SIZE, b'\x00'))
+    def stamp(self, now):
+        ''' Record timestamp of a frame at now, the current time if None '''
+        if now is None:
+            now = time.perf_counter()
+        if self.resume is not None:
+            self.offset = self.resume - now
+            self.resume = None
+        return now + self.offset
+    def write_tracking(self, tracking_data, now=None):
+        ''' Append a parsed or output record '''
+        record = self.record
+        record['timestamp'] = self.stamp(now)
+        record['seq'] = self.seq
+        channels = record['channels'][0]
+        channels[0] = tracking_data.confidence
+        channels[1:] = tracking_data.buffer
+        if self.tap == 'parsed':
+            rotation = tracking_data.rotation
+            record['has_rotation'] = rotation is not None
+            record['rotation'][0] = rotation if rotation is not None else 0
+        self.file.write(record.tobytes())
+        self.seq = self.seq + 1
+    def write_raw(self, message, now=None):
+        ''' Append a raw datagram record. Datagrams bigger than RAW_RECORD_BYTES are skipped '''
+        if len(message) > RAW_RECORD_BYTES:
+            print(f"Datagram of {len(message)} bytes too big to record")
+            return
+        record = self.record
+        record['timestamp'] = self.stamp(now)
+        record['seq'] = self.seq
+        record['size'] = len(message)
+        data = record['data'][0]
+        data[:len(message)] = np.frombuffer(message, dtype=np.uint8)
+        data[len(message):] = 0
+        self.file.write(record.tobytes())
+        self.seq = self.seq + 1
+    def close(self):
+        self.file.close()
+        print(f"Recorded {self.seq} {self.tap} frames to {self.path}")
+
+class Recording:
+    """Memory mapped recording. records is a structured array with one row per frame"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.tap, self.mode, self.started = readHeader(f)
+        dtype = record_dtype(self.tap)
+        count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=dtype)
+    def __len__(self):
+        return len(self.records)
+    def duration(self):
+        ''' Seconds from the first to the last record '''
+        if len(self.records) < 2:
+            return 0
+        return float(self.records['timestamp'][-1] - self.records['timestamp'][0])
+    def message(self, i):
+        ''' Datagram bytes of raw record i '''
+        record = self.records[i]
+        return record['data'][:record['size']].tobytes()
+    def values(self):
+        ''' Frames x buffer array of a parsed or output recording '''
+        return self.records['channels'][:, 1:]
+    def load(self, i, tracking_data):
+        ''' Copy parsed or output record i into tracking_data '''
+        channels = self.records['channels'][i]
+        tracking_data.confidence = float(channels[0])
+        tracking_data.buffer[:] = channels[1:]
+        if self.tap == 'parsed' and self.records['has_rotation'][i]:
+            tracking_data.rotation = tuple(self.records['rotation'][i].tolist())
+        else:
+            tracking_data.rotation = None
+
+def replay(recording, handler, speed=1.0):
+    """Call handler with every record index. Paced to the recorded timestamps divided by speed,
+    as fast as possible if speed is 0. Returns the number of records replayed"""
+    timestamps = recording.records['timestamp']
+    if len(timestamps) == 0:
+        return 0
+    start = time.perf_counter()
+    first = float(timestamps[0])
+    for i in range(len(timestamps)):
+        if speed > 0:
+            delay = start + (float(timestamps[i]) - first) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        handler(i)
+    return len(timestamps)
+
+def replay_into(recording, cal, iFM, runner=None, speed=1.0):
+    """Replay a recording through the pipeline with the recorded timestamps. raw recordings need an
+    ExpressionAppRunner. Calibration answers on raw recordings are skipped so the ExpressionApp cal file is kept"""
+    timestamps = recording.records['timestamp']
+    if recording.tap == 'raw':
+        if runner is None:
+            raise ValueError("raw recordings replay through an ExpressionAppRunner")
+        def handler(i):
+            message = recording.message(i)
+            if is_calibration(message):
+                return
+            runner.onMessage(message, float(timestamps[i]))
+            iFM.udp_send()
+    elif recording.tap == 'parsed':
+        parsed = TrackingData()
+        def handler(i):
+            recording.load(i, parsed)
+            cal.input_tracking(parsed, float(timestamps[i]))
+            iFM.udp_send()
+    else:
+        def handler(i):
+            recording.load(i, iFM.tracking_data)
+            iFM.udp_send()
+    return replay(recording, handler, speed)
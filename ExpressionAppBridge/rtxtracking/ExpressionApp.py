@@ -4,75 +4,46 @@ ExpressionApp.py
 Manage the RTX Tracking ExpressionApp
 '''
 
-import asyncio, os, json, subprocess
+import asyncio, os, json, subprocess, socket, threading, time
+import numpy as np
 from ..config_utils import debug_settings, saveConfig
-from ..tracking_data import TrackingData
+from ..tracking_data import TrackingData, BLENDSHAPE_INDEX, EXP_IDX_TO_PERFECT_SYNC
 from ..quaternion import euler_from_quaternion
-from math import sqrt
+from .decoder import make_decoder, is_calibration
+from .head_position import HEAD_LANDMARKS, HeadPositionEstimator
 
-POSX_DIVIDER = 5000
-POSY_DIVIDER = 5000
-POSZ_DIVIDER = 2000
+# Number of 'pts' values used by headPos. Resolution plus the jawline landmarks
+HEAD_PTS_COUNT = 2 + HEAD_LANDMARKS * 2
 
-EXP_IDX_TO_PERFECT_SYNC = [
-    "browDown_L",         # 0
-    "browDown_R",         # 1
-    "browInnerUp",        # 2 browInnerUp_L
-    "browInnerUp",        # 3 browInnerUp_R - Average both
-    "browOuterUp_L",      # 4
-    "browOuterUp_R",      # 5
-    "cheekPuff",          # 6 - cheekPuff_L
-    "cheekPuff",          # 7 - cheekPuff_R - Average both
-    "cheekSquint_L",      # 8
-    "cheekSquint_R",      # 9
-    "eyeBlink_L",         # 10
-    "eyeBlink_R",         # 11
-    "eyeLookDown_L",      # 12
-    "eyeLookDown_R",      # 13
-    "eyeLookIn_L",        # 14
-    "eyeLookIn_R",        # 15
-    "eyeLookOut_L",       # 16
-    "eyeLookOut_R",       # 17
-    "eyeLookUp_L",        # 18
-    "eyeLookUp_R",        # 19
-    "eyeSquint_L",        # 20
-    "eyeSquint_R",        # 21
-    "eyeWide_L",          # 22
-    "eyeWide_R",          # 23
-    "jawForward",         # 24
-    "jawLeft",            # 25
-    "jawOpen",            # 26
-    "jawRight",           # 27
-    "mouthClose",         # 28
-    "mouthDimple_L",      # 29
-    "mouthDimple_R",      # 30
-    "mouthFrown_L",       # 31
-    "mouthFrown_R",       # 32
-    "mouthFunnel",        # 33
-    "mouthLeft",          # 34
-    "mouthLowerDown_L",   # 35
-    "mouthLowerDown_R",   # 36
-    "mouthPress_L",       # 37
-    "mouthPress_R",       # 38
-    "mouthPucker",        # 39
-    "mouthRight",         # 40
-    "mouthRollLower",     # 41
-    "mouthRollUpper",     # 42
-    "mouthShrugLower",    # 43
-    "mouthShrugUpper",    # 44
-    "mouthSmile_L",       # 45
-    "mouthSmile_R",       # 46
-    "mouthStretch_L",     # 47
-    "mouthStretch_R",     # 48
-    "mouthUpperUp_L",     # 49
-    "mouthUpperUp_R",     # 50
-    "noseSneer_L",        # 51
-    "noseSneer_R"         # 52
-]
+def build_exp_plan(mapping):
+    """Gather plan from expression indexes to blendshape slots. Returns the target slots and two
+    source index arrays. Blendshapes fed by a pair of expressions average both, the rest use the
+    same index twice."""
+    sources = {}
+    for i, name in enumerate(mapping):
+        sources.setdefault(name, []).append(i)
+    slots = np.array([BLENDSHAPE_INDEX[name] for name in sources])
+    first = np.array([idx[0] for idx in sources.values()])
+    second = np.array([idx[-1] for idx in sources.values()])
+    return slots, first, second
+
+# Expression to blendshape plan. browInnerUp and cheekPuff average their L/R pairs
+EXP_SLOTS, EXP_FIRST, EXP_SECOND = build_exp_plan(EXP_IDX_TO_PERFECT_SYNC)
 
 CAL_FILENAME = "config/RTX_internal_cal.json"
+# Calibration of stand-ins like the emulator. Kept apart so it does not replace the ExpressionApp one
+EMULATOR_CAL_FILENAME = "config/RTX_emulator_cal.json"
 CAL_DELAY = 10
 
+# Tracking packets listening address
+LISTEN_ADDR = ('127.0.0.1', 9140)
+
+# Ingest modes. 'all' processes every datagram, 'latest' only the newest one per loop iteration
+INGEST_MODES = ['all', 'latest']
+
+# Biggest datagram accepted by the latest ingest receiver
+MAX_DATAGRAM_SIZE = 65535
+
 # UDP Expressionapp protocol
 class ExpresssionAppProtocol:
     def __init__(self, onMessage):
@@ -86,6 +57,82 @@ class ExpresssionAppProtocol:
     def connection_lost(self, exc):
         pass
 
+def make_listen_socket(addr, rcvbuf=None):
+    """UDP socket bound to addr. rcvbuf sets the OS receive buffer size in bytes"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.bind(addr)
+    return sock
+
+# Newest datagram wins receiver
+class LatestDatagramReceiver:
+    """Drain the socket on a thread and hand only the newest datagram to the event loop.
+    Datagrams replaced before the loop got to them are dropped. Calibration answers are never dropped."""
+    def __init__(self, onMessage, loop, sock):
+        self.onMessage = onMessage
+        self.loop = loop
+        self.sock = sock
+        self.sock.settimeout(0.5)
+        
+        # Shared with the receiving thread
+        self.lock = threading.Lock()
+        self.latest = None
+        self.latest_count = 0
+        self.cal_messages = []
+        self.scheduled = False
+        
+        # Counters. Coalesced counts deliveries that replaced at least one datagram
+        self.received = 0
+        self.dropped = 0
+        self.coalesced = 0
+        
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    def run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                # close() shuts the socket down while we wait. Anything else stops tracking, say so
+                if self.running:
+                    print(f"ExpressionApp receiver stopped: {e}", flush=True)
+                break
+            with self.lock:
+                self.received = self.received + 1
+                if is_calibration(data):
+                    self.cal_messages.append(data)
+                else:
+                    if self.latest is not None:
+                        self.dropped = self.dropped + 1
+                    self.latest = data
+                    self.latest_count = self.latest_count + 1
+                
+                # A single delivery is queued on the loop at a time
+                if not self.scheduled:
+                    self.scheduled = True
+                    self.loop.call_soon_threadsafe(self.deliver)
+    def deliver(self):
+        with self.lock:
+            cal_messages, self.cal_messages = self.cal_messages, []
+            data, self.latest = self.latest, None
+            if self.latest_count > 1:
+                self.coalesced = self.coalesced + 1
+            self.latest_count = 0
+            self.scheduled = False
+        for message in cal_messages:
+            self.onMessage(message)
+        if data is not None:
+            self.onMessage(data)
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+        print(f"Ingest: {self.received} received, {self.dropped} dropped as stale, {self.coalesced} coalesced deliveries", flush=True)
+
 # UDP command sender
 class ExpressionAppSendProtocol:
     def __init__(self, message):
@@ -94,6 +141,8 @@ class ExpressionAppSendProtocol:
     def connection_made(self, transport):
         transport.sendto(self.message)
         transport.close()
+    def connection_lost(self, exc):
+        pass
 
 async def sendCommand(payload, port):
     loop = asyncio.get_running_loop()
@@ -136,7 +185,32 @@ def formatStr(format_number):
     except KeyError:
         return formats[1]
 
-def setup(config):
+def expAppCommand(config):
+    """Command that starts ExpressionApp.exe from the configured directory"""
+    return [os.path.join(config.get('expapp_dir', ""), "ExpressionApp.exe")]
+
+def parseCaps(output):
+    """Camera list from the --print_caps console output"""
+    return json.loads(output.split("\r\n\r\n\r\n")[1])
+
+def selectOption(count, message):
+    """Ask for a number below count. A single option is picked without asking"""
+    if count == 1:
+        print("->0")
+        return 0
+    while True:
+        try:
+            selected = int(input("->"))
+            if selected >= 0 and selected < count:
+                return selected
+            print(message)
+        except ValueError:
+            print(message)
+
+def setup(config, command=None):
+    """Ask for the camera settings. command starts a stand-in for ExpressionApp.exe, see emulator.py"""
+    if command is not None:
+        return setupCamera(command)
     save_config = False
     
     # Check for ExpressionApp.exe
@@ -158,28 +232,21 @@ def setup(config):
         config['expapp_dir'] = ExpAppPathInput
         saveConfig(config)
     
-    run_parameters = [
-        f"{ExpAppPathInput}\ExpressionApp.exe",
-        "--print_caps"
-    ]
+    return setupCamera(expAppCommand(config))
+
+def setupCamera(command):
+    run_parameters = command + ["--print_caps"]
     
     result = subprocess.run(run_parameters, capture_output=True)
     
-    data = json.loads(result.stdout.decode().split("\r\n\r\n\r\n")[1])
+    data = parseCaps(result.stdout.decode())
     
     print("Available cameras")
     for c in data:
         print(f"{c['id']} - {c['name']}")
     
     print("Select a camera")
-    while True:
-        try:
-            camera = int(input("->"))
-            if camera >= 0 and camera < len(data):
-                break
-            print("Please select a number corresponding to a camera")
-        except ValueError:
-            print("Please select a number corresponding to a camera")
+    camera = selectOption(len(data), "Please select a number corresponding to a camera")
     
     print("Available camera modes")
     for i, c in enumerate(data[camera]['caps']):
@@ -188,14 +255,7 @@ def setup(config):
         print(f"{i} - {c['maxCX']}x{c['maxCY']}@{fps} {codec}({c['format']})")
     
     print("Select a camera mode")
-    while True:
-        try:
-            camera_cap = int(input('->'))
-            if camera_cap >= 0 and camera_cap < len(data[camera]['caps']):
-                break
-            print("Please select a number corresponding a camera mode")
-        except ValueError:
-            print("Please select a number corresponding a camera mode")
+    camera_cap = selectOption(len(data[camera]['caps']), "Please select a number corresponding a camera mode")
     
     camera_conf = {
         "camera": camera,
@@ -206,20 +266,23 @@ def setup(config):
     
     return camera_conf
 
-def convert_exp(expr_in):
-    """ExpressionApp exp parameters are from 0 to 1. Convert to 0-100"""
-    out = expr_in * 100
-    if out > 100:
-        return 100
-    if out < 0:
-        return 0
-    return out
-
 class ExpressionAppRunner:
-    def __init__(self, cal_input, config, camera_config):
+    def __init__(self, cal_input, config, camera_config, decoder='fast', ingest='all', rcvbuf=None, command=None):
         # Internal container to parse data into
         self.parsed_data = TrackingData()
         
+        # Scratch buffers for the expression mapping
+        self.exp = np.zeros(len(EXP_IDX_TO_PERFECT_SYNC))
+        self.exp_first = np.zeros(len(EXP_SLOTS))
+        self.exp_second = np.zeros(len(EXP_SLOTS))
+        
+        # Datagram decoder
+        self.decode = make_decoder(decoder)
+        
+        # Datagram ingest mode and OS receive buffer size
+        self.ingest = ingest
+        self.rcvbuf = rcvbuf
+        
         # cal input in charge of consuming our parsed data
         self.cal = cal_input
         
@@ -229,56 +292,69 @@ class ExpressionAppRunner:
         # Config object generated from setup
         self.camera_config = camera_config
         
-        # Center coords for passing pos data
-        self.headCenter = [None, None, None]
+        # ExpressionApp command line. A stand-in like the emulator can replace ExpressionApp.exe
+        self.command = command if command is not None else expAppCommand(config)
+        self.cal_filename = CAL_FILENAME if command is None else EMULATOR_CAL_FILENAME
+        
+        # Head position from the landmarks
+        self.head_position = HeadPositionEstimator()
+        
+        # Callbacks run with every datagram and its timestamp before it is parsed
+        self.message_hooks = []
     def loadCal(self):
         try:
-            with open(CAL_FILENAME) as f:
+            with open(self.cal_filename) as f:
                 return(json.load(f))
         except FileNotFoundError:
             return([])
     def saveCal(self, cal):
-        with open(CAL_FILENAME, "w") as f:
+        with open(self.cal_filename, "w") as f:
             json.dump(cal, f)
         print("Cal saved!")
-    def headPos(self, pts):
-        if len(pts)<254:
-            return
-        # Points for left and right side of face
-        x1 = pts[2]
-        y1 = pts[3]
-        x2 = pts[66]
-        y2 = pts[67]
-        
-        # Average X and Y to get a single position point
-        x = (x2 + x1) / 2
-        y = (y2 + y1) / 2
-        
-        # Get distance between points 1 and 2
-        pointdist = sqrt((x2 - x1)**2 + (y2-y1)**2)
-        
-        # Store first position
-        if self.headCenter[0] is None:
-            self.headCenter = [x, y, pointdist]
+    def startRecording(self, recorder):
+        """Record every datagram before it is parsed. See recording.py"""
+        self.message_hooks.append(recorder.write_raw)
+    def headPos(self, pts, now):
+        self.head_position.update(pts, now, self.parsed_data.head)
+    def headRotation(self, rot):
+        """Store a x, y, z, w head rotation quaternion, and as Euler angles in degrees"""
+        # Kept so the rotation filters do not have to rebuild it from the angles
+        self.parsed_data.rotation = (rot[0], rot[1], rot[2], rot[3])
+        hx, hy, hz = euler_from_quaternion(rot[0], rot[1], rot[2], rot[3])
+        self.parsed_data.head[0] = hx
+        self.parsed_data.head[1] = hy
+        self.parsed_data.head[2] = hz
+    def mapExpressions(self, expressions):
+        """Store the ExpressionApp exp parameters on the blendshape slots"""
+        # ExpressionApp exp parameters are from 0 to 1. Convert to 0-100
+        self.exp[:] = expressions
+        np.multiply(self.exp, 100, out=self.exp)
+        np.clip(self.exp, 0, 100, out=self.exp)
         
-        # Calculate pos values
-        posx = (x - self.headCenter[0])/POSX_DIVIDER
-        posy = (self.headCenter[1] - y)/POSY_DIVIDER
-        posz = (pointdist - self.headCenter[2])/POSZ_DIVIDER
+        # Gather into the blendshape slots. Pairs are averaged
+        np.take(self.exp, EXP_FIRST, out=self.exp_first)
+        np.take(self.exp, EXP_SECOND, out=self.exp_second)
+        np.add(self.exp_first, self.exp_second, out=self.exp_first)
+        np.divide(self.exp_first, 2, out=self.exp_first)
+        self.parsed_data.blendshape_values[EXP_SLOTS] = self.exp_first
+    def onMessage(self, message, now=None):
+        """Parse message from ExpressionApp. now is the perf_counter timestamp of the datagram, the
+        current time if None"""
+        if now is None:
+            now = time.perf_counter()
         
-        # Store
-        self.parsed_data.head[3] = posx
-        self.parsed_data.head[4] = posy
-        self.parsed_data.head[5] = posz
-    def onMessage(self, message):
-        """Parse message from ExpressionApp"""
+        # Hooks on the datagram as received, IE. recording
+        for callback in self.message_hooks:
+            callback(message, now)
         
-        # JSON load
-        data = json.loads(message[:-1].decode('utf-8'))
+        # Decode the members we use
+        data = self.decode(message, HEAD_PTS_COUNT)
         
         # Check for cal message
         if len(data['cal']) > 0:
             self.saveCal(data['cal'])
+            # The user holds a neutral pose for calibration, take it as the head center too
+            self.head_position.recenter()
             return
         
         # Save confidence
@@ -292,30 +368,16 @@ class ExpressionAppRunner:
         points = data['pts']
         
         # Parse point data to get head position
-        self.headPos(points)
+        self.headPos(points, now)
         
         # Convert head rotation values
-        hx, hy, hz = euler_from_quaternion(head_rotation[0], head_rotation[1], head_rotation[2], head_rotation[3])
+        self.headRotation(head_rotation)
         
-        # Store head rotation values
-        self.parsed_data.head[0] = hx
-        self.parsed_data.head[1] = hy
-        self.parsed_data.head[2] = hz
-        
-        # Fill in the tracking data blendshape data according to mapping. Skip indexes 2/3 and 6/7
-        for i, x in enumerate(EXP_IDX_TO_PERFECT_SYNC):
-            if i in [2, 3, 6, 7]:
-                continue
-            self.parsed_data.blendshapes[x] = convert_exp(expressions[i])
-        
-        # Handle 2/3 for browInner. Average them
-        self.parsed_data.blendshapes['browInnerUp'] = (convert_exp(expressions[2]) + convert_exp(expressions[3]))/2
-        
-        # Handle 6/7 for cheekPuff same as browInner
-        self.parsed_data.blendshapes['cheekPuff'] = (convert_exp(expressions[6]) + convert_exp(expressions[7]))/2
+        # Map the expressions to blendshapes
+        self.mapExpressions(expressions)
         
         # With all blendshape and head rotation data parsed, we call tracking input so cal values are applied
-        self.cal.input_tracking(self.parsed_data)
+        self.cal.input_tracking(self.parsed_data, now)
     async def start(self, doCal):
         """Start nvidia ExpressionApp and start the UDP listener to receive the parameters"""
         # Open the cal file
@@ -327,7 +389,7 @@ class ExpressionAppRunner:
         parameters = [
             "--show=True",
             "--landmarks=True",
-            f"--model_path={self.config['expapp_dir']}\models",
+            f"--model_path={os.path.join(self.config.get('expapp_dir', ''), 'models')}",
             f"--cam_res={self.camera_config['res']}",
             "--expr_mode=2",
             f"--camera={self.camera_config['camera']}",
@@ -344,25 +406,32 @@ class ExpressionAppRunner:
         
         try:
             print("Opening ExpressionApp", flush=True)
-            ExpressionApp_process = await asyncio.create_subprocess_exec(f"{self.config['expapp_dir']}\ExpressionApp.exe", *parameters, 
+            ExpressionApp_process = await asyncio.create_subprocess_exec(*self.command, *parameters,
             stdout=None if debug_settings['debug_expapp'] else asyncio.subprocess.DEVNULL,
             stderr=None if debug_settings['debug_expapp'] else asyncio.subprocess.DEVNULL)
             
             print("Starting nvidia UDP listener")
             loop = asyncio.get_running_loop()
-            transport, protocol = await loop.create_datagram_endpoint(lambda: ExpresssionAppProtocol(self.onMessage),
-            local_addr=('127.0.0.1', 9140))
+            sock = make_listen_socket(LISTEN_ADDR, self.rcvbuf)
+            if self.ingest == 'latest':
+                transport = LatestDatagramReceiver(self.onMessage, loop, sock)
+            else:
+                transport, protocol = await loop.create_datagram_endpoint(lambda: ExpresssionAppProtocol(self.onMessage),
+                sock=sock)
             
             # Request calibration if cal file is missing
             if len(cal_file) < 1 or doCal:
                 asyncio.create_task(expAppCal(self.camera_config['camera']))
             
-            while True:
+            # Keep an eye on the process. The bridge stops if it exits
+            while ExpressionApp_process.returncode is None:
                 await asyncio.sleep(0.1)
+            print(f"ExpressionApp exited with code {ExpressionApp_process.returncode}", flush=True)
         except asyncio.CancelledError:
             pass
         finally:
             print("Closing ExpressionApp", flush=True)
-            ExpressionApp_process.terminate()
+            if ExpressionApp_process.returncode is None:
+                ExpressionApp_process.terminate()
             await ExpressionApp_process.wait()
             transport.close()
@@ -0,0 +1,66 @@
+'''
+decoder.py
+
+ExpressionApp datagram decoders. Both return the packet dict, see EXPAPP.md for its members.
+
+full_decode parses the whole JSON payload.
+fast_decode cuts the 'pts' array down to the values in use before parsing. Landmarks are
+most of the payload, so this skips most of the number parsing. Anything unexpected falls
+back to full_decode.
+
+orjson is used for parsing when installed, json otherwise.
+'''
+import json
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+DECODER_MODES = ['full', 'fast']
+
+def full_decode(message, pts_count=None):
+    """Parse the whole datagram. Trailing NULL char is dropped"""
+    return json_loads(message[:-1])
+
+def fast_decode(message, pts_count=None):
+    """Parse the datagram keeping only the first pts_count 'pts' values. All of them if pts_count is None"""
+    if pts_count is None:
+        return full_decode(message)
+
+    # Locate the landmark array
+    start = message.find(b'"pts"')
+    if start < 0:
+        return full_decode(message)
+    bracket = message.find(b'[', start)
+    end = message.find(b']', bracket)
+    if bracket < 0 or end < 0 or message[start + 5:bracket].strip() != b':':
+        return full_decode(message)
+
+    # Find the comma after the last value we need. Nothing to cut on short arrays
+    values = message[bracket + 1:end].split(b',', pts_count)
+    if len(values) <= pts_count:
+        return full_decode(message)
+    cut = end - len(values[-1]) - 1
+
+    # Parse the payload with the trimmed array
+    try:
+        return json_loads(message[:cut] + message[end:-1])
+    except ValueError:
+        return full_decode(message)
+
+def is_calibration(message):
+    """True if the datagram carries calibration values"""
+    start = message.find(b'"cal"')
+    if start < 0:
+        return False
+    bracket = message.find(b'[', start)
+    end = message.find(b']', bracket)
+    return bracket >= 0 and end >= 0 and message[bracket + 1:end].strip() != b''
+
+def make_decoder(mode='fast'):
+    """Decoder function for the mode"""
+    if mode == 'full':
+        return full_decode
+    return fast_decode
@@ -0,0 +1,183 @@
+'''
+emulator.py
+
+Stand-in for ExpressionApp.exe, so RTX tracking can run without the RTX Tracking package or an
+RTX GPU, IE. on Linux for load tests.
+
+Run with `python -m ExpressionAppBridge.rtxtracking.emulator [options]`, or let main.py start it
+with `--emulator`. It takes the same command line as ExpressionApp.exe and:
+
+ * Prints the camera list on --print_caps, in the format read by setup
+ * Streams tracking datagrams to port 9140 in the format documented on EXPAPP.md. Motion is
+   synthetic, see synthetic.py, or replayed from captured packets with --packets
+ * Answers {"cmd":" calibrate"} on port 9160 + camera with a calibration packet
+
+--rate overrides the camera frame rate, and can go up to thousands of packets per second.
+Packets are sent in bursts when a single sleep is too coarse for the rate.
+'''
+import argparse, json, signal, socket, sys, threading, time
+from .synthetic import EXP_COUNT, synthetic_frame, calibration_frame, encode_packet, synthetic_packets
+
+# Command that starts the emulator in place of ExpressionApp.exe
+EMULATOR_COMMAND = [sys.executable, '-m', 'ExpressionAppBridge.rtxtracking.emulator']
+
+# Tracking datagram destination and base control port
+TRACKING_ADDR = ('127.0.0.1', 9140)
+CONTROL_PORT = 9160
+
+# Synthetic packets generated up front and then looped. 10 seconds of motion at 60 fps
+SYNTHETIC_CYCLE = 600
+
+# Longest sleep between bursts. In seconds
+MAX_SLEEP = 0.1
+
+# Emulated cameras. minInterval is in 100ns units, as DirectShow reports it
+EMULATOR_CAPS = [
+    {
+        "id": 0,
+        "name": "ExpressionApp emulator",
+        "caps": [
+            {"id": 0, "maxCX": 1280, "maxCY": 720, "minInterval": 166666, "format": 102},
+            {"id": 1, "maxCX": 1280, "maxCY": 720, "minInterval": 333333, "format": 102},
+            {"id": 2, "maxCX": 640, "maxCY": 480, "minInterval": 333333, "format": 102}
+        ]
+    }
+]
+
+def caps_output(caps=EMULATOR_CAPS):
+    ''' --print_caps console output. The camera list is the second block between blank lines '''
+    return "ExpressionApp emulator\r\n\r\n\r\n" + json.dumps(caps) + "\r\n\r\n\r\n"
+
+def load_packets(path):
+    ''' Captured datagrams. A raw recording or a file with one datagram per line '''
+    if path.endswith('.rec'):
+        from ..recording import Recording
+        recording = Recording(path)
+        if recording.tap != 'raw':
+            raise ValueError(f"{path} is a {recording.tap} recording, packets need a raw one")
+        return [recording.message(i) for i in range(len(recording))]
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') + b'\x00' for line in f if line.strip()]
+
+class Emulator:
+    """Streams packets to addr at rate packets per second and answers calibration requests"""
+    def __init__(self, packets, rate, addr=TRACKING_ADDR, control_port=CONTROL_PORT, width=1280, height=720, camera=0):
+        self.packets = packets
+        self.rate = rate
+        self.addr = addr
+        self.width = width
+        self.height = height
+        self.camera = camera
+        self.sent = 0
+        self.errors = 0
+        self.calibrations = 0
+        self.running = True
+        self.started = None
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.control = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.control.bind(('127.0.0.1', control_port))
+        self.control.settimeout(0.5)
+        self.control_thread = threading.Thread(target=self.control_loop, daemon=True)
+    def control_loop(self):
+        while self.running:
+            try:
+                data = self.control.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                cmd = json.loads(data.rstrip(b'\x00')).get('cmd', '').strip()
+            except (ValueError, AttributeError):
+                print(f"Invalid command {data!r}", flush=True)
+                continue
+            if cmd == 'calibrate':
+                self.calibrate()
+            else:
+                print(f"Command {cmd}", flush=True)
+    def calibrate(self):
+        ''' Send a calibration packet. The current synthetic expressions are taken as neutral '''
+        t = time.monotonic() - self.started if self.started is not None else 0
+        values = synthetic_frame(t, width=self.width, height=self.height)['exp'][:EXP_COUNT]
+        self.sock.sendto(encode_packet(calibration_frame(values, self.camera)), self.addr)
+        self.calibrations = self.calibrations + 1
+        print("Calibration sent", flush=True)
+    def run(self, duration=None, count=None):
+        ''' Stream until stopped, duration seconds or count packets '''
+        self.control_thread.start()
+        packets = self.packets
+        total = len(packets)
+        start = self.started = time.monotonic()
+        while self.running:
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+
+            # Every packet due by now. Bursts keep the average rate above what sleep can pace
+            due = int((now - start) * self.rate) + 1 - self.sent
+            if count is not None:
+                due = min(due, count - self.sent)
+                if due <= 0:
+                    break
+            for _ in range(due):
+                try:
+                    self.sock.sendto(packets[self.sent % total], self.addr)
+                except OSError:
+                    self.errors = self.errors + 1
+                self.sent = self.sent + 1
+            time.sleep(min(max(start + self.sent / self.rate - time.monotonic(), 0), MAX_SLEEP))
+    def close(self):
+        self.running = False
+        self.control.close()
+        self.control_thread.join()
+        self.sock.close()
+        elapsed = time.monotonic() - self.started if self.started is not None else 0
+        print(f"Emulator: {self.sent} packets in {elapsed:.1f} seconds, {self.sent / elapsed if elapsed > 0 else 0:.0f} packets/s, {self.errors} send errors, {self.calibrations} calibrations", flush=True)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ExpressionApp stand-in. Takes the ExpressionApp.exe options, unknown ones are ignored", allow_abbrev=False)
+    parser.add_argument('--print_caps', action='store_true', help="Print the camera list and exit")
+    parser.add_argument('--camera', type=int, default=0)
+    parser.add_argument('--cam_res', default="1280x720")
+    parser.add_argument('--cam_fps', type=float, default=60)
+    parser.add_argument('--fps_limit', type=float)
+    parser.add_argument('--rate', type=float, help="Packets per second. Defaults to the camera frame rate")
+    parser.add_argument('--packets', help="Replay captured packets, a raw .rec recording or one datagram per line")
+    parser.add_argument('--port', type=int, default=TRACKING_ADDR[1], help=f"Tracking datagram port. Default {TRACKING_ADDR[1]}")
+    parser.add_argument('--control_port', type=int, help=f"Command port. Default {CONTROL_PORT} + camera")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+    parser.add_argument('--count', type=int, help="Stop after this many packets")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.print_caps:
+        # Written as bytes so the line endings stay as they are on every OS
+        sys.stdout.buffer.write(caps_output().encode())
+        sys.stdout.flush()
+        return
+
+    width, height = (int(x) for x in args.cam_res.lower().split('x'))
+    rate = args.rate or args.fps_limit or args.cam_fps
+    if args.packets:
+        packets = load_packets(args.packets)
+    else:
+        packets = synthetic_packets(SYNTHETIC_CYCLE, camera=args.camera, width=width, height=height, fps=int(rate))
+
+    control_port = args.control_port if args.control_port is not None else CONTROL_PORT + args.camera
+    emulator = Emulator(packets, rate, (TRACKING_ADDR[0], args.port), control_port, width, height, args.camera)
+
+    # terminate() from the bridge ends the stream like Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Streaming {len(packets)} {'captured' if args.packets else 'synthetic'} packets at {rate:g}/s to port {args.port}, commands on port {control_port}", flush=True)
+    try:
+        emulator.run(args.duration, args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+if __name__ == "__main__":
+    main()
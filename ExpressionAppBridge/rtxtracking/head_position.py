@@ -0,0 +1,95 @@
+'''
+head_position.py
+
+Head position from the ExpressionApp landmarks.
+
+'pts' holds the capture resolution followed by x, y pairs for every landmark. The estimate uses the
+HEAD_LANDMARKS jawline landmarks at the start of the array, the face outline, which moves with the
+head and little with expressions. Only those are parsed, see decoder.fast_decode. Each packet is
+reduced to the landmark centroid, which gives x and y, and the RMS distance of the landmarks to
+it, which grows as the head gets closer to the camera and gives z. Both are divided by the
+capture height so the output does not depend on the camera resolution. With a few dozen values
+per packet plain float math is faster than converting them to a numpy array.
+
+Positions are relative to a center. The center is the average of the first WARMUP_FRAMES
+frames, follows the head slowly so a new resting position becomes the new center, and is
+taken again on recenter.
+'''
+import math, operator
+
+# Output scale. Same output as the old jaw point estimator on a 720p camera
+POS_X_SCALE = 0.15
+POS_Y_SCALE = 0.15
+POS_Z_SCALE = 0.15
+
+# Frames averaged into a fresh center
+WARMUP_FRAMES = 30
+
+# Time for the center to catch up with a new resting position. In seconds, 0 disables drift
+DRIFT_TIME = 60
+
+# Landmarks used, the jawline. ExpressionApp points 1 to 33
+HEAD_LANDMARKS = 33
+
+# Landmarks needed for a position
+MIN_LANDMARKS = 3
+
+# Smallest landmark spread taken as a face, in capture heights. Lost faces can send the landmarks
+# all on one spot, which would divide by zero once it became the center
+MIN_SCALE = 1e-3
+
+class HeadPositionEstimator:
+    """Landmark centroid and scale based head position. Positions are written to head[3:6]"""
+    def __init__(self, drift_time=DRIFT_TIME, warmup=WARMUP_FRAMES, landmarks=HEAD_LANDMARKS):
+        self.drift_time = drift_time
+        self.warmup = warmup
+        self.values = landmarks * 2
+        self.center = [0.0, 0.0, 0.0]
+        self.frames = 0
+        self.last = None
+    def recenter(self):
+        """Take a new center from the next frames"""
+        self.frames = 0
+        self.last = None
+    def measure(self, pts):
+        """Centroid x, y and RMS scale of a pts array, in capture heights. None if there are too few
+        landmarks or they have no spread"""
+        if pts is None or len(pts) < 2 + MIN_LANDMARKS * 2:
+            return None
+        height = pts[1]
+        if height <= 0:
+            return None
+        xy = pts[2:2 + min(len(pts) - 2, self.values) // 2 * 2]
+        count = len(xy) // 2
+        # Mean squared distance to the centroid is the mean squared length minus the centroid squared
+        cx = sum(xy[0::2]) / count
+        cy = sum(xy[1::2]) / count
+        squared = sum(map(operator.mul, xy, xy)) / count - cx * cx - cy * cy
+        scale = math.sqrt(max(squared, 0.0)) / height
+        if not scale >= MIN_SCALE:
+            return None
+        return cx / height, cy / height, scale
+    def update(self, pts, now, head):
+        """Write the position for a pts array into head. Left untouched when tracking is lost"""
+        pose = self.measure(pts)
+        if pose is None:
+            return False
+        x, y, z = pose
+        center = self.center
+        if self.frames < self.warmup:
+            # Running mean of the first frames
+            self.frames = self.frames + 1
+            rate = 1 / self.frames
+        elif self.drift_time > 0 and self.last is not None:
+            rate = min((now - self.last) / self.drift_time, 1)
+        else:
+            rate = 0
+        self.last = now
+        center[0] = center[0] + (x - center[0]) * rate
+        center[1] = center[1] + (y - center[1]) * rate
+        center[2] = center[2] + (z - center[2]) * rate
+
+        head[3] = (x - center[0]) * POS_X_SCALE
+        head[4] = (center[1] - y) * POS_Y_SCALE
+        head[5] = (z / center[2] - 1) * POS_Z_SCALE
+        return True
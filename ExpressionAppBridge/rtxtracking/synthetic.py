@@ -0,0 +1,97 @@
+'''
+synthetic.py
+
+Synthetic ExpressionApp datagrams. Used for benchmarks, tests and headless runs.
+
+Packets follow the format documented on EXPAPP.md: a JSON dict with a trailing NULL char.
+Motion is a set of slow sinusoids so any frame can be generated from its timestamp.
+'''
+import json, math, random
+
+# Number of expression parameters and landmark points sent by ExpressionApp
+EXP_COUNT = 53
+LANDMARK_COUNT = 126
+JAW_POINTS = 33
+
+def _quaternion_from_euler(roll, pitch, yaw):
+    """Radians to x, y, z, w"""
+    cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+    cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+    cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+    return [
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+        cr * cp * cy + sr * sp * sy
+    ]
+
+def _landmarks(t, width, height, rng):
+    """126 x/y points. The first 33 are the jawline, the rest are spread inside the face"""
+    cx = width / 2 + width * 0.05 * math.sin(0.5 * t)
+    cy = height / 2 + height * 0.04 * math.sin(0.3 * t)
+    size = height * 0.3 * (1 + 0.1 * math.sin(0.2 * t))
+    pts = []
+    for i in range(LANDMARK_COUNT):
+        if i < JAW_POINTS:
+            # Jaw goes from one ear to the other under the chin
+            a = math.pi * i / (JAW_POINTS - 1)
+            x = cx - size * math.cos(a)
+            y = cy + size * 0.8 * math.sin(a)
+        else:
+            # Inner features on a sunflower spiral
+            k = i - JAW_POINTS
+            r = size * 0.7 * math.sqrt((k + 0.5) / (LANDMARK_COUNT - JAW_POINTS))
+            a = k * 2.39996
+            x = cx + r * math.cos(a)
+            y = cy - size * 0.2 + r * math.sin(a)
+        if rng is not None:
+            x = x + rng.gauss(0, 0.5)
+            y = y + rng.gauss(0, 0.5)
+        pts.append(round(x, 3))
+        pts.append(round(y, 3))
+    return pts
+
+def synthetic_frame(t, seq=0, width=1280, height=720, fps=60, camera=0, rng=None):
+    """Tracking packet contents at t seconds. Pass a random.Random as rng to add landmark noise"""
+    exp = []
+    for i in range(EXP_COUNT):
+        value = 0.5 + 0.6 * math.sin(t * (0.7 + 0.05 * i) + i)
+        exp.append(round(min(max(value, 0), 1), 6))
+    rot = _quaternion_from_euler(0.15 * math.sin(0.9 * t), 0.25 * math.sin(0.6 * t), 0.1 * math.sin(0.4 * t))
+    return {
+        "exp": exp,
+        "cal": [],
+        "rot": [round(x, 6) for x in rot],
+        "pos": [0, 0, 0],
+        "pts": [width, height] + _landmarks(t, width, height, rng),
+        "shw": 1,
+        "cam": camera,
+        "fps": fps,
+        "num": seq,
+        "cnf": 45
+    }
+
+def calibration_frame(values, camera=0):
+    """Packet sent back by ExpressionApp after a calibrate command"""
+    return {
+        "exp": [],
+        "cal": list(values),
+        "rot": [],
+        "pos": [],
+        "pts": [],
+        "shw": 1,
+        "cam": camera,
+        "fps": 0,
+        "num": 0,
+        "cnf": 0
+    }
+
+def encode_packet(frame, compact=True):
+    """Serialize a packet as sent on the wire, trailing NULL included"""
+    separators = (',', ':') if compact else (', ', ': ')
+    return json.dumps(frame, separators=separators).encode() + b'\x00'
+
+def synthetic_packets(count, rate=60, seed=0, compact=True, **kwargs):
+    """List of count consecutive packets at rate Hz. Reproducible for a given seed"""
+    rng = random.Random(seed)
+    return [encode_packet(synthetic_frame(i / rate, i, rng=rng, **kwargs), compact) for i in range(count)]
@@ -0,0 +1,80 @@
+'''
+timing.py
+
+Timing helpers.
+
+IntervalStats keeps inter-event interval statistics.
+DeadlineClock is a fixed rate asyncio clock based on perf_counter deadlines.
+monotonic ticks every 15.6 ms on Windows, too coarse for intervals and deadlines at tracking rates.
+'''
+import asyncio, time
+from collections import deque
+
+# Number of intervals kept for percentile calculation
+HISTORY = 1000
+
+class IntervalStats:
+    """Interval statistics between marked events. All values in seconds"""
+    def __init__(self, history=HISTORY):
+        self.intervals = deque(maxlen=history)
+        self.last = None
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.missed = 0
+    def mark(self, now=None):
+        """Record an event at now, perf_counter seconds"""
+        if now is None:
+            now = time.perf_counter()
+        if self.last is not None:
+            self.add(now - self.last)
+        self.last = now
+    def add(self, interval):
+        """Record a single interval"""
+        self.intervals.append(interval)
+        self.count = self.count + 1
+        self.total = self.total + interval
+        if interval > self.max:
+            self.max = interval
+    def percentile(self, p):
+        """Percentile over the latest intervals. p goes from 0 to 100"""
+        if len(self.intervals) == 0:
+            return 0
+        ordered = sorted(self.intervals)
+        idx = min(int(round(p / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[idx]
+    def summary(self):
+        """Mean, p99 and max interval plus missed deadlines"""
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "p99": self.percentile(99),
+            "max": self.max,
+            "missed": self.missed
+        }
+    def __str__(self):
+        s = self.summary()
+        return f"{s['count']} intervals, mean {s['mean']*1000:.2f}ms, p99 {s['p99']*1000:.2f}ms, max {s['max']*1000:.2f}ms, {s['missed']} missed deadlines"
+
+class DeadlineClock:
+    """Fixed rate clock. Deadlines advance by a fixed period from the start, so processing time
+    does not accumulate. Deadlines already gone are skipped instead of bursted."""
+    def __init__(self, rate, stats=None):
+        self.period = 1 / rate
+        self.deadline = None
+        self.stats = stats if stats is not None else IntervalStats()
+    def next_delay(self, now):
+        """Advance to the next deadline and return how long to wait for it"""
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline = self.deadline + self.period
+
+        # Fell behind. Skip every deadline already gone
+        if self.deadline <= now:
+            missed = int((now - self.deadline) / self.period) + 1
+            self.stats.missed = self.stats.missed + missed
+            self.deadline = self.deadline + missed * self.period
+        return self.deadline - now
+    async def wait(self):
+        """Sleep until the next deadline"""
+        await asyncio.sleep(self.next_delay(time.perf_counter()))
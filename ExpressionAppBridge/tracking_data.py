@@ -2,82 +2,204 @@
 tracking_data.py
 
 Tracking data storage. Contains blendshape, eye rotation, head pos and head rotation.
+
+Every value lives on a single float64 buffer. Blendshapes take the first slots in
+iFM output order, followed by the head, right eye and left eye values.
 '''
+import numpy as np
+
+# Perfect Sync blendshapes in iFM output order. The list position is the slot on the buffer
+BLENDSHAPE_NAMES = [
+    # Brow
+    "browInnerUp",
+    "browDown_L",
+    "browDown_R",
+    "browOuterUp_L",
+    "browOuterUp_R",
+
+    # Eye
+    "eyeLookUp_L",
+    "eyeLookUp_R",
+    "eyeLookDown_L",
+    "eyeLookDown_R",
+    "eyeLookIn_L",
+    "eyeLookIn_R",
+    "eyeLookOut_L",
+    "eyeLookOut_R",
+    "eyeBlink_L",
+    "eyeBlink_R",
+    "eyeSquint_L",
+    "eyeSquint_R",
+    "eyeWide_L",
+    "eyeWide_R",
+
+    # Cheek
+    "cheekPuff",
+    "cheekSquint_L",
+    "cheekSquint_R",
+
+    # Nose
+    "noseSneer_L",
+    "noseSneer_R",
+
+    # Jaw
+    "jawOpen",
+    "jawForward",
+    "jawLeft",
+    "jawRight",
+
+    # Mouth
+    "mouthFunnel",
+    "mouthPucker",
+    "mouthLeft",
+    "mouthRight",
+    "mouthRollUpper",
+    "mouthRollLower",
+    "mouthShrugUpper",
+    "mouthShrugLower",
+    "mouthClose",
+    "mouthSmile_L",
+    "mouthSmile_R",
+    "mouthFrown_L",
+    "mouthFrown_R",
+    "mouthDimple_L",
+    "mouthDimple_R",
+    "mouthUpperUp_L",
+    "mouthUpperUp_R",
+    "mouthLowerDown_L",
+    "mouthLowerDown_R",
+    "mouthPress_L",
+    "mouthPress_R",
+    "mouthStretch_L",
+    "mouthStretch_R",
+    "tongueOut"
+]
+
+# Blendshape name -> buffer slot
+BLENDSHAPE_INDEX = {name: i for i, name in enumerate(BLENDSHAPE_NAMES)}
+
+BLENDSHAPE_COUNT = len(BLENDSHAPE_NAMES)
+
+# ExpressionApp expression index -> Perfect Sync blendshape
+EXP_IDX_TO_PERFECT_SYNC = [
+    "browDown_L",         # 0
+    "browDown_R",         # 1
+    "browInnerUp",        # 2 browInnerUp_L
+    "browInnerUp",        # 3 browInnerUp_R - Average both
+    "browOuterUp_L",      # 4
+    "browOuterUp_R",      # 5
+    "cheekPuff",          # 6 - cheekPuff_L
+    "cheekPuff",          # 7 - cheekPuff_R - Average both
+    "cheekSquint_L",      # 8
+    "cheekSquint_R",      # 9
+    "eyeBlink_L",         # 10
+    "eyeBlink_R",         # 11
+    "eyeLookDown_L",      # 12
+    "eyeLookDown_R",      # 13
+    "eyeLookIn_L",        # 14
+    "eyeLookIn_R",        # 15
+    "eyeLookOut_L",       # 16
+    "eyeLookOut_R",       # 17
+    "eyeLookUp_L",        # 18
+    "eyeLookUp_R",        # 19
+    "eyeSquint_L",        # 20
+    "eyeSquint_R",        # 21
+    "eyeWide_L",          # 22
+    "eyeWide_R",          # 23
+    "jawForward",         # 24
+    "jawLeft",            # 25
+    "jawOpen",            # 26
+    "jawRight",           # 27
+    "mouthClose",         # 28
+    "mouthDimple_L",      # 29
+    "mouthDimple_R",      # 30
+    "mouthFrown_L",       # 31
+    "mouthFrown_R",       # 32
+    "mouthFunnel",        # 33
+    "mouthLeft",          # 34
+    "mouthLowerDown_L",   # 35
+    "mouthLowerDown_R",   # 36
+    "mouthPress_L",       # 37
+    "mouthPress_R",       # 38
+    "mouthPucker",        # 39
+    "mouthRight",         # 40
+    "mouthRollLower",     # 41
+    "mouthRollUpper",     # 42
+    "mouthShrugLower",    # 43
+    "mouthShrugUpper",    # 44
+    "mouthSmile_L",       # 45
+    "mouthSmile_R",       # 46
+    "mouthStretch_L",     # 47
+    "mouthStretch_R",     # 48
+    "mouthUpperUp_L",     # 49
+    "mouthUpperUp_R",     # 50
+    "noseSneer_L",        # 51
+    "noseSneer_R"         # 52
+]
+
+# Blendshapes that take calibration entries, in iFM order. These line up with the ones listed on the ExpressionApp
+PERFECT_SYNC_BLENDSHAPES = [name for name in BLENDSHAPE_NAMES if name in EXP_IDX_TO_PERFECT_SYNC]
+
+# Buffer layout
+# Head: RotX, RotY, RotZ, PosX, PosY, PosZ. Eyes: RotX, RotY, RotZ
+HEAD_SLICE = slice(BLENDSHAPE_COUNT, BLENDSHAPE_COUNT + 6)
+RIGHT_EYE_SLICE = slice(BLENDSHAPE_COUNT + 6, BLENDSHAPE_COUNT + 9)
+LEFT_EYE_SLICE = slice(BLENDSHAPE_COUNT + 9, BLENDSHAPE_COUNT + 12)
+BUFFER_SIZE = BLENDSHAPE_COUNT + 12
+
+class BlendshapeView:
+    """Dict-like access to the blendshape slots. Reads and writes go straight to the buffer"""
+    __slots__ = ('array',)
+    def __init__(self, array):
+        self.array = array
+    def __getitem__(self, key):
+        return self.array.item(BLENDSHAPE_INDEX[key])
+    def __setitem__(self, key, value):
+        self.array[BLENDSHAPE_INDEX[key]] = value
+    def __contains__(self, key):
+        return key in BLENDSHAPE_INDEX
+    def __iter__(self):
+        return iter(BLENDSHAPE_NAMES)
+    def __len__(self):
+        return BLENDSHAPE_COUNT
+    def __repr__(self):
+        return repr(dict(self.items()))
+    def get(self, key, default=None):
+        idx = BLENDSHAPE_INDEX.get(key)
+        if idx is None:
+            return default
+        return self.array.item(idx)
+    def keys(self):
+        return list(BLENDSHAPE_NAMES)
+    def values(self):
+        return self.array.tolist()
+    def items(self):
+        return list(zip(BLENDSHAPE_NAMES, self.array.tolist()))
+
 class TrackingData:
+    __slots__ = ('buffer', 'blendshape_values', 'blendshapes', 'head', 'rightEye', 'leftEye', 'confidence', 'rotation')
     def __init__(self):
-        """Perfect Sync Tracking parameters"""
-        self.blendshapes = {
-            # Brow
-            "browInnerUp": 0,
-            "browDown_L": 0,
-            "browDown_R": 0,
-            "browOuterUp_L": 0,
-            "browOuterUp_R": 0,
-
-            # Eye
-            "eyeLookUp_L": 0,
-            "eyeLookUp_R": 0,
-            "eyeLookDown_L": 0,
-            "eyeLookDown_R": 0,
-            "eyeLookIn_L": 0,
-            "eyeLookIn_R": 0,
-            "eyeLookOut_L": 0,
-            "eyeLookOut_R": 0,
-            "eyeBlink_L": 0,
-            "eyeBlink_R": 0,
-            "eyeSquint_L": 0,
-            "eyeSquint_R": 0,
-            "eyeWide_L": 0,
-            "eyeWide_R": 0,
-
-            # Cheek
-            "cheekPuff": 0,
-            "cheekSquint_L": 0,
-            "cheekSquint_R": 0,
-
-            # Nose
-            "noseSneer_L": 0,
-            "noseSneer_R": 0,
-            
-            # Jaw
-            "jawOpen": 0,
-            "jawForward": 0,
-            "jawLeft": 0,
-            "jawRight": 0,
-
-            # Mouth
-            "mouthFunnel": 0,
-            "mouthPucker": 0,
-            "mouthLeft": 0,
-            "mouthRight": 0,
-            "mouthRollUpper": 0,
-            "mouthRollLower": 0,
-            "mouthShrugUpper": 0,
-            "mouthShrugLower": 0,
-            "mouthClose": 0,
-            "mouthSmile_L": 0,
-            "mouthSmile_R": 0,
-            "mouthFrown_L": 0,
-            "mouthFrown_R": 0,
-            "mouthDimple_L": 0,
-            "mouthDimple_R": 0,
-            "mouthUpperUp_L": 0,
-            "mouthUpperUp_R": 0,
-            "mouthLowerDown_L": 0,
-            "mouthLowerDown_R": 0,
-            "mouthPress_L": 0,
-            "mouthPress_R": 0,
-            "mouthStretch_L": 0,
-            "mouthStretch_R": 0,
-            "tongueOut": 0
-    }
+        # Backing storage for every tracking value
+        self.buffer = np.zeros(BUFFER_SIZE)
+
+        # Perfect Sync Tracking parameters. Array view and by-name view
+        self.blendshape_values = self.buffer[:BLENDSHAPE_COUNT]
+        self.blendshapes = BlendshapeView(self.blendshape_values)
+
         # Head rotation and position
         # RotX, RotY, RotZ, PosX, PosY, PosZ
         # Degrees
-        self.head = [0, 0, 0, 0, 0, 0]
+        self.head = self.buffer[HEAD_SLICE]
         # Right and Left eyes rotation
         # RotX, RotY, RotZ
-        self.rightEye = [0, 0, 0]
-        self.leftEye = [0, 0, 0]
+        self.rightEye = self.buffer[RIGHT_EYE_SLICE]
+        self.leftEye = self.buffer[LEFT_EYE_SLICE]
         # Confidence indicator from ExpApp
-        self.confidence = 0
\ No newline at end of file
+        self.confidence = 0
+        # Head rotation as the x, y, z, w quaternion reported by the tracker. None if it only gives angles
+        self.rotation = None
+    def copy_from(self, other):
+        """Copy every value from another TrackingData"""
+        np.copyto(self.buffer, other.buffer)
+        self.confidence = other.confidence
+        self.rotation = other.rotation
@@ -0,0 +1,55 @@
+'''
+bench_decoder.py
+
+Compare the ExpressionApp datagram decoders.
+
+Run with `python -m benchmarks.bench_decoder [--packets FILE]`. FILE holds one captured
+datagram per line without the trailing NULL char. Synthetic packets are used otherwise.
+'''
+import argparse, json
+from ExpressionAppBridge.rtxtracking import decoder
+from ExpressionAppBridge.rtxtracking.ExpressionApp import HEAD_PTS_COUNT
+from ExpressionAppBridge.rtxtracking.synthetic import synthetic_packets
+from .common import measure, report
+
+# 'pts' values kept by fast_decode, the ones head position uses
+PTS_COUNT = HEAD_PTS_COUNT
+
+def load_packets(path):
+    """Captured datagrams, one per line"""
+    with open(path, 'rb') as f:
+        return [line.rstrip(b'\r\n') + b'\x00' for line in f if line.strip()]
+
+def decode_all(fn, packets, pts_count):
+    for message in packets:
+        fn(message, pts_count)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packets', help="File with one captured datagram per line")
+    args = parser.parse_args()
+    
+    packets = load_packets(args.packets) if args.packets else synthetic_packets(600)
+    count = len(packets)
+    print(f"{count} packets, {sum(len(p) for p in packets) / count:.0f} bytes on average. JSON backend: {decoder.json_loads.__module__}")
+    
+    results = [
+        ("json.loads", lambda: decode_all(lambda m, n: json.loads(m[:-1].decode('utf-8')), packets, None)),
+        ("full_decode", lambda: decode_all(decoder.full_decode, packets, None)),
+        ("fast_decode", lambda: decode_all(decoder.fast_decode, packets, PTS_COUNT))
+    ]
+    for name, fn in results:
+        report(name, measure(fn, number=10) / count)
+    
+    # Same decoders on the json fallback
+    if decoder.json_loads is not json.loads:
+        backend = decoder.json_loads
+        decoder.json_loads = json.loads
+        try:
+            report("full_decode, json backend", measure(lambda: decode_all(decoder.full_decode, packets, None), number=10) / count)
+            report("fast_decode, json backend", measure(lambda: decode_all(decoder.fast_decode, packets, PTS_COUNT), number=10) / count)
+        finally:
+            decoder.json_loads = backend
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+'''
+bench_ifm.py
+
+Compare the precompiled iFM serializer against the previous str(iFM) implementation.
+
+Run with `python -m benchmarks.bench_ifm`
+'''
+import random
+from ExpressionAppBridge.tracking_data import TrackingData, BLENDSHAPE_NAMES
+from ExpressionAppBridge.iFM import iFM_Data
+from .common import measure, report
+
+def legacy_str(iFM):
+    """Serializer as it was before iFM_Serializer. Kept as the benchmark reference"""
+    output = "|".join([f"{k}-{int(v)}" for k, v in iFM.tracking_data.blendshapes.items()])
+    output = output + "|=head#" + ",".join(["{:.6f}".format(x) for x in iFM.tracking_data.head])
+    if iFM.rightEye_enable:
+        output = output + "|rightEye#" + ",".join(["{:.6f}".format(x) for x in iFM.tracking_data.rightEye])
+    if iFM.leftEye_enable:
+        output = output + "|leftEye#" + ",".join(["{:.6f}".format(x) for x in iFM.tracking_data.leftEye])
+    output = output + "|"
+    return output.encode()
+
+def sample_tracking_data(seed=0):
+    """Tracking data filled with reproducible values"""
+    rng = random.Random(seed)
+    td = TrackingData()
+    for k in BLENDSHAPE_NAMES:
+        td.blendshapes[k] = rng.uniform(0, 100)
+    for i in range(6):
+        td.head[i] = rng.uniform(-30, 30)
+    td.rightEye[1] = rng.uniform(-30, 30)
+    td.leftEye[1] = rng.uniform(-30, 30)
+    return td
+
+def main():
+    iFM = iFM_Data(sample_tracking_data())
+    assert legacy_str(iFM) == iFM.serialize()
+    
+    legacy = measure(lambda: legacy_str(iFM))
+    compiled = measure(iFM.serialize)
+    report("legacy str(iFM).encode()", legacy)
+    report("iFM_Serializer.serialize()", compiled)
+    print(f"Speedup: {legacy/compiled:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+'''
+bench_pipeline.py
+
+Per stage and end to end cost of the tracking pipeline on fixed inputs.
+
+Run with `python -m benchmarks.bench_pipeline [--packets FILE] [--save] [--check]`. FILE is a raw
+recording or one captured datagram per line, see rtxtracking/emulator.py. Reproducible synthetic
+packets are used otherwise. Mediapipe stages run on generated landmarker results, mediapipe
+itself is not needed.
+
+Every stage reports its time per frame, the fps one core could sustain running only that stage,
+the peak bytes allocated during a frame and the memory blocks left allocated per frame. Results
+are compared with the saved baselines in baselines.json and changes above --threshold percent are
+flagged. --save writes the current results as the new baselines.
+
+Raw times depend on the machine. Every timing repetition of a stage is paired with one of a fixed
+reference loop, and stage times are saved and compared as the median multiple of it. Baselines
+saved on one machine then hold on another, and clock speed changes during a run even out.
+'''
+import argparse, json, math, os, random, statistics, time
+from collections import namedtuple
+from tempfile import TemporaryDirectory
+import numpy as np
+from ExpressionAppBridge import cal as cal_module
+from ExpressionAppBridge.cal import TrackingInput, doCal
+from ExpressionAppBridge.iFM import iFM_Data
+from ExpressionAppBridge.mediapipe.mediapipe import BlendshapeMapper, mediapipe_to_ifm, process_Transform_into_TrackingData
+from ExpressionAppBridge.rtxtracking.ExpressionApp import HEAD_PTS_COUNT, ExpressionAppRunner
+from ExpressionAppBridge.rtxtracking.emulator import load_packets
+from ExpressionAppBridge.rtxtracking.synthetic import synthetic_packets
+from ExpressionAppBridge.tracking_data import BLENDSHAPE_INDEX, TrackingData
+from .common import REPEAT, allocations, measure
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# Frames of synthetic input. Stages cycle through them
+FRAMES = 600
+
+# Calls per timing repetition
+NUMBER = 2000
+
+# Change in time per frame, relative to the reference loop, flagged as a regression. In percent
+THRESHOLD = 25
+
+# Reference loop input. A mix of interpreter and small numpy work like the pipeline stages
+REFERENCE_VALUES = [float(i) for i in range(64)]
+REFERENCE_ARRAY = np.zeros(64)
+
+# Calibration used for the benchmark. One entry of every type
+BENCH_CAL = {
+    "eyes": cal_module.DEFAULT_CAL['eyes'],
+    "blendshapes": {
+        "jawOpen": {"type": "interpolation", "minIn": 5, "maxIn": 80, "minOut": 0, "maxOut": 100},
+        "eyeBlink_L": {"type": "outputSnap", "limit": 60},
+        "eyeBlink_R": {"type": "outputSnap", "limit": 60},
+        "mouthSmile_L": {"type": "simple", "max": 70},
+        "mouthSmile_R": {"type": "simple", "max": 70},
+        "mouthFunnel": {"type": "curve", "points": [[0, 0], [30, 10], [100, 100]], "shape": "smoothstep"}
+    }
+}
+
+Category = namedtuple('Category', ['index', 'score', 'display_name', 'category_name'])
+
+def landmarker_results(count, seed=0):
+    """Transformation matrices and blendshape categories shaped like FaceLandmarker results"""
+    rng = random.Random(seed)
+    names = ["_neutral"] + list(mediapipe_to_ifm)
+    matrices = []
+    blendshapes = []
+    for i in range(count):
+        t = i / 30
+        x, y, z = 0.2 * math.sin(0.9 * t), 0.3 * math.sin(0.6 * t), 0.1 * math.sin(0.4 * t)
+        cx, sx, cy, sy, cz, sz = math.cos(x), math.sin(x), math.cos(y), math.sin(y), math.cos(z), math.sin(z)
+        m = np.eye(4)
+        m[:3, :3] = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]]) @ np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]]) @ np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+        m[:3, 3] = [math.sin(t), math.cos(t), -40 + math.sin(0.3 * t)]
+        matrices.append(m)
+        blendshapes.append([[Category(j, rng.random(), '', name) for j, name in enumerate(names)]])
+    return matrices, blendshapes
+
+class Cycle:
+    """Hands out the frames of a list in a loop"""
+    def __init__(self, items):
+        self.items = items
+        self.i = 0
+    def next(self):
+        item = self.items[self.i]
+        self.i = (self.i + 1) % len(self.items)
+        return item
+
+def build_stages(packets, tmp):
+    """Name -> frame function for every stage, in pipeline order"""
+    cal_path = os.path.join(tmp, "bench_cal.json")
+    with open(cal_path, "w") as f:
+        json.dump(BENCH_CAL, f)
+
+    # RTX pipeline
+    td = TrackingData()
+    cal = TrackingInput(td, cal_path)
+    iFM = iFM_Data(td)
+    runner = ExpressionAppRunner(cal, {}, {})
+    runner.saveCal = lambda values: None
+    decoded = [runner.decode(message, HEAD_PTS_COUNT) for message in packets]
+    decoded = [d for d in decoded if len(d['cal']) == 0 and len(d['exp']) > 0]
+    parsed = []
+    for i, d in enumerate(decoded):
+        runner.headPos(d['pts'], i / 60)
+        runner.headRotation(d['rot'])
+        runner.mapExpressions(d['exp'])
+        frame = TrackingData()
+        frame.copy_from(runner.parsed_data)
+        frame.confidence = d['cnf']
+        parsed.append(frame)
+
+    messages = Cycle(packets)
+    frames = Cycle(decoded)
+    parsed_frames = Cycle(parsed)
+    entries = list(BENCH_CAL['blendshapes'].items())
+    entry_slots = [BLENDSHAPE_INDEX[k] for k, _ in entries]
+    values = Cycle([p.blendshape_values.tolist() for p in parsed])
+    scratch = np.zeros(len(parsed[0].blendshape_values))
+    raw_values = Cycle([p.blendshape_values for p in parsed])
+
+    # Mediapipe post-processing
+    mp_td = TrackingData()
+    mp_td.confidence = 100
+    mapper = BlendshapeMapper()
+    matrices, blendshapes = landmarker_results(FRAMES)
+    results = Cycle(list(zip(matrices, blendshapes)))
+
+    def legacy_cal():
+        v = values.next()
+        for (k, entry), slot in zip(entries, entry_slots):
+            doCal(entry, v[slot])
+    def compiled_cal():
+        np.copyto(scratch, raw_values.next())
+        cal.compiled.apply(scratch)
+    def mediapipe_post():
+        matrix, result = results.next()
+        process_Transform_into_TrackingData(matrix, mp_td)
+        mapper.apply(result, mp_td)
+    def rtx_chain():
+        runner.onMessage(messages.next())
+        iFM.serialize()
+    def mediapipe_chain():
+        mediapipe_post()
+        cal.input_tracking(mp_td)
+        iFM.serialize()
+
+    stages = {
+        "decode": lambda: runner.decode(messages.next(), HEAD_PTS_COUNT),
+        "headPos": lambda: runner.headPos(frames.next()['pts'], time.perf_counter()),
+        "headRotation": lambda: runner.headRotation(frames.next()['rot']),
+        "mapExpressions": lambda: runner.mapExpressions(frames.next()['exp']),
+        "input_tracking": lambda: cal.input_tracking(parsed_frames.next()),
+        "eyeRotation": cal.eyeRotation,
+        "doCal": legacy_cal,
+        "CompiledCal.apply": compiled_cal,
+        "iFM_Data.__str__": lambda: str(iFM),
+        "iFM_Data.serialize": iFM.serialize,
+        "mediapipe post-processing": mediapipe_post,
+        "rtx chain": rtx_chain,
+        "mediapipe chain": mediapipe_chain
+    }
+    return stages, cal
+
+def reference():
+    """Fixed workload stage times are measured against"""
+    total = 0.0
+    for v in REFERENCE_VALUES:
+        total = total + v * 0.5
+    np.add(REFERENCE_ARRAY, total, out=REFERENCE_ARRAY)
+    return REFERENCE_ARRAY.sum()
+
+def run(packets, number=NUMBER):
+    """Benchmark every stage. Returns name -> results"""
+    results = {}
+    with TemporaryDirectory() as tmp:
+        stages, cal = build_stages(packets, tmp)
+        try:
+            for name, fn in stages.items():
+                pairs = [(measure(fn, number, 1), measure(reference, number, 1)) for _ in range(REPEAT)]
+                ns = min(stage for stage, _ in pairs)
+                relative = statistics.median(stage / ref for stage, ref in pairs)
+                peak, blocks = allocations(fn)
+                results[name] = {"ns": round(ns), "relative": round(relative, 3), "fps": round(1e9 / ns), "peakBytes": round(peak), "blocks": round(blocks, 2)}
+        finally:
+            cal.close()
+    return results
+
+def load_baselines(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def print_results(results, baselines, threshold):
+    """Print results next to the baselines. Returns the stages slower than threshold percent.
+    Baseline times are shown scaled to the reference loop of this run"""
+    regressions = []
+    print(f"{'stage':<28} {'ns/frame':>10} {'fps':>10} {'peak B':>8} {'blocks':>7} {'baseline':>10} {'change':>8}")
+    for name, r in results.items():
+        line = f"{name:<28} {r['ns']:>10} {r['fps']:>10} {r['peakBytes']:>8} {r['blocks']:>7.2f}"
+        base = baselines.get(name)
+        if base is not None and 'relative' in base:
+            change = (r['relative'] - base['relative']) / base['relative'] * 100
+            line = line + f" {base['relative'] * r['ns'] / r['relative']:>10.0f} {change:>+7.1f}%"
+            if change > threshold:
+                regressions.append(name)
+                line = line + " REGRESSION"
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Tracking pipeline benchmark")
+    parser.add_argument('--packets', help="Captured ExpressionApp packets, a raw .rec recording or one datagram per line")
+    parser.add_argument('--baselines', default=BASELINES, help="Baseline file. Default benchmarks/baselines.json")
+    parser.add_argument('--save', action='store_true', help="Save the results as the new baselines")
+    parser.add_argument('--check', action='store_true', help="Exit with an error if any stage regressed")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help=f"Slowdown flagged as a regression, in percent. Default {THRESHOLD}")
+    parser.add_argument('--number', type=int, default=NUMBER, help=f"Frames per timing repetition. Default {NUMBER}")
+    args = parser.parse_args()
+
+    packets = load_packets(args.packets) if args.packets else synthetic_packets(FRAMES)
+    print(f"{len(packets)} packets")
+    results = run(packets, args.number)
+    regressions = print_results(results, load_baselines(args.baselines), args.threshold)
+
+    if args.save:
+        with open(args.baselines, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baselines saved to {args.baselines}")
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        if args.check:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+'''
+bench_quaternion.py
+
+Compare the batch quaternion math against the per quaternion math module path, and the
+quaternion space head rotation filters against filtering each angle.
+
+Filters are timed on the whole head, position included. Per angle rotation filters share their
+group with the position filter of the same type, as they do with the default config, while the
+rotation filters add a group of their own.
+
+Run with `python -m benchmarks.bench_quaternion`
+'''
+import numpy as np
+from ExpressionAppBridge import quaternion
+from ExpressionAppBridge.filters import CHANNEL_COUNT, HEAD_SLICE, FilterBank, filterSpec
+from .common import measure, report
+
+# Quaternions per batch conversion
+BATCH = 1000
+
+def per_quaternion(q):
+    return [quaternion.euler_from_quaternion(*x) for x in q]
+
+def filter_frame(bank, values, frame):
+    """One head filter step"""
+    values[HEAD_SLICE] = frame
+    bank.update(values, 0)
+
+def main():
+    q = quaternion.normalize(np.random.default_rng(0).normal(size=(BATCH, 4)))
+    rows = q.tolist()
+    np.testing.assert_allclose(per_quaternion(rows), quaternion.eulers_from_quaternions(q), atol=1e-9)
+    
+    loop = measure(lambda: per_quaternion(rows), number=200) / BATCH
+    batch = measure(lambda: quaternion.eulers_from_quaternions(q), number=200) / BATCH
+    report("euler_from_quaternion, per quaternion", loop)
+    report("eulers_from_quaternions, batch", batch)
+    print(f"Speedup: {loop/batch:.1f}x")
+    
+    print()
+    values = np.zeros(CHANNEL_COUNT)
+    frame = [3.0, -2.0, 10.0, 0.1, 0.2, 0.3]
+    avg = {"type": "avg", "window": 5}
+    ema = {"type": "ema", "alpha": 0.5}
+    for name, filters in [
+        ("avg per angle, default", {"headRotation": avg, "headPosition": avg}),
+        ("quatAvg", {"headRotation": {"type": "quatAvg", "window": 5}, "headPosition": avg}),
+        ("ema per angle", {"headRotation": ema, "headPosition": ema}),
+        ("slerp", {"headRotation": {"type": "slerp", "alpha": 0.5}, "headPosition": ema})
+    ]:
+        bank = FilterBank(filterSpec(filters))
+        report(f"{name} head frame", measure(lambda: filter_frame(bank, values, frame)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+'''
+common.py
+
+Shared helpers for the micro-benchmarks.
+'''
+import sys, timeit, tracemalloc
+
+# Timing repetitions. The best one is reported
+REPEAT = 5
+
+def measure(fn, number=10000, repeat=REPEAT):
+    """Return the best per-call time of fn in nanoseconds"""
+    timer = timeit.Timer(fn)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+def allocations(fn, number=200):
+    """Return the peak bytes allocated while fn runs and the memory blocks fn keeps, per call"""
+    fn()
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(number):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            fn()
+            peak = peak + tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return peak / number, retained_blocks(fn, number) - retained_blocks(lambda: None, number)
+
+def retained_blocks(fn, number):
+    """Memory blocks still allocated per call after number calls of fn"""
+    calls = range(number)
+    blocks = sys.getallocatedblocks()
+    for _ in calls:
+        fn()
+    return (sys.getallocatedblocks() - blocks) / number
+
+def report(name, ns):
+    """Print a single benchmark result line"""
+    print(f"{name:<40} {ns:>12.0f} ns/call {1e9/ns:>12.0f} calls/s")
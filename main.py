@@ -1,45 +1,124 @@
-import asyncio, signal, functools, json, argparse
+import asyncio, signal, functools, json, argparse, time, shlex
 from ExpressionAppBridge.rtxtracking import ExpressionAppRunner, setup
-from ExpressionAppBridge.mediapipe import mediapipe_start
-from ExpressionAppBridge.iFM import iFM_Data, start_iFM_Sender
+from ExpressionAppBridge.rtxtracking.ExpressionApp import INGEST_MODES
+from ExpressionAppBridge.rtxtracking.decoder import DECODER_MODES
+from ExpressionAppBridge.rtxtracking.emulator import EMULATOR_COMMAND
+from ExpressionAppBridge.mediapipe import ROTATION_SCALE, mediapipe_start
+from ExpressionAppBridge.iFM import iFM_Data, start_iFM_Sender, parse_destination, SEND_MODES, MAX_RATE, KEEPALIVE
 from ExpressionAppBridge.tracking_data import TrackingData
 from ExpressionAppBridge.config_utils import loadConfig, debug_settings
-from ExpressionAppBridge.cal import TrackingInput, debug_entries
+from ExpressionAppBridge.cal import TrackingInput
+from ExpressionAppBridge.filters import DEGREES
+from ExpressionAppBridge.recording import Recorder, Recording, recordingPath, replay_into
+
+# Blendshape cal file of each tracking mode
+CAL_FILES = {
+    'rtx': "config/RTX_Blendshapes_cal.json",
+    'mediapipe': "config/Mediapipe_Blendshapes_cal.json"
+}
+
+# Degrees per unit of the head rotation of each tracking mode
+ROTATION_SCALES = {
+    'rtx': DEGREES,
+    'mediapipe': ROTATION_SCALE
+}
+
+def start_recording(args, mode, cal, runner=None):
+    """Record every tap available to args.record. raw needs the ExpressionAppRunner"""
+    if args.record is None:
+        return
+    cal.startRecording(Recorder(recordingPath(args.record, 'parsed'), 'parsed', mode), Recorder(recordingPath(args.record, 'output'), 'output', mode))
+    if runner is not None:
+        raw = Recorder(recordingPath(args.record, 'raw'), 'raw', mode)
+        runner.startRecording(raw)
+        cal.recorders.append(raw)
 
 async def rtx_main(args):
     # Load config file.
     config = loadConfig()
     
+    # ExpressionApp stand-in for runs without the RTX Tracking package
+    command = None
+    if args.emulator is not None:
+        command = EMULATOR_COMMAND + shlex.split(args.emulator)
+    
     # Test the ExpressionApp path, ask for camera settings
-    camera_conf = setup(config)
+    camera_conf = setup(config, command)
     
     # Set up tracking storage
     tdata = TrackingData()
     
     # Set up iFM serializer
-    iFM = iFM_Data(tdata)
+    iFM = iFM_Data(tdata, args.ifm_dest)
     
     # Set up calibration
-    cal = TrackingInput(tdata, "config/RTX_Blendshapes_cal.json")
+    cal = TrackingInput(tdata, CAL_FILES['rtx'])
+    cal.start_watcher()
+    if args.autocal:
+        cal.startAutoCal()
     
     # Set up ExpressionApp
-    expapp = ExpressionAppRunner(cal, config, camera_conf)
+    expapp = ExpressionAppRunner(cal, config, camera_conf, args.decoder, args.ingest, args.rcvbuf, command)
+    start_recording(args, 'rtx', cal, expapp)
     
-    # Run ExpressionApp and iFM sender
-    await asyncio.gather(expapp.start(args.cal), start_iFM_Sender(iFM))
+    # Run ExpressionApp and iFM sender. The sender stops once ExpressionApp exits
+    sender = asyncio.create_task(start_iFM_Sender(iFM, cal, args.send_mode, args.max_rate, args.keepalive))
+    try:
+        await expapp.start(args.cal)
+    finally:
+        sender.cancel()
+        await sender
+        cal.close()
 
 def mediapipe_main(args):
     # Set up tracking storage
     tdata = TrackingData()
     
     # iFM serializer
-    iFM = iFM_Data(tdata)
+    iFM = iFM_Data(tdata, args.ifm_dest)
     
     # Set up calibration
-    cal = TrackingInput(tdata, "config/Mediapipe_Blendshapes_cal.json")
+    cal = TrackingInput(tdata, CAL_FILES['mediapipe'], rotation_scale=ROTATION_SCALES['mediapipe'])
+    cal.start_watcher()
+    if args.autocal:
+        cal.startAutoCal()
+    start_recording(args, 'mediapipe', cal)
     
     # Start mediapipe main loop
-    mediapipe_start(cal, iFM)
+    try:
+        mediapipe_start(cal, iFM, args.source, args.source_rate, args.source_frames, args.source_loop)
+    finally:
+        cal.close()
+    
+    for dest in iFM.destinations:
+        print(f"iFM destination {dest}")
+    iFM.close()
+
+def replay_main(args):
+    recording = Recording(args.replay)
+    mode = recording.mode if recording.mode in CAL_FILES else 'rtx'
+    print(f"Replaying {len(recording)} {recording.tap} frames, {recording.duration():.1f} seconds of {mode} tracking")
+    
+    # Same setup as a live session, minus the tracker
+    tdata = TrackingData()
+    iFM = iFM_Data(tdata, args.ifm_dest)
+    cal = TrackingInput(tdata, CAL_FILES[mode], rotation_scale=ROTATION_SCALES[mode])
+    cal.start_watcher()
+    runner = None
+    if recording.tap == 'raw':
+        runner = ExpressionAppRunner(cal, {}, {}, args.decoder)
+    start_recording(args, mode, cal, runner)
+    
+    try:
+        start = time.monotonic()
+        count = replay_into(recording, cal, iFM, runner, args.replay_speed)
+        elapsed = time.monotonic() - start
+        print(f"Replayed {count} frames in {elapsed:.2f} seconds, {count / elapsed if elapsed > 0 else 0:.0f} frames/s")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cal.close()
+        iFM.close()
 
 if __name__ == "__main__":
     # Command line stuff
@@ -47,21 +126,44 @@ if __name__ == "__main__":
     parser.add_argument('--mode', choices=['rtx', 'mediapipe'])
     parser.add_argument('--debug-ifm', help="Print every iFM frame sent. VERY VERBOSE", action='store_true')
     parser.add_argument('--debug-expapp', help="Print tracker console output. Only for RTX", action='store_true')
+    parser.add_argument('--debug-timing', help="Print iFM packet interval statistics every few seconds", action='store_true')
     parser.add_argument('--debug-param', help="Provide a comma separated list of parameters to be printed IE. 'brow,blink'", action='store', metavar='param')
     parser.add_argument('--cal', action='store_true', help="Do a calibration on start. Only for RTX")
+    parser.add_argument('--autocal', action='store_true', help="Measure the range of every blendshape while tracking and write a suggested blendshape config on exit")
+    parser.add_argument('--emulator', nargs='?', const='', metavar='args', help="Run RTX tracking against the ExpressionApp emulator instead of ExpressionApp.exe. Optional emulator arguments, IE. '--rate 1000'. Only for RTX")
+    parser.add_argument('--decoder', choices=DECODER_MODES, default='fast', help="ExpressionApp packet decoder. 'fast' only parses the members in use, 'full' parses the whole packet. Only for RTX")
+    parser.add_argument('--ingest', choices=INGEST_MODES, default='all', help="'latest' only processes the newest ExpressionApp packet when they pile up, dropping stale ones. Only for RTX")
+    parser.add_argument('--rcvbuf', type=int, metavar='bytes', help="OS receive buffer size for ExpressionApp packets. Only for RTX")
+    parser.add_argument('--ifm-dest', action='append', type=parse_destination, metavar='host:port[@rate]', help="iFM destination. Can be repeated to send to several receivers. An optional rate caps the packets per second for that receiver. Default 127.0.0.1:49983")
+    parser.add_argument('--source', metavar='source', help="Mediapipe frame source. 'camera' for a DirectShow camera (default), 'synthetic[:WxH]' for a generated test pattern, or the path of a video file, an image sequence like frames/%%04d.png or a directory of images. Only for mediapipe")
+    parser.add_argument('--source-rate', type=float, metavar='fps', help="Frame rate for file and synthetic sources. 0 reads frames as fast as possible. Defaults to the video frame rate or 30")
+    parser.add_argument('--source-frames', type=int, metavar='count', help="Stop after this many frames. Only for mediapipe")
+    parser.add_argument('--source-loop', action='store_true', help="Restart file sources at the end. Only for mediapipe")
+    parser.add_argument('--record', metavar='prefix', help="Record the session to prefix.parsed.rec, prefix.output.rec and, for RTX, prefix.raw.rec")
+    parser.add_argument('--replay', metavar='file', help="Replay a recording instead of tracking")
+    parser.add_argument('--replay-speed', type=float, default=1.0, metavar='factor', help="Replay speed. 0 replays as fast as possible. Default 1")
+    parser.add_argument('--send-mode', choices=SEND_MODES, default='poll', help="iFM send mode. 'poll' sends at a fixed rate, 'event' sends as soon as a frame is tracked. Only for RTX")
+    parser.add_argument('--max-rate', type=float, default=MAX_RATE, help=f"Max iFM send rate in Hz on event mode. Default {MAX_RATE}")
+    parser.add_argument('--keepalive', type=float, default=KEEPALIVE, help=f"Resend the last frame after this many seconds without new frames on event mode. Default {KEEPALIVE}")
     
     # Parse command line args
     args = parser.parse_args()
     
     # Load command line args to debug struct
     debug_settings['debug_ifm'] = args.debug_ifm
-    debug_entries = args.debug_param.split(',') if args.debug_param is not None else []
+    debug_settings['debug_param'] = args.debug_param.split(',') if args.debug_param is not None else []
     debug_settings['debug_expapp'] = args.debug_expapp
+    debug_settings['debug_timing'] = args.debug_timing
+    
+    # Replays do not need a tracker
+    if args.replay is not None:
+        replay_main(args)
+        raise SystemExit
     
     # Handle mode selection
     mode = args.mode
     
-    if mode != 'rtx' or mode != 'mediapipe':
+    if mode not in ['rtx', 'mediapipe']:
         mode = None
     
     # Or ask for it if not selected
@@ -0,0 +1,88 @@
+import unittest, json, os
+import numpy as np
+from tempfile import TemporaryDirectory
+from ExpressionAppBridge import autocal, cal
+from ExpressionAppBridge.autocal import P2Quantiles, AutoCal
+from ExpressionAppBridge.tracking_data import TrackingData, BLENDSHAPE_COUNT, BLENDSHAPE_INDEX
+
+class TestP2Quantiles(unittest.TestCase):
+    def test_accuracy(self):
+        ''' Estimates land close to the exact percentiles of the stream '''
+        rng = np.random.default_rng(0)
+        data = np.stack([
+            rng.uniform(0, 100, 5000),
+            rng.normal(50, 10, 5000),
+            rng.beta(2, 5, 5000) * 100,
+            np.zeros(5000)
+        ], axis=1)
+        p = [0.02, 0.98, 0.5, 0.98]
+        est = P2Quantiles(p)
+        for row in data:
+            est.add(row)
+        exact = [np.percentile(data[:, i], p[i] * 100) for i in range(4)]
+        np.testing.assert_allclose(est.quantiles(), exact, atol=0.5)
+    
+    def test_few_samples(self):
+        ''' Fewer than 5 samples give the exact percentile of what was seen '''
+        est = P2Quantiles([0.0, 1.0])
+        est.add(np.array([3.0, 3.0]))
+        est.add(np.array([1.0, 1.0]))
+        self.assertEqual(list(est.quantiles()), [1.0, 3.0])
+
+class TestAutoCal(unittest.TestCase):
+    def test_proposal(self):
+        ''' Blendshapes that move get an interpolation entry over their 2-98 percentile range '''
+        ac = AutoCal(stride=1)
+        rng = np.random.default_rng(1)
+        values = np.zeros(BLENDSHAPE_COUNT)
+        for _ in range(4000):
+            values[BLENDSHAPE_INDEX['jawOpen']] = rng.uniform(10, 60)
+            values[BLENDSHAPE_INDEX['mouthLeft']] = rng.uniform(0, 2)
+            values[BLENDSHAPE_INDEX['tongueOut']] = rng.uniform(0, 80)
+            ac.update(values, 45)
+        proposal = ac.proposal()
+        
+        # tongueOut moves but takes no cal entries
+        self.assertEqual(list(proposal.keys()), ['jawOpen'])
+        self.assertEqual(proposal['jawOpen']['type'], 'interpolation')
+        self.assertEqual(proposal['jawOpen']['minIn'], 11)
+        self.assertEqual(proposal['jawOpen']['maxIn'], 59)
+        
+        # Proposals are valid cal entries
+        config = ac.candidate(cal.DEFAULT_CAL)
+        self.assertEqual(cal.cleanConfig(json.loads(json.dumps(config))), config)
+    
+    def test_confidence_and_stride(self):
+        ''' Low confidence frames are skipped, then one frame out of stride is sampled '''
+        ac = AutoCal(stride=4)
+        values = np.zeros(BLENDSHAPE_COUNT)
+        for _ in range(8):
+            ac.update(values, 0)
+        self.assertEqual(ac.samples, 0)
+        for _ in range(8):
+            ac.update(values, 45)
+        self.assertEqual(ac.samples, 2)
+
+class TestTrackingInputAutoCal(unittest.TestCase):
+    def test_candidate_file(self):
+        ''' The candidate is written next to the cal file on close. The cal file is left alone '''
+        with TemporaryDirectory() as d:
+            filepath = os.path.join(d, "test_cal.json")
+            instance = cal.TrackingInput(TrackingData(), filepath)
+            instance.startAutoCal()
+            instance.autocal.stride = 1
+            rng = np.random.default_rng(2)
+            td = TrackingData()
+            td.confidence = 45
+            for _ in range(autocal.AUTOCAL_MIN_SAMPLES):
+                td.blendshapes['browInnerUp'] = rng.uniform(20, 80)
+                instance.input_tracking(td)
+            instance.close()
+            self.assertEqual(instance.filtered_hooks, [])
+            
+            with open(os.path.join(d, "test_cal.autocal.json")) as f:
+                candidate = json.load(f)
+            self.assertIn('browInnerUp', candidate['blendshapes'])
+            self.assertEqual(candidate['eyes'], instance.config['eyes'])
+            with open(filepath) as f:
+                self.assertEqual(json.load(f)['blendshapes'], {})
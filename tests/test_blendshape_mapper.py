@@ -0,0 +1,54 @@
+import unittest
+from collections import namedtuple
+import numpy as np
+from ExpressionAppBridge.mediapipe.mediapipe import BlendshapeMapper, mediapipe_to_ifm, process_BlendShapes_into_TrackingData
+from ExpressionAppBridge.tracking_data import TrackingData
+
+Category = namedtuple('Category', ['index', 'score', 'display_name', 'category_name'])
+
+# Same layout as the face landmarker model, a neutral category followed by the 51 blendshapes
+MODEL_NAMES = ["_neutral"] + list(mediapipe_to_ifm)
+
+def categories(names, seed=0):
+    scores = np.random.default_rng(seed).random(len(names))
+    return [[Category(i, float(s), '', name) for i, (name, s) in enumerate(zip(names, scores))]]
+
+def by_name(result):
+    td = TrackingData()
+    process_BlendShapes_into_TrackingData(result, td)
+    return td.blendshape_values
+
+class TestBlendshapeMapper(unittest.TestCase):
+    def test_matches_names(self):
+        ''' Index mapping gives the same values as the name based mapping '''
+        mapper = BlendshapeMapper()
+        td = TrackingData()
+        for seed in range(3):
+            result = categories(MODEL_NAMES, seed)
+            mapper.apply(result, td)
+            np.testing.assert_allclose(td.blendshape_values, by_name(result))
+        self.assertEqual(td.blendshapes["browDown_R"], result[0][MODEL_NAMES.index("browDownLeft")].score * 100)
+
+    def test_changed_categories(self):
+        ''' A new category order is resolved again '''
+        mapper = BlendshapeMapper()
+        td = TrackingData()
+        mapper.apply(categories(MODEL_NAMES), td)
+        names = list(reversed(MODEL_NAMES))
+        result = categories(names, 1)
+        mapper.apply(result, td)
+        self.assertEqual(mapper.names, names)
+        np.testing.assert_allclose(td.blendshape_values, by_name(result))
+
+    def test_fallback(self):
+        ''' Categories that do not resolve to a permutation go through the name based mapping '''
+        mapper = BlendshapeMapper()
+        td = TrackingData()
+        names = MODEL_NAMES + ["jawOpen"]
+        result = categories(names, 2)
+        mapper.apply(result, td)
+        self.assertIsNone(mapper.src)
+        np.testing.assert_allclose(td.blendshape_values, by_name(result))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
-import unittest, json, os
+import unittest, json, os, random, time
+import numpy as np
 from tempfile import NamedTemporaryFile
 from ExpressionAppBridge import cal
-from ExpressionAppBridge.tracking_data import TrackingData
+from ExpressionAppBridge.tracking_data import TrackingData, BLENDSHAPE_NAMES
 
 class TestConfigParser(unittest.TestCase):
     def setUp(self):
@@ -391,4 +392,232 @@ class TestConfigParser(unittest.TestCase):
         self.assertEqual(instance.config, cal_out)
         
         # Finally delete tempfile
-        os.remove(tempfile.name)
\ No newline at end of file
+        os.remove(tempfile.name)
+    def test_strip_invalid_parameters(self):
+        ''' Non numeric parameters and zero divisors are removed '''
+        
+        cal_in = {
+            "blendshapes": {
+                "browDown_L": {
+                  "type": "interpolation",
+                  "minIn": 50,
+                  "maxIn": 50,
+                  "minOut": 0,
+                  "maxOut": 100
+                },
+                "browDown_R": {
+                  "type": "simple",
+                  "max": 0
+                },
+                "mouthLeft": {
+                    "type": "outputSnap",
+                    "limit": "60"
+                },
+                "mouthRight": {
+                    "type": "outputSnap",
+                    "limit": 60
+                }
+            }
+        }
+        
+        # Create temp file, fill it with input and close it
+        tempfile = NamedTemporaryFile(delete=False, mode='w')
+        json.dump(cal_in, tempfile)
+        tempfile.close()
+        
+        # Create new instance
+        instance = cal.TrackingInput(self.td, tempfile.name)
+        
+        # Check config result
+        self.assertEqual(instance.config['blendshapes'], {"mouthRight": {"type": "outputSnap", "limit": 60}})
+        
+        # Finally delete tempfile
+        os.remove(tempfile.name)
+
+class TestCompiledCal(unittest.TestCase):
+    def setUp(self):
+        # One of each type, with integer and float parameters
+        self.config = {
+            "eyes": {
+                "left": {
+                    "maxRotation": 30,
+                    "fullScale": 80
+                },
+                "right": {
+                    "maxRotation": 25.5,
+                    "fullScale": 60
+                }
+            },
+            "blendshapes": {
+                "eyeBlink_L": {"type": "outputSnap", "limit": 60},
+                "eyeBlink_R": {"type": "outputSnap", "limit": 55.5},
+                "browDown_L": {"type": "simple", "max": 50},
+                "browDown_R": {"type": "simple", "max": 33.3},
+                "mouthLeft": {"type": "interpolation", "minIn": 0, "maxIn": 50, "minOut": 0, "maxOut": 100},
+                "mouthRight": {"type": "interpolation", "minIn": 10.5, "maxIn": 70, "minOut": 5, "maxOut": 95},
+                "jawOpen": {"type": "interpolation", "minIn": 5, "maxIn": 90, "minOut": 100, "maxOut": 0}
+            }
+        }
+        self.compiled = cal.CompiledCal(self.config)
+    def test_matches_doCal(self):
+        ''' Compiled calibration matches int(round(doCal())) on every slot '''
+        rng = random.Random(42)
+        values = np.zeros(len(BLENDSHAPE_NAMES))
+        for n in range(2000):
+            for i in range(len(values)):
+                # Include exact .5 outputs and the parameter values themselves
+                values[i] = rng.choice([rng.uniform(-10, 110), rng.randint(0, 100), rng.randint(0, 200) / 2])
+            expected = values.copy()
+            for k, c in self.config['blendshapes'].items():
+                idx = BLENDSHAPE_NAMES.index(k)
+                expected[idx] = int(round(cal.doCal(c, expected[idx])))
+            self.compiled.apply(values)
+            self.assertEqual(values.tolist(), expected.tolist())
+    def test_batch(self):
+        ''' Several frames at once give the same result as one by one '''
+        rng = np.random.default_rng(1)
+        frames = rng.uniform(0, 100, (50, len(BLENDSHAPE_NAMES)))
+        expected = frames.copy()
+        for row in expected:
+            self.compiled.apply(row)
+        self.compiled.apply(frames)
+        self.assertEqual(frames.tolist(), expected.tolist())
+    def test_eyes(self):
+        ''' Eye rotation uses the compiled eye parameters '''
+        td = TrackingData()
+        td.blendshapes['eyeLookOut_L'] = 70
+        td.blendshapes['eyeLookIn_L'] = 10
+        td.blendshapes['eyeLookIn_R'] = 0
+        td.blendshapes['eyeLookOut_R'] = 90
+        rotation = self.compiled.eyes(td.blendshape_values)
+        self.assertEqual(rotation[0], (60 / 80) * 30)
+        self.assertEqual(rotation[1], (-60 / 60) * 25.5)
+
+class TestCurveCal(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            "eyes": cal.DEFAULT_CAL['eyes'],
+            "blendshapes": {
+                "jawOpen": {"type": "curve", "points": [[0, 0], [30, 60], [60, 100]]},
+                "mouthLeft": {"type": "curve", "points": [[10, 0], [80, 100]], "shape": "smoothstep"},
+                "mouthRight": {"type": "curve", "points": [[0, 0], [100, 100]], "shape": "gamma", "gamma": 2.2},
+                "browDown_L": {"type": "simple", "max": 50}
+            }
+        }
+        self.compiled = cal.CompiledCal(self.config)
+    def test_curve_values(self):
+        ''' Piecewise curves with clamping and easing '''
+        jaw = self.config['blendshapes']['jawOpen']
+        self.assertEqual(list(cal.curveValues(jaw, [-5, 0, 15, 30, 45, 60, 80])), [0, 0, 30, 60, 80, 100, 100])
+        smooth = self.config['blendshapes']['mouthLeft']
+        self.assertEqual(cal.curveValues(smooth, 45), 50)
+        self.assertLess(cal.curveValues(smooth, 20), 100 * 10 / 70)
+        gamma = self.config['blendshapes']['mouthRight']
+        self.assertAlmostEqual(float(cal.curveValues(gamma, 50)), 100 * 0.5 ** 2.2)
+    def test_table(self):
+        ''' Table lookups stay within one step of the exact curve after rounding '''
+        rng = np.random.default_rng(3)
+        frames = rng.uniform(-10, 110, (2000, len(BLENDSHAPE_NAMES)))
+        out = self.compiled.apply(frames.copy())
+        for k, c in self.config['blendshapes'].items():
+            idx = BLENDSHAPE_NAMES.index(k)
+            expected = np.array([int(round(cal.doCal(c, x))) for x in frames[:, idx]])
+            self.assertLessEqual(np.abs(out[:, idx] - expected).max(), 1)
+        
+        # Inputs on the table grid are exact
+        values = np.zeros(len(BLENDSHAPE_NAMES))
+        values[BLENDSHAPE_NAMES.index('jawOpen')] = 15
+        self.compiled.apply(values)
+        self.assertEqual(values[BLENDSHAPE_NAMES.index('jawOpen')], 30)
+    def test_clean(self):
+        ''' Malformed curves are removed '''
+        config = {
+            "blendshapes": {
+                "jawOpen": {"type": "curve"},
+                "mouthLeft": {"type": "curve", "points": [[0, 0]]},
+                "mouthRight": {"type": "curve", "points": [[0, 0], [0, 100]]},
+                "mouthClose": {"type": "curve", "points": [[0, 0], [50, "100"]]},
+                "mouthFunnel": {"type": "curve", "points": [[0, 0], [50, 100]], "shape": "gamma"},
+                "mouthPucker": {"type": "curve", "points": [[0, 0], [50, 100]], "shape": "cubic"},
+                "mouthRollLower": {"type": "curve", "points": [[0, 0], [50, 100]], "shape": "gamma", "gamma": 0.5},
+                "mouthRollUpper": {"type": "curve", "points": [[0, 0], [1e12, 100]]},
+                "mouthShrugLower": {"type": "curve", "points": [[-10, 0], [50, 100]]},
+                "mouthShrugUpper": {"type": "curve", "points": [[0, 0], [50, float('nan')]]}
+            }
+        }
+        cal.cleanConfig(config)
+        self.assertEqual(list(config['blendshapes'].keys()), ['mouthRollLower'])
+    def test_bounds(self):
+        ''' Tables never outgrow the input range and NaN inputs give a valid lookup '''
+        wide = {"type": "curve", "points": [[-1e12, 0], [1e12, 100]]}
+        self.assertEqual(len(cal.curveTable(wide)), round((cal.CURVE_MAX_INPUT - cal.CURVE_MIN_INPUT) / cal.CURVE_STEP) + 1)
+        compiled = cal.CompiledCal({"eyes": cal.DEFAULT_CAL['eyes'], "blendshapes": {"jawOpen": wide, "mouthLeft": self.config['blendshapes']['mouthLeft']}})
+        values = np.zeros(len(BLENDSHAPE_NAMES))
+        values[BLENDSHAPE_NAMES.index('jawOpen')] = np.nan
+        values[BLENDSHAPE_NAMES.index('mouthLeft')] = np.nan
+        compiled.apply(values)
+        self.assertEqual(values[BLENDSHAPE_NAMES.index('jawOpen')], 50)
+        self.assertEqual(values[BLENDSHAPE_NAMES.index('mouthLeft')], 0)
+
+class TestCalWatcher(unittest.TestCase):
+    def test_reload(self):
+        ''' Changes are picked up off the frame path. Broken files keep the current config '''
+        tempfile = NamedTemporaryFile(delete=False, mode='w')
+        json.dump({"blendshapes": {}}, tempfile)
+        tempfile.close()
+        instance = cal.TrackingInput(TrackingData(), tempfile.name)
+        first = instance.compiled
+        instance.start_watcher(poll_period=0.05)
+        try:
+            # Valid change
+            with open(tempfile.name, 'w') as f:
+                json.dump({"blendshapes": {"eyeBlink_L": {"type": "outputSnap", "limit": 60}}}, f)
+            deadline = time.time() + 5
+            while instance.compiled is first and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIsNot(instance.compiled, first)
+            self.assertIn("eyeBlink_L", instance.config['blendshapes'])
+            
+            # Broken file
+            second = instance.compiled
+            with open(tempfile.name, 'w') as f:
+                f.write("{")
+            time.sleep(0.3)
+            self.assertIs(instance.compiled, second)
+        finally:
+            instance.stop_watcher()
+            os.remove(tempfile.name)
+
+class TestCalDebug(unittest.TestCase):
+    def setUp(self):
+        self.tempfile = NamedTemporaryFile(delete=False, mode='w')
+        json.dump({"blendshapes": {"eyeBlink_L": {"type": "simple", "max": 50}}}, self.tempfile)
+        self.tempfile.close()
+    def tearDown(self):
+        os.remove(self.tempfile.name)
+    def test_debug_off(self):
+        ''' Without debug params no debug hooks are installed '''
+        instance = cal.TrackingInput(TrackingData(), self.tempfile.name)
+        self.assertEqual((instance.filtered_hooks, instance.listeners), ([], []))
+        self.assertIsNone(instance.debug_log)
+    def test_debug_slots(self):
+        ''' Debug params select blendshapes by substring '''
+        slots = cal.debugSlots(['blink', 'Blink'])
+        self.assertEqual([BLENDSHAPE_NAMES[i] for i in slots], ['eyeBlink_L', 'eyeBlink_R'])
+        self.assertEqual(len(cal.debugSlots([''])), 0)
+    def test_debug_output(self):
+        ''' Selected blendshapes are logged with raw and calibrated values '''
+        instance = cal.TrackingInput(TrackingData(), self.tempfile.name)
+        instance.setDebug(['Blink'])
+        lines = []
+        instance.debug_log.format = lambda entry: lines.append(instance.formatDebug(entry)) or ""
+        try:
+            td = TrackingData()
+            td.blendshapes['eyeBlink_L'] = 25
+            td.blendshapes['eyeBlink_R'] = 30
+            instance.input_tracking(td)
+        finally:
+            instance.close()
+        self.assertEqual(lines, ["eyeBlink_L raw 25.0 cal 50.0\neyeBlink_R 30.0"])
+        self.assertEqual(instance.tracking_data.blendshapes['eyeBlink_L'], 50)
+        self.assertEqual((instance.filtered_hooks, instance.listeners), ([], []))
@@ -0,0 +1,60 @@
+import unittest, json, os, copy
+import numpy as np
+from tempfile import TemporaryDirectory
+from ExpressionAppBridge import cal, calfit
+from ExpressionAppBridge.tracking_data import BLENDSHAPE_COUNT, BLENDSHAPE_INDEX, BUFFER_SIZE
+
+def sample_session(n=20000, seed=0):
+    ''' Quiet blendshapes plus a few with known shapes '''
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(0, 3, (n, BLENDSHAPE_COUNT))
+    values[:, BLENDSHAPE_INDEX['jawOpen']] = rng.uniform(0, 60, n)
+    values[:, BLENDSHAPE_INDEX['mouthSmile_L']] = rng.uniform(20, 70, n)
+    values[:, BLENDSHAPE_INDEX['tongueOut']] = rng.uniform(0, 80, n)
+    blink = rng.random(n) < 0.1
+    values[:, BLENDSHAPE_INDEX['eyeBlink_L']] = np.where(blink, rng.normal(75, 3, n), rng.normal(5, 2, n))
+    return values
+
+class TestCalFit(unittest.TestCase):
+    def test_fit(self):
+        ''' Each blendshape gets the cal type matching its distribution. tongueOut takes no cal entries '''
+        entries = calfit.fit(sample_session())
+        self.assertEqual(set(entries.keys()), {'jawOpen', 'mouthSmile_L', 'eyeBlink_L'})
+        self.assertEqual(entries['jawOpen'], {"type": "simple", "max": 59})
+        self.assertEqual(entries['mouthSmile_L'], {"type": "interpolation", "minIn": 21, "maxIn": 69, "minOut": 0, "maxOut": 100})
+        self.assertEqual(entries['eyeBlink_L']['type'], 'outputSnap')
+        self.assertTrue(20 < entries['eyeBlink_L']['limit'] < 60)
+    
+    def test_clean_accepts(self):
+        ''' Fitted configs pass cleanConfig unchanged '''
+        config = copy.deepcopy(cal.DEFAULT_CAL)
+        config['blendshapes'] = calfit.fit(sample_session())
+        cleaned = cal.cleanConfig(copy.deepcopy(config))
+        self.assertEqual(cleaned, config)
+    
+    def test_report(self):
+        ''' Saturation and dead zone rates come from the fitted config applied to the recording '''
+        values = sample_session()
+        config = copy.deepcopy(cal.DEFAULT_CAL)
+        config['blendshapes'] = calfit.fit(values)
+        rows = {r['blendshape']: r for r in calfit.report(values, config)}
+        self.assertAlmostEqual(rows['jawOpen']['saturation'], 0.02, delta=0.005)
+        self.assertAlmostEqual(rows['mouthSmile_L']['deadZone'], 0.02, delta=0.005)
+        self.assertEqual(rows['browInnerUp']['type'], 'none')
+        self.assertNotIn('tongueOut', rows)
+    
+    def test_load_session(self):
+        ''' npy buffers and csv files with a blendshape header load as frames x blendshapes '''
+        with TemporaryDirectory() as d:
+            buffers = np.zeros((3, BUFFER_SIZE))
+            buffers[:, BLENDSHAPE_INDEX['jawOpen']] = [1, 2, 3]
+            np.save(os.path.join(d, "session.npy"), buffers)
+            values = calfit.load_session(os.path.join(d, "session.npy"))
+            self.assertEqual(values.shape, (3, BLENDSHAPE_COUNT))
+            self.assertEqual(list(values[:, BLENDSHAPE_INDEX['jawOpen']]), [1, 2, 3])
+            
+            with open(os.path.join(d, "session.csv"), "w") as f:
+                f.write("jawOpen,unknown\n10,5\n20,5\n")
+            values = calfit.load_session(os.path.join(d, "session.csv"))
+            self.assertEqual(values.shape, (2, BLENDSHAPE_COUNT))
+            self.assertEqual(list(values[:, BLENDSHAPE_INDEX['jawOpen']]), [10, 20])
@@ -0,0 +1,59 @@
+import unittest, socket, subprocess, sys, threading, time, json
+from ExpressionAppBridge.rtxtracking import decoder
+from ExpressionAppBridge.rtxtracking.emulator import EMULATOR_CAPS, EMULATOR_COMMAND, Emulator, caps_output
+from ExpressionAppBridge.rtxtracking.ExpressionApp import parseCaps, selectOption
+from ExpressionAppBridge.rtxtracking.synthetic import synthetic_packets
+
+class TestEmulator(unittest.TestCase):
+    def setUp(self):
+        self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx.bind(('127.0.0.1', 0))
+        self.rx.settimeout(2)
+        self.rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    def tearDown(self):
+        self.rx.close()
+    
+    def test_print_caps(self):
+        ''' --print_caps output is read back by setup '''
+        self.assertEqual(parseCaps(caps_output()), EMULATOR_CAPS)
+        result = subprocess.run(EMULATOR_COMMAND + ["--print_caps"], capture_output=True, timeout=30)
+        self.assertEqual(parseCaps(result.stdout.decode()), EMULATOR_CAPS)
+        self.assertEqual(selectOption(1, ""), 0)
+    
+    def test_stream(self):
+        ''' Packets are streamed in order at the requested rate '''
+        packets = synthetic_packets(50)
+        emulator = Emulator(packets, 1000, self.rx.getsockname(), 0)
+        start = time.monotonic()
+        thread = threading.Thread(target=emulator.run, args=(None, 300))
+        thread.start()
+        received = [self.rx.recv(65535) for _ in range(300)]
+        thread.join()
+        elapsed = time.monotonic() - start
+        emulator.close()
+        self.assertEqual(received, [packets[i % 50] for i in range(300)])
+        self.assertAlmostEqual(elapsed, 0.3, delta=0.15)
+        self.assertEqual(decoder.full_decode(received[0])['cnf'], 45)
+    
+    def test_calibrate(self):
+        ''' The calibrate command is answered with a calibration packet '''
+        emulator = Emulator(synthetic_packets(1), 10, self.rx.getsockname(), 0)
+        thread = threading.Thread(target=emulator.run, args=(0.5,))
+        thread.start()
+        tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        tx.sendto(json.dumps({"cmd": " calibrate"}).encode(), emulator.control.getsockname())
+        tx.close()
+        messages = []
+        while len(messages) < 10:
+            message = self.rx.recv(65535)
+            messages.append(message)
+            if decoder.is_calibration(message):
+                break
+        thread.join()
+        emulator.close()
+        self.assertTrue(decoder.is_calibration(messages[-1]))
+        self.assertEqual(len(decoder.full_decode(messages[-1])['cal']), 53)
+        self.assertEqual(emulator.calibrations, 1)
+
+if __name__ == '__main__':
+    unittest.main()
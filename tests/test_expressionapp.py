@@ -0,0 +1,147 @@
+import unittest, os, random, asyncio, io, socket, time
+from contextlib import redirect_stdout
+from tempfile import NamedTemporaryFile
+from ExpressionAppBridge.rtxtracking import decoder
+from ExpressionAppBridge.rtxtracking.ExpressionApp import ExpressionAppRunner, LatestDatagramReceiver, make_listen_socket, CAL_FILENAME, EMULATOR_CAL_FILENAME, EXP_IDX_TO_PERFECT_SYNC
+from ExpressionAppBridge.rtxtracking.synthetic import synthetic_packets, synthetic_frame, calibration_frame, encode_packet
+from ExpressionAppBridge.tracking_data import TrackingData
+from ExpressionAppBridge.cal import TrackingInput
+
+# Resolution plus landmarks up to the end of the jawline
+PTS_COUNT = 68
+
+class TestDecoder(unittest.TestCase):
+    def check_same(self, message, pts_count=PTS_COUNT):
+        full = decoder.full_decode(message)
+        fast = decoder.fast_decode(message, pts_count)
+        for k in ['cal', 'cnf', 'rot', 'exp']:
+            self.assertEqual(fast[k], full[k], k)
+        if pts_count is None:
+            self.assertEqual(fast['pts'], full['pts'])
+        else:
+            self.assertEqual(fast['pts'], full['pts'][:pts_count])
+    def test_fast_matches_full(self):
+        ''' Fast decoder extracts the same values as the full parse '''
+        for compact in [True, False]:
+            for message in synthetic_packets(10, compact=compact):
+                self.check_same(message)
+                self.check_same(message, None)
+    def test_empty_pts(self):
+        ''' Lost tracking sends an empty pts array '''
+        frame = synthetic_frame(0)
+        frame['pts'] = []
+        self.check_same(encode_packet(frame))
+    def test_cal_fallback(self):
+        ''' Calibration answers go through the full parser '''
+        message = encode_packet(calibration_frame([0.5, 0.25]))
+        self.assertEqual(decoder.fast_decode(message, PTS_COUNT)['cal'], [0.5, 0.25])
+    def test_malformed_fallback(self):
+        ''' Unexpected layouts fall back to the full parser '''
+        frame = synthetic_frame(0)
+        frame['pts'] = None
+        message = encode_packet(frame)
+        self.assertEqual(decoder.fast_decode(message, PTS_COUNT)['pts'], None)
+
+    def test_is_calibration(self):
+        self.assertTrue(decoder.is_calibration(encode_packet(calibration_frame([0.5]))))
+        self.assertTrue(decoder.is_calibration(encode_packet(calibration_frame([0.5]), compact=False)))
+        self.assertFalse(decoder.is_calibration(synthetic_packets(1)[0]))
+
+class TestLatestIngest(unittest.TestCase):
+    def test_newest_wins(self):
+        ''' A stalled loop only gets the newest datagram, plus every calibration answer '''
+        received = []
+        packets = synthetic_packets(20)
+        cal_packet = encode_packet(calibration_frame([1.0]))
+        async def run():
+            receiver = LatestDatagramReceiver(received.append, asyncio.get_running_loop(), make_listen_socket(('127.0.0.1', 0)))
+            tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                for message in packets[:10] + [cal_packet] + packets[10:]:
+                    tx.sendto(message, receiver.sock.getsockname())
+                # Block the loop while datagrams arrive
+                time.sleep(0.3)
+                await asyncio.sleep(0.1)
+            finally:
+                tx.close()
+                receiver.close()
+            return receiver
+        receiver = asyncio.run(run())
+        self.assertEqual(received, [cal_packet, packets[-1]])
+        self.assertEqual(receiver.received, 21)
+        self.assertEqual(receiver.dropped, 19)
+        self.assertEqual(receiver.coalesced, 1)
+    def test_socket_error(self):
+        ''' A socket error while running stops the receiver with a message, close() stays quiet '''
+        async def run():
+            return LatestDatagramReceiver(lambda message: None, asyncio.get_running_loop(), make_listen_socket(('127.0.0.1', 0)))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            receiver = asyncio.run(run())
+            receiver.sock.close()
+            receiver.thread.join(2)
+        self.assertFalse(receiver.thread.is_alive())
+        self.assertIn("ExpressionApp receiver stopped", output.getvalue())
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            receiver = asyncio.run(run())
+            receiver.close()
+        self.assertNotIn("ExpressionApp receiver stopped", output.getvalue())
+
+class TestExpressionAppRunner(unittest.TestCase):
+    def setUp(self):
+        tempfile = NamedTemporaryFile(delete=False)
+        tempfile.close()
+        os.remove(tempfile.name)
+        self.cal_path = tempfile.name
+    def tearDown(self):
+        os.remove(self.cal_path)
+    def run_packets(self, decoder_mode, packets):
+        td = TrackingData()
+        runner = ExpressionAppRunner(TrackingInput(td, self.cal_path), {}, {}, decoder_mode)
+        for message in packets:
+            runner.onMessage(message)
+        return td
+    def test_decoders_agree(self):
+        ''' Both decoders produce the same tracking output '''
+        packets = synthetic_packets(20)
+        full = self.run_packets('full', packets)
+        fast = self.run_packets('fast', packets)
+        self.assertEqual(full.buffer.tolist(), fast.buffer.tolist())
+        self.assertEqual(full.confidence, fast.confidence)
+
+    def test_expression_mapping(self):
+        ''' Expressions are scaled, clipped and pairs averaged like the per-element conversion '''
+        def convert(x):
+            return min(max(x * 100, 0), 100)
+        rng = random.Random(5)
+        frame = synthetic_frame(0)
+        frame['exp'] = [rng.uniform(-0.2, 1.2) for x in EXP_IDX_TO_PERFECT_SYNC]
+        td = self.run_packets('full', [encode_packet(frame)])
+        exp = frame['exp']
+        for i, name in enumerate(EXP_IDX_TO_PERFECT_SYNC):
+            if i in [2, 3, 6, 7]:
+                continue
+            self.assertEqual(td.blendshapes[name], convert(exp[i]), name)
+        self.assertEqual(td.blendshapes['browInnerUp'], (convert(exp[2]) + convert(exp[3])) / 2)
+        self.assertEqual(td.blendshapes['cheekPuff'], (convert(exp[6]) + convert(exp[7])) / 2)
+        self.assertEqual(td.blendshapes['tongueOut'], 0)
+    
+    def test_emulator_cal_file(self):
+        ''' A stand-in for ExpressionApp keeps its calibration in its own file '''
+        cal = TrackingInput(TrackingData(), self.cal_path)
+        self.assertEqual(ExpressionAppRunner(cal, {}, {}).cal_filename, CAL_FILENAME)
+        runner = ExpressionAppRunner(cal, {}, {}, command=["emulator"])
+        self.assertEqual(runner.cal_filename, EMULATOR_CAL_FILENAME)
+        self.assertNotEqual(EMULATOR_CAL_FILENAME, CAL_FILENAME)
+        
+        # Calibration answers go to and load from that file
+        with NamedTemporaryFile(delete=False) as f:
+            runner.cal_filename = f.name
+        try:
+            with redirect_stdout(io.StringIO()):
+                runner.onMessage(encode_packet(calibration_frame([0.5, 0.25])))
+            self.assertEqual(runner.loadCal(), [0.5, 0.25])
+        finally:
+            os.remove(runner.cal_filename)
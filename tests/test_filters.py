@@ -0,0 +1,171 @@
+import unittest, os
+from tempfile import TemporaryDirectory
+import numpy as np
+from ExpressionAppBridge import cal, filters
+from ExpressionAppBridge.filters import FilterBank, filterSpec, CHANNEL_COUNT
+from ExpressionAppBridge.tracking_data import BLENDSHAPE_INDEX, TrackingData
+
+# Head rotation averaged in quaternion space, opt-in
+QUAT_AVG = {"headRotation": {"type": "quatAvg", "window": 5}}
+
+def legacy_avg(history, size):
+    ''' Old RollingAvg output, sum of the last size values over size '''
+    return sum(history[-size:]) / size
+
+class TestFilters(unittest.TestCase):
+    def test_default_spec(self):
+        ''' Head channels default to a 5 frame average. Blendshapes are not filtered '''
+        spec = filterSpec({})
+        self.assertEqual(len(spec), CHANNEL_COUNT)
+        self.assertEqual(spec[0], ('none', ()))
+        self.assertEqual(spec[filters.HEAD_ROTATION_CHANNELS[0]], ('avg', (5.0,)))
+        self.assertEqual(spec[filters.HEAD_POSITION_CHANNELS[-1]], ('avg', (5.0,)))
+    
+    def test_avg(self):
+        ''' Running sum average matches the full window sum once the window is full '''
+        bank = FilterBank(filterSpec({}))
+        rng = np.random.default_rng(0)
+        history = []
+        channel = filters.HEAD_POSITION_CHANNELS[1]
+        for i in range(50):
+            values = np.zeros(CHANNEL_COUNT)
+            values[channel] = rng.uniform(-30, 30)
+            history.append(values[channel])
+            bank.update(values, i / 60)
+            if i == 0:
+                # Partial windows average what has been seen so far
+                self.assertEqual(values[channel], history[0])
+            if i >= 4:
+                self.assertAlmostEqual(values[channel], legacy_avg(history, 5), places=9)
+    
+    def test_ema(self):
+        ''' EMA starts at the first sample then moves alpha of the way each frame '''
+        spec = filterSpec({"blendshapes": {"jawOpen": {"type": "ema", "alpha": 0.25}}})
+        bank = FilterBank(spec)
+        idx = BLENDSHAPE_INDEX['jawOpen']
+        values = np.zeros(CHANNEL_COUNT)
+        values[idx] = 40
+        bank.update(values, 0)
+        self.assertEqual(values[idx], 40)
+        values[idx] = 80
+        bank.update(values, 1 / 60)
+        self.assertEqual(values[idx], 50)
+    
+    def test_one_euro(self):
+        ''' One Euro smooths noise on a still signal and follows a fast one closely '''
+        spec = filterSpec({"headPosition": {"type": "oneEuro", "minCutoff": 0.5, "beta": 0.01}})
+        bank = FilterBank(spec)
+        rng = np.random.default_rng(1)
+        channel = filters.HEAD_POSITION_CHANNELS[0]
+        still = []
+        for i in range(120):
+            values = np.zeros(CHANNEL_COUNT)
+            values[channel] = rng.normal(0, 1)
+            bank.update(values, i / 60)
+            still.append(values[channel])
+        self.assertLess(np.std(still[20:]), 0.3)
+        
+        # A fast ramp gets followed with little lag
+        for i in range(120, 180):
+            values = np.zeros(CHANNEL_COUNT)
+            values[channel] = (i - 120) * 5
+            bank.update(values, i / 60)
+        self.assertGreater(values[channel], 59 * 5 * 0.9)
+    
+    def test_quat_avg(self):
+        ''' Rotation average follows small motion like avg and does not break at +-180 '''
+        bank = FilterBank(filterSpec(QUAT_AVG))
+        rot = filters.HEAD_ROTATION_CHANNELS
+        history = []
+        for i in range(20):
+            values = np.zeros(CHANNEL_COUNT)
+            values[rot] = [i * 0.5, -i * 0.25, i * 0.1]
+            history.append(values[rot].copy())
+            bank.update(values, i / 60)
+        np.testing.assert_allclose(values[rot], np.mean(history[-5:], axis=0), atol=0.01)
+        
+        # Yaw going through 180. Averaging the angles would give values near 0
+        bank = FilterBank(filterSpec(QUAT_AVG))
+        for yaw in [176, 178, -180, -178, -176]:
+            values = np.zeros(CHANNEL_COUNT)
+            values[rot] = [0, 0, yaw]
+            bank.update(values, 0)
+        self.assertAlmostEqual(abs(values[rot[2]]), 180, places=6)
+    
+    def test_slerp(self):
+        ''' slerp moves alpha of the way along the rotation, across the wrap around too '''
+        bank = FilterBank(filterSpec({"headRotation": {"type": "slerp", "alpha": 0.25}}))
+        rot = filters.HEAD_ROTATION_CHANNELS
+        values = np.zeros(CHANNEL_COUNT)
+        values[rot] = [0, 0, 170]
+        bank.update(values, 0)
+        values[rot] = [0, 0, -170]
+        bank.update(values, 1 / 60)
+        self.assertAlmostEqual(values[rot[2]], 175)
+    
+    def test_rotation_scale(self):
+        ''' Mediapipe head rotations are converted to degrees for the rotation filters and back '''
+        from ExpressionAppBridge.mediapipe.mediapipe import ROTATION_SCALE
+        rot = filters.HEAD_ROTATION_CHANNELS
+        for kind in [{"type": "quatAvg", "window": 5}, {"type": "slerp", "alpha": 0.5}]:
+            bank = FilterBank(filterSpec({"headRotation": kind}), ROTATION_SCALE)
+            for i in range(10):
+                values = np.zeros(CHANNEL_COUNT)
+                values[rot] = [10, -120, 5]
+                bank.update(values, i / 60)
+                np.testing.assert_allclose(values[rot], [10, -120, 5], atol=1e-9)
+    
+    def test_quaternion_input(self):
+        ''' A quaternion from the tracker is filtered as is, the angles only being written '''
+        from ExpressionAppBridge.quaternion import quaternion_from_euler
+        bank = FilterBank(filterSpec(QUAT_AVG))
+        rot = filters.HEAD_ROTATION_CHANNELS
+        q = quaternion_from_euler(20, -30, 40)
+        for i in range(5):
+            # Angles on the values are ignored when the quaternion is given
+            values = np.zeros(CHANNEL_COUNT)
+            bank.update(values, i / 60, q)
+        np.testing.assert_allclose(values[rot], [20, -30, 40], atol=1e-9)
+    
+    def test_clean(self):
+        ''' Invalid filter entries are removed '''
+        config = {
+            "headRotation": {"type": "ema", "alpha": 2},
+            "headPosition": {"type": "oneEuro", "minCutoff": 1},
+            "blendshapes": {
+                "invalid": {"type": "ema"},
+                "jawOpen": {"type": "avg", "window": 0},
+                "mouthLeft": {"type": "unknown"},
+                "mouthRight": {"type": "avg", "window": 3},
+                "mouthClose": {"type": "slerp"}
+            }
+        }
+        filters.cleanFilters(config)
+        self.assertNotIn("headRotation", config)
+        self.assertIn("headPosition", config)
+        self.assertEqual(list(config["blendshapes"].keys()), ["mouthRight"])
+
+class TestTrackingInputFilters(unittest.TestCase):
+    def test_filter_swap(self):
+        ''' Filter state survives reloads that do not change the filters '''
+        with TemporaryDirectory() as d:
+            instance = cal.TrackingInput(TrackingData(), os.path.join(d, "cal.json"))
+            bank = instance.filter_bank
+            instance.compiled = cal.CompiledCal(cal.cleanConfig({"eyes": {}, "blendshapes": {}}))
+            instance.input_tracking(TrackingData())
+            self.assertIs(instance.filter_bank, bank)
+            
+            instance.compiled = cal.CompiledCal(cal.cleanConfig({"eyes": {}, "filters": {"headRotation": {"type": "none"}}}))
+            instance.input_tracking(TrackingData())
+            self.assertIsNot(instance.filter_bank, bank)
+    
+    def test_tracker_rotation(self):
+        ''' The quaternion on the tracking data is the one the rotation filters use '''
+        from ExpressionAppBridge.quaternion import quaternion_from_euler
+        with TemporaryDirectory() as d:
+            instance = cal.TrackingInput(TrackingData(), os.path.join(d, "cal.json"))
+            instance.compiled = cal.CompiledCal(cal.cleanConfig({"eyes": {}, "filters": QUAT_AVG}))
+            frame = TrackingData()
+            frame.rotation = quaternion_from_euler(20, -30, 40)
+            instance.input_tracking(frame)
+            np.testing.assert_allclose(instance.tracking_data.head[:3], [20, -30, 40], atol=1e-9)
@@ -0,0 +1,94 @@
+import unittest, threading
+import numpy as np
+from ExpressionAppBridge.frame_ring import FrameRing
+from ExpressionAppBridge.pipeline import LatestSlot
+
+def image(value, shape=(4, 6, 3)):
+    return np.full(shape, value, dtype=np.uint8)
+
+class TestFrameRing(unittest.TestCase):
+    def test_view(self):
+        ''' Readers get a view of the ring buffer with sequence number and timestamp '''
+        ring = FrameRing(3)
+        ring.write(image(1), 10.0)
+        ring.write(image(2), 11.0)
+        with ring.acquire(0, 0) as frame:
+            self.assertEqual(frame.seq, 2)
+            self.assertEqual(frame.timestamp, 11.0)
+            self.assertTrue(np.shares_memory(frame.image, ring.buffers))
+            self.assertEqual(frame.image[0, 0, 0], 2)
+        self.assertIsNone(frame.image)
+        
+        # Nothing newer than what was read
+        self.assertIsNone(ring.acquire(2, 0))
+    
+    def test_leases(self):
+        ''' Leased buffers are not overwritten. Frames are dropped when every buffer is in use '''
+        ring = FrameRing(3)
+        ring.write(image(1))
+        first = ring.acquire(0, 0)
+        ring.write(image(2))
+        second = ring.acquire(first.seq, 0)
+        
+        # One buffer left besides the newest, then nothing
+        self.assertTrue(ring.write(image(3)))
+        self.assertFalse(ring.write(image(4)))
+        self.assertEqual(ring.dropped, 1)
+        self.assertEqual(first.image[0, 0, 0], 1)
+        self.assertEqual(second.image[0, 0, 0], 2)
+        
+        first.release()
+        first.release()
+        self.assertTrue(ring.write(image(5)))
+        with ring.acquire(0, 0) as frame:
+            self.assertEqual(frame.image[0, 0, 0], 5)
+        second.release()
+    
+    def test_publish(self):
+        ''' Published items are handed out as they are, without a copy or ring buffers '''
+        ring = FrameRing(2)
+        item = image(7)
+        self.assertTrue(ring.publish(item, 12.0))
+        with ring.acquire(0, 0) as frame:
+            self.assertIs(frame.image, item)
+            self.assertEqual((frame.seq, frame.timestamp), (1, 12.0))
+            self.assertTrue(ring.publish(image(8)))
+            self.assertFalse(ring.publish(image(9)))
+        self.assertIsNone(ring.buffers)
+        self.assertEqual((ring.written, ring.dropped), (2, 1))
+    
+    def test_reshape(self):
+        ''' A new frame shape reallocates the ring. Old leases stay valid '''
+        ring = FrameRing(2)
+        ring.write(image(1))
+        old = ring.acquire(0, 0)
+        ring.write(image(2, (8, 8, 3)))
+        self.assertEqual(old.image.shape, (4, 6, 3))
+        self.assertEqual(old.image[0, 0, 0], 1)
+        old.release()
+        with ring.acquire(old.seq, 0) as frame:
+            self.assertEqual(frame.image.shape, (8, 8, 3))
+    
+    def test_threaded(self):
+        ''' A writer thread and a reader hand frames over intact '''
+        ring = FrameRing()
+        slot = LatestSlot(on_drop=lambda f: f.release())
+        
+        def writer():
+            for i in range(200):
+                ring.write(image(i % 256, (32, 32, 3)))
+        thread = threading.Thread(target=writer)
+        thread.start()
+        last = 0
+        while thread.is_alive() or ring.seq > last:
+            frame = ring.acquire(last, 0.5)
+            if frame is None:
+                continue
+            slot.put(frame)
+            with slot.get(0) as taken:
+                # Every pixel comes from the same write
+                self.assertEqual(len(np.unique(taken.image)), 1)
+                self.assertGreater(taken.seq, last)
+                last = taken.seq
+        thread.join()
+        self.assertEqual(ring.written + ring.dropped, 200)
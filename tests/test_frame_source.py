@@ -0,0 +1,104 @@
+import unittest, os, time
+import numpy as np
+from tempfile import TemporaryDirectory
+from ExpressionAppBridge.frame_source import FrameSource, SyntheticSource, VideoSource, parse_source
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+class TestFrameSource(unittest.TestCase):
+    def test_parse(self):
+        ''' --source values pick the source kind '''
+        self.assertEqual(parse_source(None), ('camera', None))
+        self.assertEqual(parse_source('camera'), ('camera', None))
+        self.assertEqual(parse_source('synthetic'), ('synthetic', (640, 480)))
+        self.assertEqual(parse_source('synthetic:320x240'), ('synthetic', (320, 240)))
+        self.assertEqual(parse_source('clips/face.mp4'), ('file', 'clips/face.mp4'))
+        with self.assertRaises(ValueError):
+            parse_source('synthetic:big')
+    
+    def test_synthetic(self):
+        ''' Synthetic frames are reproducible and end after max_frames '''
+        runs = []
+        for _ in range(2):
+            source = SyntheticSource(64, 48, rate=0, max_frames=5)
+            sums = []
+            while True:
+                ret, frame = source.read()
+                if not ret:
+                    break
+                with frame:
+                    self.assertEqual(frame.image.shape, (48, 64, 3))
+                    sums.append(int(frame.image.sum()))
+            runs.append(sums)
+        self.assertEqual(len(runs[0]), 5)
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(len(set(runs[0])), 5)
+    
+    def test_grab_required(self):
+        ''' Sources without grab fail on construction. Sources can write to the ring themselves '''
+        class NoGrab(FrameSource):
+            pass
+        with self.assertRaises(TypeError):
+            NoGrab()
+        
+        class Pushed(FrameSource):
+            def grab(self):
+                self.ring.write(np.full((2, 2, 3), self.count, dtype=np.uint8))
+                return True
+        source = Pushed(max_frames=2)
+        values = []
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            with frame:
+                values.append(int(frame.image[0, 0, 0]))
+        self.assertEqual(values, [0, 1])
+    
+    def test_convert(self):
+        ''' convert runs once per frame and readers get its result, nothing is copied into the ring '''
+        converted = []
+        def convert(image):
+            converted.append(image.copy())
+            return converted[-1]
+        source = SyntheticSource(16, 8, rate=0, max_frames=3, convert=convert)
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            with frame:
+                self.assertIs(frame.image, converted[-1])
+        self.assertEqual(len(converted), 3)
+        self.assertIsNone(source.ring.buffers)
+    
+    def test_pacing(self):
+        ''' Reads are paced to the source rate '''
+        source = SyntheticSource(16, 16, rate=50, max_frames=11)
+        start = time.monotonic()
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frame.release()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+    
+    @unittest.skipIf(cv2 is None, "OpenCV not installed")
+    def test_image_directory(self):
+        ''' Image directories play in name order as RGB '''
+        with TemporaryDirectory() as d:
+            for i in range(3):
+                bgr = np.zeros((8, 8, 3), dtype=np.uint8)
+                bgr[..., 0] = i * 10
+                cv2.imwrite(os.path.join(d, f"{i:03d}.png"), bgr)
+            source = VideoSource(d, rate=0)
+            blues = []
+            while True:
+                ret, frame = source.read()
+                if not ret:
+                    break
+                with frame:
+                    blues.append(int(frame.image[0, 0, 2]))
+            self.assertEqual(blues, [0, 10, 20])
@@ -0,0 +1,102 @@
+import unittest, random
+import numpy as np
+from ExpressionAppBridge.rtxtracking.head_position import HeadPositionEstimator, HEAD_LANDMARKS, POS_Z_SCALE, WARMUP_FRAMES
+from ExpressionAppBridge.rtxtracking.synthetic import LANDMARK_COUNT
+
+def face(cx, cy, size, width=1280, height=720, rng=None):
+    ''' pts array of a jawline half circle followed by a ring of inner landmarks '''
+    jaw = np.linspace(0, np.pi, HEAD_LANDMARKS)
+    inner = np.linspace(0, 2 * np.pi, LANDMARK_COUNT - HEAD_LANDMARKS, endpoint=False)
+    x = np.concatenate([cx + size * np.cos(jaw), cx + size * 0.5 * np.cos(inner)])
+    y = np.concatenate([cy + size * np.sin(jaw), cy + size * 0.5 * np.sin(inner)])
+    xy = np.stack([x, y], axis=-1)
+    if rng is not None:
+        xy = xy + rng.normal(0, 2, xy.shape)
+    return [width, height] + xy.ravel().tolist()
+
+class TestHeadPosition(unittest.TestCase):
+    def run_frames(self, estimator, frames, start=0):
+        head = np.zeros(6)
+        for i, pts in enumerate(frames):
+            estimator.update(pts, (start + i) / 60, head)
+        return head
+    
+    def test_warmup_center(self):
+        ''' Center is the average of the first frames, not the first frame alone '''
+        estimator = HeadPositionEstimator(drift_time=0)
+        frames = [face(640 + (10 if i == 0 else 0), 360, 200) for i in range(WARMUP_FRAMES)]
+        self.run_frames(estimator, frames)
+        head = self.run_frames(estimator, [face(640, 360, 200)], WARMUP_FRAMES)
+        self.assertAlmostEqual(head[3], -10 / WARMUP_FRAMES / 720 * 0.15)
+        
+        # Moving right, up and closer
+        head = self.run_frames(estimator, [face(712, 288, 220)], WARMUP_FRAMES + 1)
+        self.assertGreater(head[3], 0)
+        self.assertGreater(head[4], 0)
+        self.assertAlmostEqual(head[5], 0.1 * POS_Z_SCALE, places=3)
+    
+    def test_resolution(self):
+        ''' The same face framing gives the same position on any camera resolution '''
+        outputs = []
+        for scale in [1, 1.5]:
+            estimator = HeadPositionEstimator(drift_time=0, warmup=1)
+            self.run_frames(estimator, [face(640 * scale, 360 * scale, 200 * scale, 1280 * scale, 720 * scale)])
+            head = self.run_frames(estimator, [face(700 * scale, 330 * scale, 210 * scale, 1280 * scale, 720 * scale)], 1)
+            outputs.append(head[3:])
+        np.testing.assert_allclose(outputs[0], outputs[1])
+    
+    def test_jitter(self):
+        ''' Landmark noise averages out over all the landmarks '''
+        rng = np.random.default_rng(0)
+        estimator = HeadPositionEstimator(drift_time=0, warmup=1)
+        positions = []
+        for i in range(200):
+            head = self.run_frames(estimator, [face(640, 360, 200, rng=rng)], i)
+            positions.append(head[3:].copy())
+        # Two point estimate with the same noise moves about 2 / 720 * 0.15 / sqrt(2) on x and y
+        # and 2 * sqrt(2) / 400 * 0.15 on z
+        std = np.std(positions, axis=0)
+        self.assertLess(std[:2].max(), 0.00015)
+        self.assertLess(std[2], 0.0005)
+    
+    def test_drift_and_recenter(self):
+        ''' Center follows a new resting position and recenter takes a new one '''
+        estimator = HeadPositionEstimator(drift_time=1, warmup=1)
+        moved = [face(700, 360, 200) for i in range(300)]
+        self.run_frames(estimator, [face(640, 360, 200)])
+        head = self.run_frames(estimator, moved, 1)
+        self.assertLess(abs(head[3]), 1e-3)
+        
+        estimator = HeadPositionEstimator(drift_time=0, warmup=1)
+        self.run_frames(estimator, [face(640, 360, 200)])
+        self.assertGreater(self.run_frames(estimator, moved[:1], 1)[3], 0.01)
+        estimator.recenter()
+        self.assertEqual(self.run_frames(estimator, moved[:1], 2)[3], 0)
+    
+    def test_lost_tracking(self):
+        ''' Empty pts and landmarks without spread leave the position untouched '''
+        estimator = HeadPositionEstimator()
+        head = np.full(6, 5.0)
+        self.assertFalse(estimator.update([], 0, head))
+        self.assertFalse(estimator.update(None, 0, head))
+        self.assertFalse(estimator.update([1280, 720] + [0.0] * LANDMARK_COUNT * 2, 0, head))
+        self.assertFalse(estimator.update([1280, 720] + [100.0, 50.0] * LANDMARK_COUNT, 0, head))
+        self.assertEqual(head.tolist(), [5.0] * 6)
+        
+        # Nor do they move the center
+        self.assertTrue(estimator.update(face(640, 360, 200), 0, head))
+        self.assertTrue(np.all(np.isfinite(head)))
+        self.assertEqual(head[3:].tolist(), [0, 0, 0])
+    
+    def test_jawline(self):
+        ''' Only the jawline landmarks are used '''
+        estimator = HeadPositionEstimator(drift_time=0, warmup=1)
+        head = np.zeros(6)
+        estimator.update(face(640, 360, 200), 0, head)
+        moved = face(640, 360, 200)
+        moved[2 + HEAD_LANDMARKS * 2:] = [0.0] * (len(moved) - 2 - HEAD_LANDMARKS * 2)
+        estimator.update(moved, 1 / 60, head)
+        self.assertEqual(head[3:].tolist(), [0, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest, random, socket
+from ExpressionAppBridge.tracking_data import TrackingData, BLENDSHAPE_NAMES
+from ExpressionAppBridge.iFM import iFM_Data, parse_destination
+
+def reference_str(iFM):
+    ''' Reference iFM formatting, one value at a time '''
+    td = iFM.tracking_data
+    output = "|".join([f"{k}-{int(td.blendshapes[k])}" for k in BLENDSHAPE_NAMES])
+    output = output + "|=head#" + ",".join(["{:.6f}".format(x) for x in td.head])
+    if iFM.rightEye_enable:
+        output = output + "|rightEye#" + ",".join(["{:.6f}".format(x) for x in td.rightEye])
+    if iFM.leftEye_enable:
+        output = output + "|leftEye#" + ",".join(["{:.6f}".format(x) for x in td.leftEye])
+    return output + "|"
+
+class TestSerializer(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(1234)
+        self.td = TrackingData()
+        for k in BLENDSHAPE_NAMES:
+            self.td.blendshapes[k] = rng.uniform(-1, 101)
+        for i in range(6):
+            self.td.head[i] = rng.uniform(-180, 180)
+        for i in range(3):
+            self.td.rightEye[i] = rng.uniform(-30, 30)
+            self.td.leftEye[i] = rng.uniform(-30, 30)
+        self.iFM = iFM_Data(self.td)
+    def test_matches_reference(self):
+        ''' Serialized bytes match the per-value formatting '''
+        self.assertEqual(self.iFM.serialize(), reference_str(self.iFM).encode())
+        self.assertEqual(str(self.iFM), reference_str(self.iFM))
+    def test_eye_toggles(self):
+        ''' Disabling eyes recompiles the template '''
+        for right, left in [(False, True), (True, False), (False, False)]:
+            self.iFM.rightEye_enable = right
+            self.iFM.leftEye_enable = left
+            self.assertEqual(str(self.iFM), reference_str(self.iFM))
+    def test_large_values(self):
+        ''' Oversized values still serialize, earlier packets stay intact '''
+        first = self.iFM.serialize()
+        first_bytes = bytes(first)
+        self.td.head[:] = 1e300
+        self.assertEqual(str(self.iFM), reference_str(self.iFM))
+        self.assertEqual(first, first_bytes)
+
+class TestFanOut(unittest.TestCase):
+    def test_parse_destination(self):
+        dest = parse_destination("192.168.1.20:49983@30")
+        self.assertEqual(dest.addr, ("192.168.1.20", 49983))
+        self.assertAlmostEqual(dest.min_interval, 1/30)
+        dest = parse_destination("127.0.0.1:49983")
+        self.assertEqual(dest.min_interval, 0)
+    def test_resolve_once(self):
+        ''' Host names are stored as numeric addresses '''
+        dest = parse_destination("localhost:49983")
+        self.assertEqual(dest.addr, ("127.0.0.1", 49983))
+        self.assertEqual(dest.host, "localhost")
+        self.assertIn("localhost:49983", str(dest))
+        with self.assertRaises(ValueError):
+            parse_destination("invalid host name:49983")
+    def test_send_to_all(self):
+        ''' Every destination receives the same payload, rate limits are per destination '''
+        receivers = []
+        for i in range(2):
+            rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rx.bind(('127.0.0.1', 0))
+            rx.settimeout(1)
+            receivers.append(rx)
+        td = TrackingData()
+        td.confidence = 50
+        dests = [parse_destination(f"127.0.0.1:{rx.getsockname()[1]}") for rx in receivers]
+        dests[1].min_interval = 3600
+        iFM = iFM_Data(td, dests)
+        try:
+            for i in range(3):
+                self.assertTrue(iFM.udp_send())
+            expected = str(iFM).encode()
+            for i in range(3):
+                self.assertEqual(receivers[0].recv(4096), expected)
+            self.assertEqual(receivers[1].recv(4096), expected)
+            self.assertEqual((dests[0].sent, dests[0].skipped), (3, 0))
+            self.assertEqual((dests[1].sent, dests[1].skipped), (1, 2))
+            
+            # Low confidence frames are not sent
+            td.confidence = 0
+            self.assertFalse(iFM.udp_send())
+        finally:
+            iFM.close()
+            for rx in receivers:
+                rx.close()
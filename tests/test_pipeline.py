@@ -0,0 +1,44 @@
+import unittest, threading, time
+from ExpressionAppBridge.pipeline import LatestSlot, StageTimer
+
+class TestLatestSlot(unittest.TestCase):
+    def test_latest_only(self):
+        ''' Items not taken in time are replaced and counted as dropped '''
+        slot = LatestSlot()
+        slot.put(1)
+        slot.put(2)
+        slot.put(3)
+        self.assertEqual(slot.get(0), 3)
+        self.assertEqual(slot.dropped, 2)
+        self.assertEqual(slot.put_count, 3)
+        self.assertIsNone(slot.get(0))
+    
+    def test_wakeup(self):
+        ''' get blocks until an item arrives or the slot is closed '''
+        slot = LatestSlot()
+        got = []
+        reader = threading.Thread(target=lambda: got.append(slot.get(5)))
+        reader.start()
+        time.sleep(0.05)
+        slot.put('frame')
+        reader.join(5)
+        self.assertEqual(got, ['frame'])
+        
+        reader = threading.Thread(target=lambda: got.append(slot.get(5)))
+        reader.start()
+        slot.close()
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+        self.assertEqual(got, ['frame', None])
+
+class TestStageTimer(unittest.TestCase):
+    def test_record(self):
+        ''' Durations and run rate are tracked per stage '''
+        timer = StageTimer('detect')
+        for i in range(10):
+            timer.record(i / 30, i / 30 + 0.01)
+        s = timer.durations.summary()
+        self.assertEqual(s['count'], 10)
+        self.assertAlmostEqual(s['mean'], 0.01)
+        self.assertAlmostEqual(timer.fps(), 30)
+        self.assertIn('detect', str(timer))
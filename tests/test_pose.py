@@ -0,0 +1,136 @@
+import unittest, json, math, os
+import numpy as np
+from ExpressionAppBridge.mediapipe.pose import euler_sxyz, head_pose, matrix_pose, rotation_block
+
+try:
+    import transforms3d
+except ImportError:
+    transforms3d = None
+
+def rx(a):
+    c, s = math.cos(a), math.sin(a)
+    return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+
+def ry(a):
+    c, s = math.cos(a), math.sin(a)
+    return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+def rz(a):
+    c, s = math.cos(a), math.sin(a)
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+def affine(angles, translation, scale=(1, 1, 1)):
+    m = np.eye(4)
+    m[:3, :3] = rz(angles[2]) @ ry(angles[1]) @ rx(angles[0]) @ np.diag(scale)
+    m[:3, 3] = translation
+    return m
+
+# Matrices and the poses transforms3d gives for them. Written by write_reference
+REFERENCE = os.path.join(os.path.dirname(__file__), "pose_reference.json")
+
+def reference_matrices():
+    ''' Scaled, mirrored, sheared and gimbal locked affine matrices '''
+    rng = np.random.default_rng(7)
+    matrices = [affine(rng.uniform(-3, 3, 3), rng.uniform(-20, 20, 3), rng.uniform(-2, 2, 3)) for _ in range(40)]
+    for y in [math.pi / 2, -math.pi / 2]:
+        matrices.append(affine((0.3, y, -0.6), rng.uniform(-20, 20, 3), rng.uniform(0.5, 2, 3)))
+    for _ in range(8):
+        m = affine(rng.uniform(-1, 1, 3), rng.uniform(-20, 20, 3), rng.uniform(0.5, 2, 3))
+        m[:3, :3] = m[:3, :3] @ np.array([[1, rng.uniform(-0.3, 0.3), 0], [0, 1, rng.uniform(-0.3, 0.3)], [0, 0, 1]])
+        matrices.append(m)
+    return matrices
+
+def write_reference(path=REFERENCE):
+    ''' Regenerate the reference file. Needs transforms3d '''
+    import transforms3d
+    entries = []
+    for m in reference_matrices():
+        translation, rotation, _, _ = transforms3d.affines.decompose(m)
+        entries.append({
+            "matrix": m.tolist(),
+            "translation": translation.tolist(),
+            "angles": list(transforms3d.euler.mat2euler(rotation))
+        })
+    with open(path, "w") as f:
+        f.write("[\n" + ",\n".join(json.dumps(e) for e in entries) + "\n]\n")
+
+class TestPose(unittest.TestCase):
+    def test_round_trip(self):
+        ''' Angles and translation come back out of a scaled affine matrix '''
+        rng = np.random.default_rng(3)
+        for _ in range(50):
+            angles = rng.uniform(-1.4, 1.4, 3)
+            translation = rng.uniform(-20, 20, 3)
+            m = affine(angles, translation, rng.uniform(0.5, 2, 3))
+            t, r = head_pose(m)
+            np.testing.assert_allclose(t, translation)
+            np.testing.assert_allclose(r, angles, atol=1e-9)
+
+    def test_stack(self):
+        ''' Stacks of matrices give stacks of poses matching the single matrix results '''
+        rng = np.random.default_rng(5)
+        m = np.array([[affine(rng.uniform(-1, 1, 3), rng.uniform(-5, 5, 3)) for _ in range(7)] for _ in range(2)])
+        t, r = head_pose(m)
+        self.assertEqual(t.shape, (2, 7, 3))
+        self.assertEqual(r.shape, (2, 7, 3))
+        for i in range(2):
+            for j in range(7):
+                ti, ri = head_pose(m[i, j])
+                np.testing.assert_allclose(t[i, j], ti)
+                np.testing.assert_allclose(r[i, j], ri)
+
+    def test_orthonormal(self):
+        ''' Shear and negative scale are removed from the rotation block '''
+        m = affine((0.3, -0.2, 0.1), (0, 0, 0), (-1.5, 1, 2))
+        m[0, 1] = m[0, 1] + 0.2
+        r = rotation_block(m)
+        np.testing.assert_allclose(r @ r.T, np.eye(3), atol=1e-12)
+        self.assertAlmostEqual(np.linalg.det(r), 1)
+
+    def test_gimbal(self):
+        ''' At +-90 degrees of y the x and z rotations fold into x '''
+        r = euler_sxyz(rz(0.4) @ ry(math.pi / 2) @ rx(0.1))
+        self.assertAlmostEqual(r[1], math.pi / 2)
+        self.assertEqual(r[2], 0)
+        np.testing.assert_allclose(euler_sxyz(rz(r[2]) @ ry(r[1]) @ rx(r[0])), r, atol=1e-12)
+
+    def test_reference(self):
+        ''' Same results as transforms3d decompose and mat2euler on the stored reference poses '''
+        with open(REFERENCE) as f:
+            entries = json.load(f)
+        matrices = np.array([e['matrix'] for e in entries])
+        t, r = head_pose(matrices)
+        np.testing.assert_allclose(t, [e['translation'] for e in entries])
+        np.testing.assert_allclose(r, [e['angles'] for e in entries], atol=1e-9)
+        for e in entries:
+            t, r = matrix_pose(np.array(e['matrix']))
+            np.testing.assert_allclose(t, e['translation'])
+            np.testing.assert_allclose(r, e['angles'], atol=1e-9)
+
+    def test_matrix_pose(self):
+        ''' The single matrix path matches the numpy one, degenerate matrices included '''
+        rng = np.random.default_rng(9)
+        for _ in range(200):
+            m = affine(rng.uniform(-3, 3, 3), rng.uniform(-20, 20, 3), rng.uniform(-2, 2, 3))
+            t, r = head_pose(m)
+            ts, rs = matrix_pose(m)
+            np.testing.assert_allclose(ts, t)
+            np.testing.assert_allclose(rs, r, atol=1e-12)
+        m = affine((0.4, math.pi / 2, 0.1), (1, 2, 3))
+        np.testing.assert_allclose(matrix_pose(m)[1], head_pose(m)[1], atol=1e-12)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.testing.assert_allclose(matrix_pose(np.zeros((4, 4)))[1], head_pose(np.zeros((4, 4)))[1])
+
+    @unittest.skipIf(transforms3d is None, "transforms3d not installed")
+    def test_transforms3d(self):
+        ''' Same results as transforms3d decompose and mat2euler '''
+        rng = np.random.default_rng(7)
+        for _ in range(50):
+            m = affine(rng.uniform(-3, 3, 3), rng.uniform(-20, 20, 3), rng.uniform(-2, 2, 3))
+            decomposed = transforms3d.affines.decompose(m)
+            t, r = head_pose(m)
+            np.testing.assert_allclose(t, decomposed[0])
+            np.testing.assert_allclose(r, transforms3d.euler.mat2euler(decomposed[1]), atol=1e-9)
+
+if __name__ == '__main__':
+    unittest.main()
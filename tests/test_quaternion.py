@@ -0,0 +1,53 @@
+import unittest, math
+import numpy as np
+from ExpressionAppBridge import quaternion
+
+class TestQuaternion(unittest.TestCase):
+    def test_batch_euler(self):
+        ''' Batch conversion matches euler_from_quaternion on every quaternion '''
+        q = quaternion.normalize(np.random.default_rng(0).normal(size=(200, 4)))
+        angles = quaternion.eulers_from_quaternions(q)
+        self.assertEqual(angles.shape, (200, 3))
+        for qi, ai in zip(q, angles):
+            np.testing.assert_allclose(ai, quaternion.euler_from_quaternion(*qi), atol=1e-9)
+    
+    def test_round_trip(self):
+        ''' Euler angles come back out of their quaternions '''
+        rng = np.random.default_rng(1)
+        angles = np.stack([rng.uniform(-179, 179, 100), rng.uniform(-89, 89, 100), rng.uniform(-179, 179, 100)], axis=-1)
+        q = quaternion.quaternions_from_eulers(angles)
+        np.testing.assert_allclose(np.linalg.norm(q, axis=-1), 1)
+        np.testing.assert_allclose(quaternion.eulers_from_quaternions(q), angles, atol=1e-9)
+    
+    def test_average(self):
+        ''' Average ignores the sign of each quaternion '''
+        q = quaternion.quaternions_from_eulers([[0, 0, 10], [0, 0, 20], [0, 0, 30]])
+        q[1] = -q[1]
+        np.testing.assert_allclose(quaternion.eulers_from_quaternions(quaternion.average(q)), [0, 0, 20], atol=1e-9)
+        weighted = quaternion.average(q, [1, 0, 1])
+        np.testing.assert_allclose(quaternion.eulers_from_quaternions(weighted), [0, 0, 20], atol=1e-9)
+    
+    def test_slerp(self):
+        ''' slerp goes along the shorter arc at constant speed '''
+        q0 = quaternion.quaternions_from_eulers([0, 0, 170])
+        q1 = quaternion.quaternions_from_eulers([0, 0, -170])
+        t = np.linspace(0, 1, 5)
+        out = quaternion.slerp(q0, q1, t)
+        yaw = quaternion.eulers_from_quaternions(out)[:, 2]
+        np.testing.assert_allclose(np.mod(yaw, 360), [170, 175, 180, 185, 190], atol=1e-9)
+        
+        # Equal rotations do not divide by zero
+        np.testing.assert_allclose(quaternion.slerp(q0, q0, 0.5), q0)
+
+    def test_scalar(self):
+        ''' Single quaternion helpers match the batch ones '''
+        rng = np.random.default_rng(2)
+        for _ in range(20):
+            angles = rng.uniform(-80, 80, 3)
+            q = quaternion.quaternion_from_euler(*angles)
+            np.testing.assert_allclose(q, quaternion.quaternions_from_eulers(angles), atol=1e-12)
+            q1 = quaternion.quaternion_from_euler(*rng.uniform(-80, 80, 3))
+            np.testing.assert_allclose(quaternion.slerp_quaternion(q, q1, 0.3), quaternion.slerp(q, q1, 0.3), atol=1e-9)
+
+if __name__ == '__main__':
+    unittest.main()
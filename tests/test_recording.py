@@ -0,0 +1,180 @@
+import unittest, json, os, time
+from tempfile import TemporaryDirectory
+import numpy as np
+from ExpressionAppBridge import calfit
+from ExpressionAppBridge.cal import TrackingInput
+from ExpressionAppBridge.recording import APPEND_GAP, HEADER_SIZE, Recorder, Recording, record_dtype, recordingPath, replay, replay_into
+from ExpressionAppBridge.rtxtracking.ExpressionApp import ExpressionAppRunner
+from ExpressionAppBridge.rtxtracking.synthetic import synthetic_packets, calibration_frame, encode_packet
+from ExpressionAppBridge.tracking_data import BLENDSHAPE_COUNT, TrackingData
+
+class FakeiFM:
+    ''' Collects the frames that would be sent '''
+    def __init__(self, tracking_data):
+        self.tracking_data = tracking_data
+        self.frames = []
+    def udp_send(self):
+        self.frames.append(self.tracking_data.buffer.copy())
+
+class TestRecording(unittest.TestCase):
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.prefix = os.path.join(self.dir.name, "session")
+    def tearDown(self):
+        self.dir.cleanup()
+    
+    def runner(self, name):
+        td = TrackingData()
+        cal = TrackingInput(td, os.path.join(self.dir.name, f"{name}.json"))
+        return td, cal, ExpressionAppRunner(cal, {}, {})
+    
+    def record_session(self, packets):
+        ''' Run packets through a recording runner. Returns the calibrated frames '''
+        td, cal, runner = self.runner("live")
+        raw = Recorder(recordingPath(self.prefix, 'raw'), 'raw', 'rtx')
+        runner.startRecording(raw)
+        cal.startRecording(Recorder(recordingPath(self.prefix, 'parsed'), 'parsed', 'rtx'), Recorder(recordingPath(self.prefix, 'output'), 'output', 'rtx'))
+        cal.recorders.append(raw)
+        frames = []
+        cal.add_listener(lambda: frames.append(td.buffer.copy()))
+        for i, message in enumerate(packets):
+            runner.onMessage(message)
+        cal.close()
+        return np.array(frames)
+    
+    def test_taps(self):
+        ''' Every tap gets a fixed size record per frame '''
+        packets = synthetic_packets(30)
+        frames = self.record_session(packets)
+        for tap in ['raw', 'parsed', 'output']:
+            path = recordingPath(self.prefix, tap)
+            self.assertEqual(os.path.getsize(path), HEADER_SIZE + 30 * record_dtype(tap).itemsize)
+            recording = Recording(path)
+            self.assertEqual((recording.tap, recording.mode, len(recording)), (tap, 'rtx', 30))
+            self.assertEqual(recording.records['seq'].tolist(), list(range(30)))
+            self.assertTrue(np.all(np.diff(recording.records['timestamp']) >= 0))
+        
+        raw = Recording(recordingPath(self.prefix, 'raw'))
+        self.assertEqual([raw.message(i) for i in range(30)], packets)
+        output = Recording(recordingPath(self.prefix, 'output'))
+        np.testing.assert_allclose(output.values(), frames, rtol=1e-6, atol=1e-4)
+        self.assertEqual(output.records['channels'][0, 0], 45)
+    
+    def test_replay(self):
+        ''' Raw and parsed replays reproduce the recorded output '''
+        frames = self.record_session(synthetic_packets(30))
+        
+        # Calibration answers on a raw recording are not replayed
+        raw = Recorder(recordingPath(self.prefix, 'raw'), 'raw')
+        raw.write_raw(encode_packet(calibration_frame([0.5])))
+        raw.close()
+        
+        for tap in ['raw', 'parsed']:
+            td, cal, runner = self.runner(tap)
+            runner.saveCal = self.fail
+            iFM = FakeiFM(td)
+            count = replay_into(Recording(recordingPath(self.prefix, tap)), cal, iFM, runner, 0)
+            cal.close()
+            self.assertEqual(len(iFM.frames), 30, tap)
+            # Head position restarts its center and parsed values went through float32
+            np.testing.assert_allclose(np.array(iFM.frames)[:, :BLENDSHAPE_COUNT], frames[:, :BLENDSHAPE_COUNT], atol=1e-3, err_msg=tap)
+    
+    def test_replay_timestamps(self):
+        ''' Time based filters give the live output on replays at any speed '''
+        one_euro = {"type": "oneEuro", "minCutoff": 1.0, "beta": 0.01}
+        config = {"filters": {"headRotation": one_euro, "blendshapes": {name: one_euro for name in ["jawOpen", "eyeBlink_L"]}}}
+        for name in ["live", "raw", "parsed"]:
+            with open(os.path.join(self.dir.name, f"{name}.json"), "w") as f:
+                json.dump(config, f)
+        packets = synthetic_packets(30)
+        td, cal, runner = self.runner("live")
+        runner.startRecording(Recorder(recordingPath(self.prefix, 'raw'), 'raw', 'rtx'))
+        cal.startRecording(Recorder(recordingPath(self.prefix, 'parsed'), 'parsed', 'rtx'))
+        frames = []
+        cal.add_listener(lambda: frames.append(td.buffer.copy()))
+        for message in packets:
+            runner.onMessage(message)
+            time.sleep(0.005)
+        cal.close()
+        
+        for tap in ['raw', 'parsed']:
+            td, cal, runner = self.runner(tap)
+            iFM = FakeiFM(td)
+            replay_into(Recording(recordingPath(self.prefix, tap)), cal, iFM, runner, 0)
+            cal.close()
+            np.testing.assert_allclose(np.array(iFM.frames)[:, :BLENDSHAPE_COUNT + 3], np.array(frames)[:, :BLENDSHAPE_COUNT + 3], atol=1e-3, err_msg=tap)
+    
+    def test_parsed_rotation(self):
+        ''' Parsed records keep the tracker quaternion, so quaternion filters replay like the live run '''
+        config = {"filters": {"headRotation": {"type": "quatAvg", "window": 5}}}
+        for name in ["live", "parsed"]:
+            with open(os.path.join(self.dir.name, f"{name}.json"), "w") as f:
+                json.dump(config, f)
+        td, cal, runner = self.runner("live")
+        cal.startRecording(Recorder(recordingPath(self.prefix, 'parsed'), 'parsed', 'rtx'))
+        frames = []
+        cal.add_listener(lambda: frames.append(td.buffer.copy()))
+        for message in synthetic_packets(30):
+            runner.onMessage(message)
+        cal.close()
+        
+        recording = Recording(recordingPath(self.prefix, 'parsed'))
+        self.assertTrue(np.all(recording.records['has_rotation']))
+        loaded = TrackingData()
+        recording.load(0, loaded)
+        self.assertEqual(len(loaded.rotation), 4)
+        
+        td, cal, runner = self.runner("parsed")
+        iFM = FakeiFM(td)
+        replay_into(recording, cal, iFM, runner, 0)
+        cal.close()
+        rot = slice(BLENDSHAPE_COUNT, BLENDSHAPE_COUNT + 3)
+        np.testing.assert_allclose(np.array(iFM.frames)[:, rot], np.array(frames)[:, rot], atol=1e-9)
+    
+    def test_append(self):
+        ''' Appending continues the sequence and timestamps and drops a partial record '''
+        path = recordingPath(self.prefix, 'parsed')
+        td = TrackingData()
+        recorder = Recorder(path, 'parsed')
+        for i in range(3):
+            td.buffer[0] = i
+            recorder.write_tracking(td, i)
+        recorder.close()
+        with open(path, 'ab') as f:
+            f.write(b'\x01' * 10)
+        self.assertEqual(len(Recording(path)), 3)
+        
+        # Timestamps from another process start anywhere. They go APPEND_GAP after the last record
+        recorder = Recorder(path, 'parsed')
+        recorder.write_tracking(td, 1000)
+        recorder.write_tracking(td, 1000.5)
+        recorder.close()
+        recording = Recording(path)
+        self.assertEqual(recording.records['seq'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(recording.values()[:, 0].tolist(), [0, 1, 2, 2, 2])
+        self.assertEqual(recording.records['timestamp'].tolist(), [0, 1, 2, 2 + APPEND_GAP, 2.5 + APPEND_GAP])
+        with self.assertRaises(ValueError):
+            Recorder(path, 'output')
+    
+    def test_pacing(self):
+        ''' Replay follows the recorded timestamps scaled by speed '''
+        path = recordingPath(self.prefix, 'output')
+        recorder = Recorder(path, 'output')
+        for i in range(5):
+            recorder.write_tracking(TrackingData(), 100 + i * 0.05)
+        recorder.close()
+        times = []
+        start = time.monotonic()
+        replay(Recording(path), lambda i: times.append(time.monotonic() - start), 2)
+        self.assertAlmostEqual(times[-1], 0.1, delta=0.05)
+    
+    def test_calfit(self):
+        ''' calfit reads parsed recordings '''
+        self.record_session(synthetic_packets(20))
+        values = calfit.load_session(recordingPath(self.prefix, 'parsed'))
+        self.assertEqual(values.shape, (20, BLENDSHAPE_COUNT))
+        with self.assertRaises(ValueError):
+            calfit.load_session(recordingPath(self.prefix, 'raw'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from ExpressionAppBridge.timing import IntervalStats, DeadlineClock
+
+class TestDeadlineClock(unittest.TestCase):
+    def test_fixed_rate(self):
+        ''' Processing time does not push the deadlines back '''
+        clock = DeadlineClock(50)
+        self.assertAlmostEqual(clock.next_delay(0.0), 0.02)
+        # Woke up late and spent time processing
+        self.assertAlmostEqual(clock.next_delay(0.025), 0.015)
+        self.assertAlmostEqual(clock.deadline, 0.04)
+        self.assertEqual(clock.stats.missed, 0)
+    def test_skip_when_behind(self):
+        ''' Missed deadlines are skipped and counted, not bursted '''
+        clock = DeadlineClock(100)
+        clock.next_delay(0.0)
+        delay = clock.next_delay(0.055)
+        self.assertEqual(clock.stats.missed, 4)
+        self.assertAlmostEqual(clock.deadline, 0.06)
+        self.assertAlmostEqual(delay, 0.005)
+
+class TestIntervalStats(unittest.TestCase):
+    def test_summary(self):
+        stats = IntervalStats()
+        for t in [0, 0.01, 0.02, 0.05]:
+            stats.mark(t)
+        summary = stats.summary()
+        self.assertEqual(summary['count'], 3)
+        self.assertAlmostEqual(summary['mean'], 0.05 / 3)
+        self.assertAlmostEqual(summary['max'], 0.03)
+        self.assertAlmostEqual(summary['p99'], 0.03)
@@ -0,0 +1,52 @@
+import unittest
+from ExpressionAppBridge import tracking_data
+from ExpressionAppBridge.tracking_data import TrackingData, BLENDSHAPE_NAMES, BLENDSHAPE_INDEX
+
+class TestTrackingData(unittest.TestCase):
+    def test_layout(self):
+        ''' Blendshapes, head and eyes share a single buffer in iFM output order '''
+        td = TrackingData()
+        self.assertEqual(len(td.buffer), tracking_data.BUFFER_SIZE)
+        self.assertEqual(len(BLENDSHAPE_NAMES), 52)
+        self.assertEqual(BLENDSHAPE_NAMES[0], "browInnerUp")
+        self.assertEqual(BLENDSHAPE_NAMES[-1], "tongueOut")
+
+        # Views write through to the buffer
+        td.head[3] = 1.5
+        td.rightEye[1] = 2.5
+        td.leftEye[1] = 3.5
+        self.assertEqual(td.buffer[tracking_data.HEAD_SLICE][3], 1.5)
+        self.assertEqual(td.buffer[tracking_data.RIGHT_EYE_SLICE][1], 2.5)
+        self.assertEqual(td.buffer[tracking_data.LEFT_EYE_SLICE][1], 3.5)
+
+    def test_perfect_sync_blendshapes(self):
+        ''' Every blendshape but tongueOut takes calibration entries, in iFM order '''
+        self.assertEqual(tracking_data.PERFECT_SYNC_BLENDSHAPES, BLENDSHAPE_NAMES[:-1])
+        self.assertEqual(set(tracking_data.EXP_IDX_TO_PERFECT_SYNC), set(tracking_data.PERFECT_SYNC_BLENDSHAPES))
+
+    def test_blendshape_view(self):
+        ''' The by-name view reads and writes the blendshape slots '''
+        td = TrackingData()
+        td.blendshapes['jawOpen'] = 42
+        self.assertEqual(td.blendshape_values[BLENDSHAPE_INDEX['jawOpen']], 42)
+        self.assertEqual(td.blendshapes['jawOpen'], 42)
+        self.assertEqual(td.blendshapes.get('invalid'), None)
+        self.assertIn('jawOpen', td.blendshapes)
+        self.assertEqual(list(td.blendshapes.keys()), BLENDSHAPE_NAMES)
+        self.assertEqual(dict(td.blendshapes.items())['jawOpen'], 42)
+
+    def test_copy_from(self):
+        ''' copy_from copies every value plus confidence '''
+        src = TrackingData()
+        src.blendshapes['eyeBlink_L'] = 10
+        src.head[0] = 5
+        src.confidence = 30
+        dst = TrackingData()
+        dst.copy_from(src)
+        self.assertEqual(dst.blendshapes['eyeBlink_L'], 10)
+        self.assertEqual(dst.head[0], 5)
+        self.assertEqual(dst.confidence, 30)
+
+        # Storage is not shared
+        src.head[0] = 6
+        self.assertEqual(dst.head[0], 5)